@@ -1,16 +1,21 @@
 import tkinter as tk
-from tkinter import filedialog, messagebox, scrolledtext, Canvas
-import fitz  # PyMuPDF
-import requests
-import json
-import base64
-from PIL import Image, ImageTk
-import io
+from tkinter import filedialog, messagebox, scrolledtext
 import os
-import subprocess
-import time
+import queue
 import threading
-from fpdf import FPDF  # Добавляем для экспорта в PDF
+import report  # Отчет в PDF/JSON и пометки на чертеже
+import engine  # Движок проверки без GUI (извлечение и анализ)
+import findings
+import gost_index  # Пункты ГОСТ из docs/ для промпта
+import ollama_client
+import result_cache
+import revisions
+import scheduler  # Очередь проверок с приоритетами и отменой
+import service  # Общий сервер проверки (режим тонкого клиента)
+import spans
+import viewer  # Миниатюры листов и просмотр плитками
+from document import DocumentSession
+from image_pipeline import ImagePipelineConfig
 
 class DrawingCheckerApp:
     def __init__(self, root):
@@ -19,10 +24,22 @@ class DrawingCheckerApp:
         self.root.geometry("1200x800")  # Увеличили размер для preview
         
         # Инициализируем атрибуты
-        self.ollama_url = "http://localhost:11434"
+        # Серверы Ollama: несколько адресов через запятую - запросы распределяются между ними
+        self.ollama_url = os.environ.get("DRAWING_CHECKER_OLLAMA", engine.OLLAMA_URL)
+        self.ollama = ollama_client.OllamaClient(self.ollama_url)  # Общий пул соединений
         self.is_ollama_running = False
-        self.current_check_thread = None
-        self.stop_check = False
+        # Очередь проверок: быстрые раньше полных, не больше max_concurrent одновременно
+        self.scheduler = scheduler.JobScheduler(self._run_job)
+        self.job_logs = {}  # id задания -> журнал (прогресс и результат) для поля результатов
+        self.job_ids = []  # id заданий в порядке строк списка
+        self.streamed_jobs = set()
+        self.view_job_id = None  # задание, показанное в поле результатов
+        self.loaded_paths = []
+        self.service_client = None  # Клиент сервера проверки, если он задан
+        self.result_cache = result_cache.ResultCache()
+        self.revision_store = revisions.RevisionStore()  # прошлые проверки по обозначениям
+        self.image_config = ImagePipelineConfig()  # Области листа, dpi и бюджет изображений
+        self.gost_index = None  # Индекс пунктов ГОСТ (загружается в фоне)
         
         # Оптимизированные модели
         self.fast_models = [
@@ -41,22 +58,65 @@ class DrawingCheckerApp:
         self.create_widgets()
         
         self.root.after(1000, self.auto_check_ollama)
+        self.root.after(100, self._poll_events)
+        threading.Thread(target=self._load_gost_index, daemon=True).start()
         
     def auto_check_ollama(self):
+        if self._service_url():
+            self.is_ollama_running = self.test_connection()
+            self.status_label.config(text="Статус: Сервер проверки подключен" if self.is_ollama_running
+                                     else "Статус: Сервер проверки не доступен")
+            return
         if self.test_connection():
-            self.status_label.config(text="Статус: Ollama подключен")
+            self.status_label.config(text=self._ollama_status())
             self.is_ollama_running = True
             self.update_model_info()
+            self.warm_up_model(self.model_var.get())
         else:
             self.status_label.config(text="Статус: Ollama не запущен")
             self.is_ollama_running = False
     
-    def test_connection(self):
+    def _load_gost_index(self):
+        """Индекс ГОСТ с диска или из PDF в docs/; модель эмбеддингов - DRAWING_CHECKER_EMBED_MODEL"""
         try:
-            response = requests.get(f"{self.ollama_url}/api/tags", timeout=5)
-            return response.status_code == 200
-        except:
-            return False
+            index = gost_index.GostIndex.load_or_build(
+                embed_model=os.environ.get("DRAWING_CHECKER_EMBED_MODEL"), client=self.ollama)
+        except Exception:
+            index = None
+        self.gost_index = index
+        if index is not None:
+            self.root.after(0, lambda: self.status_label.config(
+                text=f"Статус: Пунктов ГОСТ в индексе: {len(index)}"))
+    
+    def test_connection(self):
+        if self._service_url():
+            return self._service().is_available()
+        return self.ollama.is_available()
+    
+    def _service_url(self):
+        return self.service_var.get().strip()
+    
+    def _service(self):
+        """Клиент сервера проверки из поля "Сервер проверки" (пересоздается при смене адреса)"""
+        url = self._service_url()
+        if self.service_client is None or self.service_client.service_url != url.rstrip("/"):
+            self.service_client = service.ServiceClient(url)
+        return self.service_client
+    
+    def warm_up_model(self, model):
+        """Загружает модель в память Ollama в фоне, чтобы проверка не ждала загрузки"""
+        if not self.is_ollama_running or self._service_url():
+            return  # на сервере проверки модели уже прогреты
+        self.ollama.keep_alive = self.keep_alive_var.get()
+        self.model_info.config(text=f"Загружается модель {model}...")
+        self.ollama.warm_up_async(
+            model, lambda name, result: self.root.after(0, self._warm_up_done, name, result))
+    
+    def _warm_up_done(self, model, result):
+        if isinstance(result, str):
+            self.model_info.config(text=f"{model}: {result}")
+        else:
+            self.model_info.config(text=f"Модель {model} загружена за {result:.1f} с")
     
     def create_widgets(self):
         # Заголовок
@@ -71,13 +131,15 @@ class DrawingCheckerApp:
         # Выбор модели (текстовые)
         tk.Label(settings_frame, text="Текстовая модель:").grid(row=0, column=0, padx=5)
         self.model_var = tk.StringVar(value="llama2:3b")
-        model_menu = tk.OptionMenu(settings_frame, self.model_var, *self.fast_models)
+        model_menu = tk.OptionMenu(settings_frame, self.model_var, *self.fast_models,
+                                   command=self.warm_up_model)
         model_menu.grid(row=0, column=1, padx=5)
         
         # Выбор модели для vision
         tk.Label(settings_frame, text="Vision модель:").grid(row=1, column=0, padx=5)
         self.vision_model_var = tk.StringVar(value="llava:7b")
-        vision_menu = tk.OptionMenu(settings_frame, self.vision_model_var, *self.vision_models)
+        vision_menu = tk.OptionMenu(settings_frame, self.vision_model_var, *self.vision_models,
+                                    command=self.warm_up_model)
         vision_menu.grid(row=1, column=1, padx=5)
         
         # Кнопка проверки подключения
@@ -85,21 +147,65 @@ class DrawingCheckerApp:
                                  command=self.test_connection_ui)
         self.test_btn.grid(row=0, column=2, padx=10)
         
-        # Кнопка остановки проверки
-        self.stop_btn = tk.Button(settings_frame, text="Остановить проверку", 
+        # Кнопка остановки всех проверок
+        self.stop_btn = tk.Button(settings_frame, text="Остановить проверки", 
                                  command=self.stop_checking,
                                  state=tk.DISABLED)
         self.stop_btn.grid(row=0, column=3, padx=10)
         
+        # Кэш результатов
+        self.use_cache_var = tk.BooleanVar(value=True)
+        tk.Checkbutton(settings_frame, text="Кэш результатов", 
+                       variable=self.use_cache_var).grid(row=1, column=2, padx=10)
+        tk.Button(settings_frame, text="Очистить кэш", 
+                  command=self.clear_cache).grid(row=1, column=3, padx=10)
+        
+        # Потоковый вывод ответа модели
+        self.stream_var = tk.BooleanVar(value=True)
+        tk.Checkbutton(settings_frame, text="Потоковый вывод", 
+                       variable=self.stream_var).grid(row=0, column=4, padx=10)
+        
+        # Постраничная проверка: листы отдельными запросами, несколько одновременно
+        self.page_mode_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(settings_frame, text="Постранично", 
+                       variable=self.page_mode_var).grid(row=1, column=4, padx=10)
+        tk.Label(settings_frame, text="Параллельно листов:").grid(row=0, column=5, padx=5)
+        self.num_parallel_var = tk.IntVar(value=int(os.environ.get("OLLAMA_NUM_PARALLEL", "2")))
+        tk.Spinbox(settings_frame, from_=1, to=8, width=3,
+                   textvariable=self.num_parallel_var).grid(row=0, column=6, padx=5)
+        
+        # Сколько Ollama держит модель в памяти (keep_alive): 30m, 2h, -1 - всегда
+        tk.Label(settings_frame, text="Держать модель:").grid(row=1, column=5, padx=5)
+        self.keep_alive_var = tk.StringVar(value=ollama_client.DEFAULT_KEEP_ALIVE)
+        tk.Entry(settings_frame, textvariable=self.keep_alive_var, 
+                 width=5).grid(row=1, column=6, padx=5)
+        
+        # Сколько чертежей проверяется одновременно (остальные ждут в очереди)
+        tk.Label(settings_frame, text="Проверок одновременно:").grid(row=0, column=7, padx=5)
+        self.max_checks_var = tk.IntVar(value=scheduler.default_concurrency(len(self.ollama.endpoints)))
+        tk.Spinbox(settings_frame, from_=1, to=16, width=3, textvariable=self.max_checks_var,
+                   command=self.set_concurrency).grid(row=0, column=8, padx=5)
+        
+        # Общий сервер проверки (service.py): проверки выполняются на нем, а не в локальном Ollama
+        tk.Label(settings_frame, text="Сервер проверки:").grid(row=1, column=7, padx=5)
+        self.service_var = tk.StringVar(value=os.environ.get("DRAWING_CHECKER_SERVICE", ""))
+        tk.Entry(settings_frame, textvariable=self.service_var, 
+                 width=22).grid(row=1, column=8, padx=5)
+        
+        # Повторная проверка: модели отправляются только листы, изменившиеся с прошлой проверки
+        self.incremental_var = tk.BooleanVar(value=True)
+        tk.Checkbutton(settings_frame, text="Только измененные листы", 
+                       variable=self.incremental_var).grid(row=0, column=9, padx=10)
+        
         # Информация о моделях
         self.model_info = tk.Label(settings_frame, text="", fg="blue", font=("Arial", 8))
-        self.model_info.grid(row=2, column=0, columnspan=4, pady=2)
+        self.model_info.grid(row=2, column=0, columnspan=9, pady=2)
         
         # Прогресс
         self.progress = tk.Label(self.root, text="", fg="green")
         self.progress.pack(pady=2)
         
-        # Кнопка загрузки
+        # Кнопка загрузки (можно выбрать несколько файлов)
         self.upload_btn = tk.Button(self.root, text="Загрузить PDF", 
                                    command=self.upload_pdf,
                                    font=("Arial", 12))
@@ -110,8 +216,8 @@ class DrawingCheckerApp:
         self.preview_frame.pack(pady=5)
         
         tk.Label(self.preview_frame, text="Предпросмотр PDF:").pack()
-        self.preview_canvas = Canvas(self.preview_frame, width=400, height=300, bg="white")
-        self.preview_canvas.pack()
+        self.preview = viewer.PreviewPanel(self.preview_frame, width=480, height=300)
+        self.preview.pack()
         
         # Кнопка проверки
         self.check_btn = tk.Button(self.root, text="Проверить чертеж (полная)", 
@@ -128,6 +234,14 @@ class DrawingCheckerApp:
                                         bg="lightgreen")
         self.quick_check_btn.pack(pady=2)
         
+        # Каскадная проверка: легкая текстовая модель, vision-модель только для графики и сомнительного
+        self.cascade_check_btn = tk.Button(self.root, text="Каскадная проверка", 
+                                          command=self.cascade_check_drawing,
+                                          font=("Arial", 10),
+                                          state=tk.DISABLED,
+                                          bg="lightblue")
+        self.cascade_check_btn.pack(pady=2)
+        
         # Кнопка экспорта
         self.export_btn = tk.Button(self.root, text="Сохранить отчет", 
                                    command=self.export_report,
@@ -135,6 +249,23 @@ class DrawingCheckerApp:
                                    state=tk.DISABLED)
         self.export_btn.pack(pady=5)
         
+        # Копия чертежа с замечаниями-аннотациями на листах
+        self.annotate_btn = tk.Button(self.root, text="Пометки на чертеже", 
+                                     command=self.export_annotated,
+                                     font=("Arial", 10),
+                                     state=tk.DISABLED)
+        self.annotate_btn.pack(pady=2)
+        
+        # Очередь проверок: выбор задания показывает его результат
+        queue_frame = tk.Frame(self.root)
+        queue_frame.pack(pady=2, padx=10, fill=tk.X)
+        tk.Label(queue_frame, text="Очередь проверок:").pack(side=tk.LEFT, anchor=tk.N)
+        self.job_list = tk.Listbox(queue_frame, height=4, exportselection=False)
+        self.job_list.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
+        self.job_list.bind("<<ListboxSelect>>", self._on_job_selected)
+        tk.Button(queue_frame, text="Отменить задание",
+                  command=self.cancel_selected_job).pack(side=tk.LEFT, padx=5, anchor=tk.N)
+        
         # Поле для вывода результатов
         self.result_text = scrolledtext.ScrolledText(self.root, 
                                                    height=20,
@@ -147,11 +278,23 @@ class DrawingCheckerApp:
         self.status_label.pack(pady=5)
         
         self.current_pdf_path = None
-        self.analysis_result = ""  # Для хранения результатов для экспорта
+        self.document = None  # Открытый PDF с кэшем страниц (DocumentSession)
     
     def test_connection_ui(self):
+        if self._service_url():
+            self.is_ollama_running = self.test_connection()
+            if self.is_ollama_running:
+                health = self._service().health()
+                self.status_label.config(text="Статус: Сервер проверки подключен")
+                self.model_info.config(text=f"Сервер: {health['text_model']}, {health['vision_model']}, "
+                                            f"в очереди {health['queued']}")
+                messagebox.showinfo("Успех", "Сервер проверки подключен!")
+            else:
+                self.status_label.config(text="Статус: Сервер проверки не доступен")
+                messagebox.showerror("Ошибка", "Сервер проверки или его Ollama не доступен.")
+            return
         if self.test_connection():
-            self.status_label.config(text="Статус: Ollama подключен")
+            self.status_label.config(text=self._ollama_status())
             self.is_ollama_running = True
             self.update_model_info()
             messagebox.showinfo("Успех", "Ollama подключен!")
@@ -160,393 +303,332 @@ class DrawingCheckerApp:
             self.is_ollama_running = False
             messagebox.showerror("Ошибка", "Ollama не доступен. Запустите сервис.")
     
+    def _ollama_status(self):
+        endpoints = self.ollama.endpoint_status()
+        if len(endpoints) == 1:
+            return "Статус: Ollama подключен"
+        healthy = sum(1 for endpoint in endpoints if endpoint["healthy"])
+        return f"Статус: Ollama подключен (серверов доступно: {healthy} из {len(endpoints)})"
+    
     def update_model_info(self):
         try:
-            response = requests.get(f"{self.ollama_url}/api/tags", timeout=5)
-            if response.status_code == 200:
-                models = response.json().get("models", [])
-                if models:
-                    model_names = [model["name"] for model in models]
-                    self.model_info.config(text=f"Модели: {', '.join(model_names[:5])}...")
-                else:
-                    self.model_info.config(text="Модели не установлены")
+            model_names = self.ollama.model_names()  # Список из test_connection, без повторного запроса
+            if model_names:
+                self.model_info.config(text=f"Модели: {', '.join(model_names[:5])}...")
             else:
-                self.model_info.config(text="Ошибка получения моделей")
-        except:
+                self.model_info.config(text="Модели не установлены")
+        except Exception:
             self.model_info.config(text="Не удалось получить модели")
     
+    def clear_cache(self):
+        self.result_cache.clear()
+        self.revision_store.clear()
+        self.status_label.config(text="Статус: Кэш результатов очищен")
+    
     def stop_checking(self):
-        self.stop_check = True
-        if self.current_check_thread and self.current_check_thread.is_alive():
-            self.status_label.config(text="Статус: Останавливаем проверку...")
-            self.stop_btn.config(state=tk.DISABLED)
+        """Отменяет все задания: очередь очищается, текущие запросы к Ollama прерываются"""
+        self.scheduler.cancel_all()
+        self.status_label.config(text="Статус: Останавливаем проверки...")
+    
+    def cancel_selected_job(self):
+        job = self._selected_job()
+        if job is not None and self.scheduler.cancel(job.id):
+            self.status_label.config(text=f"Статус: Отменяем задание #{job.id}...")
+    
+    def set_concurrency(self):
+        try:
+            self.scheduler.set_limit(self.max_checks_var.get())
+        except tk.TclError:
+            pass
     
     def upload_pdf(self):
-        file_path = filedialog.askopenfilename(
-            title="Выберите PDF файл",
+        file_paths = filedialog.askopenfilenames(
+            title="Выберите PDF файлы",
             filetypes=[("PDF files", "*.pdf")]
         )
         
-        if file_path:
-            self.current_pdf_path = file_path
+        if file_paths:
+            try:
+                document = DocumentSession(file_paths[0])
+            except Exception as e:
+                messagebox.showerror("Ошибка", f"Не удалось открыть PDF: {str(e)}")
+                return
+            # Проверки открывают файлы сами, поэтому документ предпросмотра можно закрыть
+            if self.document:
+                self.document.close()
+            self.document = document
+            self.current_pdf_path = file_paths[0]
+            self.loaded_paths = list(file_paths)
             self.check_btn.config(state=tk.NORMAL)
             self.quick_check_btn.config(state=tk.NORMAL)
-            self.export_btn.config(state=tk.DISABLED)  # Сброс экспорта
-            self.status_label.config(text=f"Загружен: {os.path.basename(file_path)}")
-            self.result_text.delete(1.0, tk.END)
-            self.result_text.insert(tk.END, f"Файл загружен: {file_path}\n\n")
-            self.display_pdf_preview(file_path)
-    
-    def display_pdf_preview(self, pdf_path):
-        """Отображает предпросмотр первой страницы PDF"""
-        try:
-            doc = fitz.open(pdf_path)
-            page = doc.load_page(0)
-            pix = page.get_pixmap(dpi=72)  # Низкое разрешение для preview
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            img = img.resize((400, 300), Image.LANCZOS)  # Масштабируем
-            self.preview_img = ImageTk.PhotoImage(img)  # Сохраняем ссылку
-            self.preview_canvas.create_image(0, 0, anchor=tk.NW, image=self.preview_img)
-            doc.close()
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Не удалось отобразить preview: {str(e)}")
+            self.cascade_check_btn.config(state=tk.NORMAL)
+            if len(file_paths) == 1:
+                self.status_label.config(text=f"Загружен: {os.path.basename(file_paths[0])}")
+            else:
+                self.status_label.config(text=f"Загружено файлов: {len(file_paths)}")
+            self.display_pdf_preview(self.document)
     
-    def extract_text_from_pdf(self, pdf_path, max_pages=3):
+    def display_pdf_preview(self, document):
+        """Предпросмотр: миниатюры всех листов и первый лист рендерятся в фоне"""
         try:
-            doc = fitz.open(pdf_path)
-            text = ""
-            for page_num in range(min(len(doc), max_pages)):
-                page = doc.load_page(page_num)
-                text += page.get_text()
-            doc.close()
-            return text
+            self.preview.show_document(document)
         except Exception as e:
-            return f"Ошибка извлечения текста: {str(e)}"
+            messagebox.showerror("Ошибка", f"Не удалось отобразить preview: {str(e)}")
     
-    def extract_images_from_pdf(self, pdf_path, max_pages=3):
+    def _check_options(self):
+        """Настройки интерфейса на момент постановки задания (потоки проверок не трогают Tk)"""
         try:
-            doc = fitz.open(pdf_path)
-            base64_images = []
-            for page_num in range(min(len(doc), max_pages)):
-                page = doc.load_page(page_num)
-                pix = page.get_pixmap(dpi=150)
-                img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-                buffered = io.BytesIO()
-                img.save(buffered, format="PNG")
-                base64_img = base64.b64encode(buffered.getvalue()).decode('utf-8')
-                base64_images.append(base64_img)
-            doc.close()
-            return base64_images
-        except Exception as e:
-            return f"Ошибка извлечения изображений: {str(e)}"
-    
-    def analyze_with_ollama_fast(self, text_content, base64_images=None):
-        truncated_text = text_content[:1000] + "..." if len(text_content) > 1000 else text_content
-        
-        prompt = f"""
-ТЫ: Эксперт ГОСТ. Проанализируй чертеж быстро, включая текст и графику.
-
-КРИТЕРИИ:
-- Основная надпись (наименование, код, подписи)
-- Соответствие кода документа (СБ, ВО, ГЧ, МЧ)
-- Обязательные реквизиты (масса, масштаб)
-- Положение деталей: проверка размеров на полках линий-выносок, угловые размеры в зоне 30°, дополнительные стрелки для допусков
-- Шероховатость: наличие знака √ в скобках
-- Позиции фигур: наличие буквенных обозначений баз (A, B и т.д.), их соответствие в рамках
-
-ТЕКСТ: {truncated_text}
-
-Если есть изображение: опиши графику, проверь положение элементов, сравни с текстом.
-
-Для каждой проблемы добавь ссылку на ГОСТ: 
-- ГОСТ 2.308-2011: https://meganorm.ru/Data2/1/4293800/4293800222.pdf (допуски формы)
-- ГОСТ 2.307-2011: https://meganorm.ru/Data2/1/4293800/4293800223.pdf (размеры)
-- ГОСТ 2.309-73: https://www.ntcexpert.ru/documents/GOST_2.309.pdf (шероховатость)
-- ГОСТ 2.104-2006: https://meganorm.ru/Data2/1/4293850/4293850184.pdf (основные надписи)
-
-ФОРМАТ ОТВЕТА (ТОЧНО):
-
-СООТВЕТСТВИЕ: [ДА/НЕТ]
-ПРОБЛЕМЫ:
-- [проблема 1] (Ссылка на ГОСТ: [ссылка])
-- [проблема 2] 
-РЕКОМЕНДАЦИИ:
-- [рекомендация 1]
-
-ТОЛЬКО РУССКИЙ ЯЗЫК. КРАТКО.
-"""
-        
-        payload = {
-            "model": self.vision_model_var.get() if base64_images else self.model_var.get(),
-            "prompt": prompt,
-            "stream": False,
-            "options": {
-                "temperature": 0.05,
-                "num_predict": 300,
-                "top_k": 20,
-                "repeat_penalty": 1.1
-            }
+            num_parallel = max(1, self.num_parallel_var.get())
+        except tk.TclError:
+            num_parallel = 1
+        return {
+            "text_model": self.model_var.get(),
+            "vision_model": self.vision_model_var.get(),
+            "stream": self.stream_var.get(),
+            "per_page": self.page_mode_var.get(),
+            "num_parallel": num_parallel,
+            "use_cache": self.use_cache_var.get(),
+            # Ответы прошлой ревизии - тоже кэш: без флажка "Кэш результатов" не берутся
+            "incremental": self.incremental_var.get() and self.use_cache_var.get(),
+            "service": self._service() if self._service_url() else None,
         }
-        
-        if base64_images:
-            payload["images"] = base64_images
-        
-        try:
-            response = requests.post(f"{self.ollama_url}/api/generate", 
-                                   json=payload, timeout=60)
-            
-            if response.status_code == 200:
-                return response.json().get("response", "Нет ответа")
-            else:
-                return f"Ошибка API: {response.status_code}"
-                
-        except requests.exceptions.Timeout:
-            return "Таймаут: модель не успела ответить за 60 секунд"
-        except Exception as e:
-            return f"Ошибка: {str(e)}"
     
-    def analyze_with_ollama_standard(self, text_content, base64_images=None):
-        truncated_text = text_content[:1800] + "..." if len(text_content) > 1800 else text_content
-        
-        prompt = f"""
-ТЫ: Эксперт по технической документации и российским стандартам ГОСТ. Твоя задача - анализировать чертежи на соответствие ГОСТ, включая текст и графику (положение деталей, фигур, размеров).
-
-АНАЛИЗИРУЙ этот чертеж и проверь соответствие ГОСТ по следующим критериям:
-
-1. ОСНОВНАЯ НАДПИСЬ - наличие и правильность заполнения:
-   - Наименование изделия
-   - Обозначение документа (код: СБ, ВО, ГЧ, МЧ и т.д.)
-   - Подписи (Разраб., Пров., Т.контр., Н.контр., Утв.)
-   - Масса, масштаб, листы
-
-2. КОД ДОКУМЕНТА - соответствие наименованию:
-   - СБ = Сборочный чертеж
-   - ВО = Чертеж общего вида  
-   - ГЧ = Габаритный чертеж
-   - МЧ = Монтажный чертеж
-
-3. ТЕХНИЧЕСКИЕ ТРЕБОВАНИЯ:
-   - Расположение над основной надписью
-   - Ширина не более 185 мм
-
-4. ОБОЗНАЧЕНИЯ И СИМВОЛЫ:
-   - Буквенные обозначения в технических требованиях
-   - Символы *, **, *** 
-   - Знак √ в скобках для шероховатости
-
-5. ГРАФИКА И ПОЛОЖЕНИЕ:
-   - Простановка размеров на полке линии-выноски (в зоне 30°)
-   - Угловые размеры в зоне 30°
-   - Дополнительные стрелки для допусков формы (ГОСТ 2.308)
-   - Соответствие буквенных обозначений баз в рамках
-   - Положение фигур, деталей: сравни с текстом, выяви несоответствия (например, Ra на поверхностях)
-
-ТЕКСТ ЧЕРТЕЖА ДЛЯ АНАЛИЗА:
-{truncated_text}
-
-Если есть изображение: опиши видимые элементы, проверь позиции, сравни с требованиями ГОСТ.
-
-Для каждой проблемы добавь ссылку на ГОСТ: 
-- ГОСТ 2.308-2011: https://meganorm.ru/Data2/1/4293800/4293800222.pdf (допуски формы)
-- ГОСТ 2.307-2011: https://meganorm.ru/Data2/1/4293800/4293800223.pdf (размеры)
-- ГОСТ 2.309-73: https://www.ntcexpert.ru/documents/GOST_2.309.pdf (шероховатость)
-- ГОСТ 2.104-2006: https://meganorm.ru/Data2/1/4293850/4293850184.pdf (основные надписи)
-
-ФОРМАТ ОТВЕТА (СТРОГО ПРИДЕРЖИВАЙСЯ ЭТОГО ФОРМАТА):
-
-СООТВЕТСТВИЕ: [ДА/НЕТ]
-ОБЩИЙ ВЫВОД: [1-2 предложения]
-
-ДЕТАЛЬНЫЙ АНАЛИЗ:
-1. Основная надпись: [СООТВЕТСТВУЕТ/НЕ СООТВЕТСТВУЕТ] - [причина] (Ссылка на ГОСТ: [ссылка])
-2. Код документа: [СООТВЕТСТВУЕТ/НЕ СООТВЕТСТВУЕТ] - [причина]  
-3. Подписи: [СООТВЕТСТВУЕТ/НЕ СООТВЕТСТВУЕТ] - [причина]
-4. Технические требования: [СООТВЕТСТВУЕТ/НЕ СООТВЕТСТВУЕТ] - [причина]
-5. Обозначения: [СООТВЕТСТВУЕТ/НЕ СООТВЕТСТВУЕТ] - [причина]
-6. Графика и положение: [СООТВЕТСТВУЕТ/НЕ СООТВЕТСТВУЕТ] - [причина, включая описание позиций] (Ссылка на ГОСТ: [ссылка])
-
-РЕКОМЕНДАЦИИ:
-- [конкретная рекомендация 1]
-- [конкретная рекомендация 2]
-
-НЕ ИЗМЕНЯЙ ФОРМАТ ОТВЕТА. ОТВЕЧАЙ ТОЛЬКО НА РУССКОМ ЯЗЫКЕ.
-"""
-        
-        payload = {
-            "model": self.vision_model_var.get() if base64_images else self.model_var.get(),
-            "prompt": prompt,
-            "stream": False,
-            "options": {
-                "temperature": 0.1,
-                "num_predict": 600,
-                "top_p": 0.8,
-                "repeat_penalty": 1.2
-            }
-        }
-        
-        if base64_images:
-            payload["images"] = base64_images
-        
-        try:
-            response = requests.post(f"{self.ollama_url}/api/generate", 
-                                   json=payload, timeout=(30, 120))
-            
-            if self.stop_check:
-                return "Проверка прервана пользователем"
-            
-            if response.status_code == 200:
-                return response.json().get("response", "Нет ответа от модели")
-            else:
-                return f"Ошибка API: {response.status_code}"
-                
-        except requests.exceptions.Timeout:
-            return self.fallback_analysis(text_content)
-        except Exception as e:
-            return f"Ошибка соединения: {str(e)}"
-
-    def fallback_analysis(self, text_content):
-        self.root.after(0, self._update_progress, "Таймаут! Используем упрощенный анализ...")
-        
-        checks = {
-            "Основная надпись": ["разраб", "пров", "лист", "листов", "масса", "масштаб"],
-            "Код документа": ["сб", "во", "гч", "мч", "рнат"],
-            "Подписи": ["разраб", "пров", "т.контр", "утв"],
-            "Графика": ["ra", "поверхность", "размер", "стрелка"]
-        }
-        
-        result = "УПРОЩЕННЫЙ АНАЛИЗ (после таймаута):\n\n"
-        text_lower = text_content.lower()
-        
-        for check_name, keywords in checks.items():
-            found = any(keyword in text_lower for keyword in keywords)
-            status = "✓ ЕСТЬ" if found else "✗ НЕТ"
-            result += f"{check_name}: {status}\n"
-        
-        result += "\nПримечание: Полный анализ не удался из-за таймаута нейросети. Графика не проанализирована."
-        return result
+    def _create_analyzer(self, job, emit, tracer):
+        """Создает анализатор движка для задания; отмена задания прерывает его запросы"""
+        options = job.options
+        analyzer = engine.OllamaAnalyzer(
+            self.ollama_url,
+            options["text_model"],
+            options["vision_model"],
+            should_stop=lambda: job.token.cancelled,
+            progress=lambda message: emit(scheduler.EVENT_PROGRESS, message),
+            cache=self.result_cache if options["use_cache"] else None,
+            stream=options["stream"],
+            client=self.ollama,
+            tracer=tracer,
+            on_token=lambda token: emit(scheduler.EVENT_TOKEN, token),
+            gost_index=self.gost_index
+        )
+        job.token.on_cancel(analyzer.cancel)
+        return analyzer
 
-    def check_drawing(self):
-        if not self.current_pdf_path:
+    def _submit_checks(self, mode):
+        if not self.loaded_paths:
             messagebox.showerror("Ошибка", "Сначала загрузите PDF файл")
             return
         
         if not self.is_ollama_running:
-            messagebox.showerror("Ошибка", "Ollama не запущен")
+            messagebox.showerror("Ошибка", "Сервер проверки не доступен" if self._service_url()
+                                 else "Ollama не запущен")
             return
-            
-        self.stop_check = False
-        self.current_check_thread = threading.Thread(target=self._check_drawing_thread, 
-                                                   args=(self.analyze_with_ollama_standard, True),
-                                                   daemon=True)
-        self.current_check_thread.start()
+        
+        self.ollama.keep_alive = self.keep_alive_var.get()
+        self.set_concurrency()
+        options = self._check_options()
+        if mode == engine.CASCADE and options["service"] is None:
+            # Первая ступень каскада - самая легкая из установленных текстовых моделей;
+            # выбирается в потоке задания: /api/tags - сетевой запрос
+            options["fast_models"] = list(self.fast_models)
+        for path in self.loaded_paths:
+            self.scheduler.submit(path, mode, **options)
+
+    def check_drawing(self):
+        self._submit_checks("full")
     
     def quick_check_drawing(self):
-        if not self.current_pdf_path:
-            messagebox.showerror("Ошибка", "Сначала загрузите PDF файл")
-            return
-        
-        if not self.is_ollama_running:
-            messagebox.showerror("Ошибка", "Ollama не запущен")
-            return
-            
-        self.stop_check = False
-        self.current_check_thread = threading.Thread(target=self._check_drawing_thread, 
-                                                   args=(self.analyze_with_ollama_fast, False),
-                                                   daemon=True)
-        self.current_check_thread.start()
+        self._submit_checks("fast")
+    
+    def cascade_check_drawing(self):
+        self._submit_checks(engine.CASCADE)
 
-    def _check_drawing_thread(self, analysis_function, include_graphics=False):
-        self.root.after(0, self._update_ui_check_started)
-        
+    def _run_job(self, job, emit):
+        """Проверка одного задания (в потоке планировщика). Возвращает ответ модели"""
+        if job.options["service"] is not None:
+            return job.options["service"].run(job, emit)
+        if job.options.get("fast_models"):
+            job.options["text_model"] = self.ollama.cheapest_model(job.options["fast_models"])
+        tracer = spans.Tracer(file=job.name, mode=job.mode)
+        analyzer = self._create_analyzer(job, emit, tracer)
+        ai_result = engine.check_file(job.pdf_path, job.mode, analyzer,
+                                      progress=lambda message: emit(scheduler.EVENT_PROGRESS, message),
+                                      image_config=self.image_config,
+                                      per_page=job.options["per_page"],
+                                      num_parallel=job.options["num_parallel"],
+                                      should_stop=lambda: job.token.cancelled,
+                                      revisions=self.revision_store if job.options["incremental"] else None)
+        if ai_result is not None:
+            job.timings = tracer.format()
+            try:
+                tracer.flush()
+            except OSError:
+                pass  # журнал спанов не критичен
+        return ai_result
+    
+    def _poll_events(self):
+        """Разбирает события планировщика в потоке Tk"""
         try:
-            text_content = self.extract_text_from_pdf(self.current_pdf_path)
-            
-            if self.stop_check:
-                return
-                
-            self.root.after(0, self._update_progress, f"Текст извлечен: {len(text_content)} символов")
-            
-            base64_images = None
-            if include_graphics:
-                self.root.after(0, self._update_progress, "Извлекаем графику...")
-                base64_images = self.extract_images_from_pdf(self.current_pdf_path)
-                if isinstance(base64_images, str):
-                    self.root.after(0, self._display_error, base64_images)
-                    return
-                self.root.after(0, self._update_progress, f"Извлечено {len(base64_images)} изображений")
-            
-            if self.stop_check:
-                return
-                
-            ai_result = analysis_function(text_content, base64_images)
-            
-            if self.stop_check:
-                return
-                
-            self.analysis_result = ai_result  # Сохраняем для экспорта
-            self.root.after(0, self._display_results, ai_result)
-            
-        except Exception as e:
-            self.root.after(0, self._display_error, str(e))
-    
-    def _update_ui_check_started(self):
-        self.status_label.config(text="Статус: Идет проверка...")
-        self.check_btn.config(state=tk.DISABLED)
-        self.quick_check_btn.config(state=tk.DISABLED)
-        self.stop_btn.config(state=tk.NORMAL)
-        self.export_btn.config(state=tk.DISABLED)
-        self.result_text.insert(tk.END, "Начинаем проверку...\n")
-    
-    def _update_progress(self, message):
-        self.progress.config(text=message)
-        self.result_text.insert(tk.END, f"{message}\n")
-        self.root.update()
-    
-    def _display_results(self, result):
-        self.result_text.insert(tk.END, "\n" + "="*60 + "\n")
-        self.result_text.insert(tk.END, "РЕЗУЛЬТАТЫ ПРОВЕРКИ:\n")
-        self.result_text.insert(tk.END, "="*60 + "\n\n")
-        self.result_text.insert(tk.END, result)
-        
-        self._reset_ui_after_check()
-        self.export_btn.config(state=tk.NORMAL)  # Активируем экспорт
-    
-    def _display_error(self, error):
-        messagebox.showerror("Ошибка", f"Произошла ошибка: {error}")
-        self._reset_ui_after_check()
-    
-    def _reset_ui_after_check(self):
-        self.status_label.config(text="Статус: Проверка завершена")
-        self.check_btn.config(state=tk.NORMAL)
-        self.quick_check_btn.config(state=tk.NORMAL)
-        self.stop_btn.config(state=tk.DISABLED)
+            while True:
+                kind, job, data = self.scheduler.events.get_nowait()
+                self._handle_event(kind, job, data)
+        except queue.Empty:
+            pass
+        self.root.after(100, self._poll_events)
+    
+    def _handle_event(self, kind, job, data):
+        log = self.job_logs.setdefault(job.id, [])
+        if kind == scheduler.EVENT_QUEUED:
+            log.append(f"Файл: {job.pdf_path}\nВ очереди...\n")
+            self.job_list.insert(tk.END, job.describe())
+            self.job_ids.append(job.id)
+            if self.view_job_id is None or self._viewed_job_finished():
+                self._show_job(job.id)
+        elif kind == scheduler.EVENT_STARTED:
+            self._append_log(job, "Начинаем проверку...\n")
+        elif kind == scheduler.EVENT_PROGRESS:
+            self._append_log(job, f"{data}\n")
+            if job.id == self.view_job_id:
+                self.progress.config(text=data)
+        elif kind == scheduler.EVENT_TOKEN:
+            if job.id not in self.streamed_jobs:
+                self.streamed_jobs.add(job.id)
+                self._append_log(job, "\nОтвет модели:\n")
+            self._append_log(job, data)
+        elif kind == scheduler.EVENT_DONE:
+            # Потоковый ответ - JSON по мере генерации, после него разобранные замечания
+            text = self._results_header() + (data.format() if data is not None else "Проверка остановлена")
+            if job.timings:
+                text += f"\n\n{job.timings}\n"
+            self._append_log(job, text)
+        elif kind == scheduler.EVENT_CANCELLED:
+            self._append_log(job, "\nПроверка прервана пользователем\n")
+        elif kind == scheduler.EVENT_ERROR:
+            self._append_log(job, f"\nПроизошла ошибка: {data}\n")
+        self._update_job_list(job)
+        self._update_queue_status()
+    
+    def _results_header(self):
+        return "\n" + "="*60 + "\nРЕЗУЛЬТАТЫ ПРОВЕРКИ:\n" + "="*60 + "\n\n"
+    
+    def _append_log(self, job, text):
+        self.job_logs.setdefault(job.id, []).append(text)
+        if job.id == self.view_job_id:
+            self.result_text.insert(tk.END, text)
+            self.result_text.see(tk.END)
+    
+    def _update_job_list(self, job):
+        index = self.job_ids.index(job.id)
+        self.job_list.delete(index)
+        self.job_list.insert(index, job.describe())
+        if job.id == self.view_job_id:
+            self.job_list.selection_set(index)
+            self._update_export_state()
+    
+    def _viewed_job_finished(self):
+        job = self.scheduler.get(self.view_job_id)
+        return job is None or job.status not in (scheduler.QUEUED, scheduler.RUNNING)
+    
+    def _selected_job(self):
+        selection = self.job_list.curselection()
+        if not selection:
+            return self.scheduler.get(self.view_job_id)
+        return self.scheduler.get(self.job_ids[selection[0]])
+    
+    def _on_job_selected(self, event=None):
+        selection = self.job_list.curselection()
+        if selection:
+            self._show_job(self.job_ids[selection[0]])
+    
+    def _show_job(self, job_id):
+        """Показывает журнал и результат задания в поле результатов"""
+        self.view_job_id = job_id
+        self.result_text.delete(1.0, tk.END)
+        self.result_text.insert(tk.END, "".join(self.job_logs.get(job_id, [])))
+        self.result_text.see(tk.END)
+        self.progress.config(text="")
+        self.job_list.selection_clear(0, tk.END)
+        self.job_list.selection_set(self.job_ids.index(job_id))
+        self._update_export_state()
+    
+    def _update_export_state(self):
+        job = self.scheduler.get(self.view_job_id)
+        done = job is not None and job.status == scheduler.DONE
+        self.export_btn.config(state=tk.NORMAL if done else tk.DISABLED)
+        annotatable = done and isinstance(job.result, findings.Analysis)
+        self.annotate_btn.config(state=tk.NORMAL if annotatable else tk.DISABLED)
+    
+    def _update_queue_status(self):
+        queued, running = self.scheduler.pending()
+        self.stop_btn.config(state=tk.NORMAL if queued or running else tk.DISABLED)
+        if queued or running:
+            self.status_label.config(text=f"Статус: проверяется {running}, в очереди {queued}")
+            return
+        stats = self.result_cache.stats()
+        self.status_label.config(text=f"Статус: Проверки завершены "
+                                      f"(кэш: попаданий {stats['hits']}, промахов {stats['misses']})")
         self.progress.config(text="")
-        self.stop_check = False
     
     def export_report(self):
-        """Экспортирует отчет в PDF"""
-        if not self.analysis_result:
+        """Экспортирует отчет выбранного задания в PDF"""
+        job = self.scheduler.get(self.view_job_id)
+        if job is None or job.status != scheduler.DONE:
             messagebox.showerror("Ошибка", "Нет результатов для экспорта")
             return
         
         file_path = filedialog.asksaveasfilename(
             defaultextension=".pdf",
-            filetypes=[("PDF files", "*.pdf")],
+            filetypes=[("PDF files", "*.pdf"), ("JSON (замечания)", "*.json")],
             title="Сохранить отчет"
         )
         
         if file_path:
+            tracer = spans.Tracer(file=job.name, mode=job.mode)
             try:
-                pdf = FPDF()
-                pdf.add_page()
-                pdf.add_font('DejaVu', '', 'DejaVuSans.ttf', uni=True)  # Для русского текста (нужно скачать шрифт)
-                pdf.set_font("DejaVu", size=12)
-                pdf.multi_cell(0, 10, self.analysis_result.encode('latin-1', 'replace').decode('latin-1'))  # Простая обработка
-                pdf.output(file_path)
+                with tracer.span(spans.EXPORT) as attrs:
+                    if file_path.lower().endswith(".json"):
+                        report.export_json(job.result, file_path, source=job.pdf_path)
+                    else:
+                        report.export_pdf(job.result, file_path, timings=job.timings)
+                    attrs["file"] = os.path.basename(file_path)
+                try:
+                    tracer.flush()
+                except OSError:
+                    pass
                 messagebox.showinfo("Успех", f"Отчет сохранен: {file_path}")
             except Exception as e:
                 messagebox.showerror("Ошибка", f"Не удалось сохранить: {str(e)}")
                 # Примечание: Скачайте DejaVuSans.ttf и положите в директорию скрипта
+    
+    def export_annotated(self):
+        """Сохраняет копию чертежа выбранного задания с замечаниями на листах"""
+        job = self.scheduler.get(self.view_job_id)
+        if job is None or job.status != scheduler.DONE or not isinstance(job.result, findings.Analysis):
+            messagebox.showerror("Ошибка", "Нет результатов для пометок")
+            return
+        
+        stem = os.path.splitext(os.path.basename(job.pdf_path))[0]
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".pdf",
+            initialfile=stem + report.ANNOTATED_SUFFIX,
+            filetypes=[("PDF files", "*.pdf")],
+            title="Сохранить чертеж с пометками"
+        )
+        if not file_path:
+            return
+        if os.path.abspath(file_path) == os.path.abspath(job.pdf_path):
+            messagebox.showerror("Ошибка", "Пометки пишутся в копию: выберите другое имя файла")
+            return
+        tracer = spans.Tracer(file=job.name, mode=job.mode)
+        try:
+            with tracer.span(spans.EXPORT) as attrs:
+                attrs["annotations"] = report.annotate_pdf(job.result, job.pdf_path, file_path)
+                attrs["file"] = os.path.basename(file_path)
+            try:
+                tracer.flush()
+            except OSError:
+                pass
+            messagebox.showinfo("Успех", f"Чертеж с пометками сохранен: {file_path}")
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось сохранить: {str(e)}")
 
 def main():
     root = tk.Tk()
@@ -0,0 +1,375 @@
+"""Бенчмарк этапов проверки на синтетических чертежах и заглушке Ollama.
+
+Отдельно замеряются: открытие PDF, извлечение текста, правила, рендеринг
+областей, кодирование PNG/base64, весь конвейер изображений, запросы к
+модели (целиком, потоково, с изображениями, постранично), обработка
+промпта с постоянным префиксом и без него, экспорт отчета, пометки на
+чертеже (время на одно замечание).
+GPU и настоящий Ollama не нужны. Результаты пишутся в JSON; с --compare
+сравниваются с прошлым прогоном, замедление сверх порога - код возврата 1.
+
+    python benchmark.py -o bench.json --sizes A4 A1 --sheets 1 10
+    python benchmark.py -o new.json --compare bench.json
+"""
+import argparse
+import base64
+import copy
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import fitz  # PyMuPDF
+
+import chunking
+import engine
+import findings
+import image_pipeline
+import ollama_client
+import report
+import synthetic_drawings
+import title_block
+from document import DocumentSession
+from stub_ollama import StubConfig, StubOllamaServer
+
+DEFAULT_DATA_DIR = os.path.join(tempfile.gettempdir(), "drawing_checker_bench")
+
+
+def measure(func, repeats):
+    """Время выполнения func: список секунд и результат последнего запуска"""
+    times = []
+    result = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - started)
+    return times, result
+
+
+def summarize(scenario, times, **fields):
+    record = {"scenario": scenario, "runs": len(times),
+              "median_s": round(statistics.median(times), 6),
+              "min_s": round(min(times), 6),
+              "mean_s": round(statistics.mean(times), 6)}
+    record.update(fields)
+    return record
+
+
+def _open_and_close(path):
+    DocumentSession(path).close()
+
+
+def _with_session(path, func):
+    # Новая сессия на каждый запуск: кэш страниц и растров не должен искажать замер
+    with DocumentSession(path) as session:
+        return func(session)
+
+
+def _render_regions(session, config):
+    """Растры значимых областей всех листов (без кодирования)"""
+    pixmaps = []
+    colorspace = fitz.csGRAY if config.grayscale else None
+    for page_num in range(session.page_count):
+        for region in image_pipeline.detect_regions(session.page(page_num), config):
+            pixmaps.append(session.pixmap(page_num, dpi=region.dpi, clip=region.rect, colorspace=colorspace))
+    return pixmaps
+
+
+def _encode(pixmaps):
+    return sum(len(base64.b64encode(pix.tobytes("png"))) for pix in pixmaps)
+
+
+def _image_pipeline(session, config):
+    return sum(image_pipeline.render_page(session, page_num, config).total_bytes
+               for page_num in range(session.page_count))
+
+
+def bench_drawing(size, sheets, kind, path, repeats):
+    """Сценарии извлечения и подготовки изображений для одного чертежа"""
+    fields = {"size": size, "sheets": sheets, "kind": kind, "file_bytes": os.path.getsize(path)}
+    config = image_pipeline.ImagePipelineConfig()
+    results = []
+
+    times, _ = measure(lambda: _open_and_close(path), repeats)
+    results.append(summarize("open", times, **fields))
+
+    times, text = measure(lambda: _with_session(path, lambda s: engine.extract_text(s, None)), repeats)
+    results.append(summarize("extract_text", times, chars=len(text), **fields))
+
+    times, rules = measure(lambda: _with_session(path, lambda s: title_block.check_document(s, None)), repeats)
+    results.append(summarize("rules", times, decided=len(rules.decided()), **fields))
+
+    render_times, encode_times = [], []
+    for _ in range(repeats):
+        with DocumentSession(path) as session:
+            started = time.perf_counter()
+            pixmaps = _render_regions(session, config)
+            render_times.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            encoded = _encode(pixmaps)
+            encode_times.append(time.perf_counter() - started)
+    results.append(summarize("render", render_times, regions=len(pixmaps), **fields))
+    results.append(summarize("encode", encode_times, base64_bytes=encoded, **fields))
+
+    times, total = measure(lambda: _with_session(path, lambda s: _image_pipeline(s, config)), repeats)
+    results.append(summarize("image_pipeline", times, base64_bytes=total, **fields))
+    return results
+
+
+def bench_round_trips(path, stub_config, repeats, num_parallel):
+    """Запросы к заглушке: целиком, потоково, с изображениями и постранично"""
+    results = []
+    with StubOllamaServer(stub_config) as server:
+        client = ollama_client.OllamaClient(server.url)
+        client.warm_up("llama2:3b")
+        client.warm_up("llava:7b")
+        with DocumentSession(path) as session:
+            text = engine.extract_text(session, 3)
+            rules = title_block.check_document(session, 3)
+            images = engine.extract_images(session, 1)
+            jobs = engine.extract_page_jobs(session)
+        fields = {"sheets": len(jobs), "prompt_delay_s": stub_config.prompt_delay,
+                  "token_delay_s": stub_config.token_delay}
+
+        def analyzer(stream=False):
+            return engine.OllamaAnalyzer(server.url, cache=None, stream=stream, client=client)
+
+        times, _ = measure(lambda: analyzer().analyze_fast(text), repeats)
+        results.append(summarize("round_trip_fast", times, **fields))
+        times, _ = measure(lambda: analyzer(stream=True).analyze_fast(text), repeats)
+        results.append(summarize("round_trip_stream", times, **fields))
+        times, _ = measure(lambda: analyzer().analyze_standard(text, images), repeats)
+        results.append(summarize("round_trip_full", times, images=len(images), **fields))
+        # Ответ заглушки содержит пункт "не определено": каскад всегда доходит до vision-модели
+        times, _ = measure(lambda: analyzer().analyze_cascade(text, images, rules=rules), repeats)
+        results.append(summarize("round_trip_cascade", times, images=len(images), **fields))
+        times, _ = measure(lambda: analyzer().analyze_pages("fast", jobs, rules=rules,
+                                                            num_parallel=num_parallel), repeats)
+        results.append(summarize("round_trip_pages", times, num_parallel=num_parallel, **fields))
+        client.close()
+    return results
+
+
+def bench_endpoints(path, stub_config, repeats, num_parallel, servers=(1, 2)):
+    """Постраничная проверка на пуле из 1 и 2 заглушек, каждая обрабатывает один запрос за раз"""
+    results = []
+    config = copy.copy(stub_config)
+    config.num_parallel = 1
+    with DocumentSession(path) as session:
+        rules = title_block.check_document(session, None)
+        jobs = engine.extract_page_jobs(session)
+    for count in servers:
+        stubs = [StubOllamaServer(config).start() for _ in range(count)]
+        try:
+            client = ollama_client.OllamaClient(",".join(stub.url for stub in stubs))
+            client.warm_up("llama2:3b")
+            analyzer = engine.OllamaAnalyzer(cache=None, client=client)
+            parallel = num_parallel * count
+            times, _ = measure(lambda: analyzer.analyze_pages("fast", jobs, rules=rules,
+                                                              num_parallel=parallel), repeats)
+            results.append(summarize(f"endpoints_{count}", times, sheets=len(jobs), servers=count,
+                                     num_parallel=parallel))
+            client.close()
+        finally:
+            for stub in stubs:
+                stub.stop()
+    return results
+
+
+def _generate_metrics(client, model, options, system=None, prompt=""):
+    payload = {"model": model, "prompt": prompt, "stream": False, "options": options,
+               "keep_alive": client.keep_alive}
+    if system:
+        payload["system"] = system
+    response = client.session.post(client.url("/api/generate"), json=payload, timeout=600)
+    response.raise_for_status()
+    return response.json()
+
+
+def bench_prompt_cache(ollama_url, path, model, repeats):
+    """Обработка промпта по листам: постоянный префикс первым против текста первым.
+
+    "prefix" - как отправляет анализатор (system + текст листа); "text_first" -
+    текст листа перед постоянной частью, как в прежних шаблонах. Считаются
+    prompt_eval_duration и prompt_eval_count из ответов Ollama.
+    """
+    with DocumentSession(path) as session:
+        rules = title_block.check_document(session, None)
+        sheets = [(chunking.BLOCK_SEP.join(session.page_blocks(page_num)), rules.for_page(page_num))
+                  for page_num in range(session.page_count)]
+    options = dict(engine.FAST_OPTIONS, num_predict=16)
+    options["num_ctx"] = chunking.context_window(model, options)
+    client = ollama_client.OllamaClient(ollama_url)
+    client.warm_up(model)
+    results = []
+    totals = {}
+    for layout in ("text_first", "prefix"):
+        prompt_times, token_counts, wall_times = [], [], []
+        for _ in range(repeats):
+            _generate_metrics(client, model, options, prompt="сброс кэша промпта")
+            prompt_s = tokens = 0
+            started = time.perf_counter()
+            for text, page_rules in sheets:
+                prompt = engine.build_prompt("fast", text, page_rules)
+                if prompt is None:
+                    continue
+                system, variable = prompt
+                if layout == "prefix":
+                    data = _generate_metrics(client, model, options, system, variable)
+                else:
+                    data = _generate_metrics(client, model, options, prompt=f"{variable}\n\n{system}")
+                prompt_s += data.get("prompt_eval_duration", 0) / 1e9
+                tokens += data.get("prompt_eval_count", 0)
+            wall_times.append(time.perf_counter() - started)
+            prompt_times.append(prompt_s)
+            token_counts.append(tokens)
+        totals[layout] = statistics.median(prompt_times)
+        results.append(summarize(f"prompt_cache_{layout}", wall_times, sheets=len(sheets), model=model,
+                                 prompt_eval_s=round(totals[layout], 6),
+                                 prompt_eval_tokens=int(statistics.median(token_counts))))
+    if totals["text_first"] > 0:
+        saved = 1 - totals["prefix"] / totals["text_first"]
+        results[-1]["prompt_eval_saved"] = round(saved, 3)
+    client.close()
+    return results
+
+
+def bench_export(result_text, font_path, repeats):
+    out_path = os.path.join(tempfile.gettempdir(), "drawing_checker_bench_report.pdf")
+    try:
+        times, _ = measure(lambda: report.export_pdf(result_text, out_path, font_path), repeats)
+    except Exception as e:
+        return [{"scenario": "export", "error": str(e)}]
+    return [summarize("export", times, chars=len(result_text))]
+
+
+def _sample_findings(path, count):
+    """Замечания с цитатами из текста чертежа, по кругу по листам"""
+    with DocumentSession(path) as session:
+        words = [(page_num, word[4]) for page_num in range(session.page_count)
+                 for word in session.page(page_num).get_text("words")[:count]]
+    return [findings.Finding(f"Пункт {i}", quote=words[i % len(words)][1] if words else "",
+                             sheet=words[i % len(words)][0] if words else None,
+                             severity=findings.CRITICAL if i % 2 else findings.ADVICE)
+            for i in range(count)]
+
+
+def bench_annotate(path, repeats, counts=(10, 100)):
+    """Копия чертежа с пометками: время должно расти линейно с числом замечаний"""
+    out_path = os.path.join(tempfile.gettempdir(), "drawing_checker_bench_annotated.pdf")
+    results = []
+    for count in counts:
+        analysis = findings.Analysis("НЕТ", "", _sample_findings(path, count))
+        times, _ = measure(lambda: report.annotate_pdf(analysis, path, out_path), repeats)
+        results.append(summarize(f"annotate_{count}", times, findings=count,
+                                 per_finding_ms=round(statistics.median(times) / count * 1000, 3),
+                                 file_bytes=os.path.getsize(path)))
+    return results
+
+
+def result_key(record):
+    return (record["scenario"], record.get("size"), record.get("sheets"), record.get("kind"))
+
+
+def compare(results, baseline_path, threshold):
+    """Сравнивает медианы с прошлым прогоном; возвращает список замедлений"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {result_key(r): r for r in json.load(f)["results"] if "median_s" in r}
+    regressions = []
+    for record in results:
+        old = baseline.get(result_key(record))
+        if old is None or "median_s" not in record or old["median_s"] <= 0:
+            continue
+        ratio = record["median_s"] / old["median_s"]
+        record["baseline_median_s"] = old["median_s"]
+        record["ratio"] = round(ratio, 3)
+        if ratio > threshold:
+            regressions.append(record)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк этапов проверки чертежей")
+    parser.add_argument("-o", "--output", default="benchmark.json", help="Файл результатов (JSON)")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="Каталог синтетических PDF")
+    parser.add_argument("--sizes", nargs="+", default=["A4", "A3", "A1"],
+                        choices=sorted(synthetic_drawings.SHEET_SIZES))
+    parser.add_argument("--sheets", nargs="+", type=int, default=[1, 10], help="Число листов (1-50)")
+    parser.add_argument("--kinds", nargs="+", default=["vector", "raster"], choices=["vector", "raster"])
+    parser.add_argument("--repeats", type=int, default=3, help="Повторов каждого замера")
+    parser.add_argument("--prompt-delay", type=float, default=0.05, help="Заглушка: обработка промпта, с")
+    parser.add_argument("--token-delay", type=float, default=0.002, help="Заглушка: на токен, с")
+    parser.add_argument("--prompt-delay-per-1k", type=float, default=0.05,
+                        help="Заглушка: обработка каждой 1000 символов промпта, с")
+    parser.add_argument("--ollama-url", default=None,
+                        help="Замерять обработку промпта на настоящем Ollama вместо заглушки")
+    parser.add_argument("--model", default="llama2:3b", help="Модель для замера обработки промпта")
+    parser.add_argument("--num-parallel", type=int, default=2, help="Листов одновременно (постранично)")
+    parser.add_argument("--font", default=report.DEFAULT_FONT, help="Шрифт для экспорта отчета")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="Замедление медианы, считающееся регрессией (1.2 = +20%%)")
+    args = parser.parse_args(argv)
+
+    drawings = synthetic_drawings.make_set(args.data_dir, args.sizes, args.sheets, args.kinds)
+    results = []
+    for size, sheets, kind, path in drawings:
+        print(f"{size} {sheets} л. {kind}...", file=sys.stderr)
+        results.extend(bench_drawing(size, sheets, kind, path, args.repeats))
+
+    vector = [path for size, sheets, kind, path in drawings if kind == "vector"]
+    sample = max(vector or [path for *_, path in drawings], key=os.path.getsize)
+    stub_config = StubConfig(prompt_delay=args.prompt_delay, token_delay=args.token_delay,
+                             prompt_delay_per_1k=args.prompt_delay_per_1k)
+    print("Запросы к заглушке Ollama...", file=sys.stderr)
+    results.extend(bench_round_trips(sample, stub_config, args.repeats, args.num_parallel))
+    print("Пул серверов Ollama...", file=sys.stderr)
+    results.extend(bench_endpoints(sample, stub_config, args.repeats, args.num_parallel))
+    print("Переиспользование префикса промпта...", file=sys.stderr)
+    if args.ollama_url:
+        results.extend(bench_prompt_cache(args.ollama_url, sample, args.model, args.repeats))
+    else:
+        with StubOllamaServer(stub_config) as server:
+            results.extend(bench_prompt_cache(server.url, sample, args.model, args.repeats))
+    results.extend(bench_export(stub_config.response * 20, args.font, args.repeats))
+    print("Пометки на чертеже...", file=sys.stderr)
+    results.extend(bench_annotate(sample, args.repeats))
+
+    regressions = compare(results, args.compare, args.threshold) if args.compare else []
+    output = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "pymupdf": fitz.VersionBind,
+            "repeats": args.repeats,
+            "round_trip_file": os.path.basename(sample),
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(output, f, ensure_ascii=False, indent=1)
+
+    for record in results:
+        if "error" in record:
+            print(f"{record['scenario']:24} ошибка: {record['error']}", file=sys.stderr)
+            continue
+        where = " ".join(str(record[k]) for k in ("size", "sheets", "kind") if k in record)
+        ratio = f"  x{record['ratio']}" if "ratio" in record else ""
+        if "prompt_eval_s" in record:
+            ratio += f"  промпт {record['prompt_eval_s'] * 1000:.1f} мс, {record['prompt_eval_tokens']} ток."
+        if "prompt_eval_saved" in record:
+            ratio += f", экономия {record['prompt_eval_saved']:.0%}"
+        print(f"{record['scenario']:24} {where:18} {record['median_s'] * 1000:9.1f} мс{ratio}", file=sys.stderr)
+    print(f"Результаты: {args.output}", file=sys.stderr)
+    if regressions:
+        print(f"Регрессий: {len(regressions)} (порог x{args.threshold})", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""Разбиение текста чертежа на части под контекстное окно модели.
+
+Текст документа хранится с разделителями PyMuPDF: листы разделены символом
+PAGE_SEP, текстовые блоки листа - BLOCK_SEP. Части собираются из целых блоков,
+блок режется только если сам не помещается в бюджет.
+"""
+import math
+import re
+
+PAGE_SEP = "\f"
+BLOCK_SEP = "\n\n"
+
+# Контекст Ollama по умолчанию, если для модели не задан свой (num_ctx)
+DEFAULT_CONTEXT = 2048
+MAX_CONTEXT = 8192  # больше не запрашиваем: растет расход памяти на KV-кэш
+# Контекстные окна семейств моделей (по имени до двоеточия)
+MODEL_CONTEXT = {
+    "llama2": 4096,
+    "tinyllama": 2048,
+    "qwen": 8192,
+    "llama3": 8192,
+    "llava": 4096,
+    "bakllava": 4096,
+}
+IMAGE_TOKENS = 576  # токенов на изображение у llava-подобных моделей
+RESERVE_TOKENS = 64  # запас на неточность оценки
+MIN_TEXT_TOKENS = 200  # меньше на текст чертежа в запросе не оставляем
+
+_TOKEN = re.compile(r"[А-Яа-яЁё]+|[A-Za-z]+|\d+|[^\w\s]")
+
+
+def estimate_tokens(text):
+    """Грубая оценка числа токенов: кириллица дробится токенизаторами сильнее латиницы"""
+    tokens = 0
+    for match in _TOKEN.finditer(text):
+        word = match.group()
+        if word[0].isdigit():
+            tokens += math.ceil(len(word) / 2)
+        elif word[0].isalpha():
+            per_token = 4 if word[0].isascii() else 2
+            tokens += math.ceil(len(word) / per_token)
+        else:
+            tokens += 1
+    return tokens
+
+
+def context_window(model, options=None):
+    """Контекст модели в токенах: явный num_ctx или известное окно семейства"""
+    if options and options.get("num_ctx"):
+        return options["num_ctx"]
+    family = model.split(":")[0].split("/")[-1]
+    return min(MODEL_CONTEXT.get(family, DEFAULT_CONTEXT), MAX_CONTEXT)
+
+
+def text_budget(context, prompt_tokens, num_predict, images=0):
+    """Сколько токенов остается на текст чертежа в одном запросе (меньше нуля - переполнение)"""
+    return context - prompt_tokens - num_predict - images * IMAGE_TOKENS - RESERVE_TOKENS
+
+
+def image_limit(context, prompt_tokens, num_predict):
+    """Сколько изображений помещается в окно рядом с промптом, ответом и текстом (не меньше одного)"""
+    return max(1, (text_budget(context, prompt_tokens, num_predict) - MIN_TEXT_TOKENS) // IMAGE_TOKENS)
+
+
+def fit_context(context, prompt_tokens, num_predict, images=0):
+    """Контекст и число изображений, при которых на текст остается не меньше MIN_TEXT_TOKENS.
+
+    Сначала num_ctx удваивается до MAX_CONTEXT (другой num_ctx - перезагрузка модели
+    в Ollama, поэтому шаги крупные), затем отбрасываются последние изображения.
+    Возвращает (num_ctx, изображений, бюджет текста) или None, если не помещается
+    даже промпт без изображений: иначе Ollama молча обрежет начало промпта.
+    """
+    for count in range(images, -1, -1):
+        num_ctx = context
+        while text_budget(num_ctx, prompt_tokens, num_predict, count) < MIN_TEXT_TOKENS and num_ctx < MAX_CONTEXT:
+            num_ctx = min(num_ctx * 2, MAX_CONTEXT)
+        budget = text_budget(num_ctx, prompt_tokens, num_predict, count)
+        if budget >= MIN_TEXT_TOKENS:
+            return num_ctx, count, budget
+    return None
+
+
+def join_blocks(pages):
+    """Текст документа из блоков по листам (список списков строк)"""
+    return PAGE_SEP.join(BLOCK_SEP.join(blocks) for blocks in pages)
+
+
+def split_blocks(text):
+    """Обратное join_blocks: [(номер листа, текст блока), ...]"""
+    blocks = []
+    for page_num, page_text in enumerate(text.split(PAGE_SEP)):
+        for block in page_text.split(BLOCK_SEP):
+            if block.strip():
+                blocks.append((page_num, block.strip()))
+    return blocks
+
+
+def _split_long_block(block, budget):
+    """Блок больше бюджета режется по строкам, а строка - по символам"""
+    pieces = []
+    current = []
+    current_tokens = 0
+    for line in block.split("\n"):
+        tokens = estimate_tokens(line)
+        while tokens > budget:
+            cut = max(1, len(line) * budget // tokens)
+            pieces.append(line[:cut])
+            line = line[cut:]
+            tokens = estimate_tokens(line)
+        if current and current_tokens + tokens > budget:
+            pieces.append("\n".join(current))
+            current, current_tokens = [], 0
+        current.append(line)
+        current_tokens += tokens
+    if current:
+        pieces.append("\n".join(current))
+    return pieces
+
+
+def iter_chunks(text, budget):
+    """Части текста не больше budget токенов (генератор).
+
+    Если в документе несколько листов, перед первым блоком каждого листа в части
+    ставится метка [Лист N], чтобы модель знала, откуда текст.
+    """
+    blocks = split_blocks(text)
+    multi_page = len({page_num for page_num, _ in blocks}) > 1
+    current = []
+    current_tokens = 0
+    current_page = None
+    for page_num, block in blocks:
+        for piece in (_split_long_block(block, budget) if estimate_tokens(block) > budget else [block]):
+            if multi_page and page_num != current_page:
+                piece = f"[Лист {page_num + 1}]\n{piece}"
+            tokens = estimate_tokens(piece)
+            if current and current_tokens + tokens > budget:
+                yield BLOCK_SEP.join(current)
+                current, current_tokens = [], 0
+            if multi_page and not current and page_num == current_page:
+                piece = f"[Лист {page_num + 1}, продолжение]\n{piece}"
+                tokens = estimate_tokens(piece)
+            current.append(piece)
+            current_tokens += tokens
+            current_page = page_num
+    if current:
+        yield BLOCK_SEP.join(current)
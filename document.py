@@ -0,0 +1,200 @@
+"""Сессия документа PDF: один fitz.open на файл и общий кэш страниц и растров."""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import fitz  # PyMuPDF
+
+import chunking
+import spans
+
+DEFAULT_PIXMAP_CACHE_BYTES = 256 * 1024 * 1024
+
+
+def pixmap_size(pix):
+    """Объем пикселей без копирования pix.samples"""
+    return pix.stride * pix.height
+
+
+def _rounded(value):
+    """Числа во вложенных кортежах, округленные до 0,1"""
+    if isinstance(value, (int, float)):
+        return round(value, 1)
+    if isinstance(value, (tuple, list)):
+        return tuple(_rounded(v) for v in value)
+    return value
+
+
+class DocumentSession:
+    """Открывает PDF один раз и раздает страницы, текст и растры из кэша.
+
+    Растры кэшируются по ключу (страница, dpi, область, цветовое пространство)
+    в LRU с ограничением по суммарному объему пикселей. Документ PyMuPDF не
+    потокобезопасен, поэтому все обращения к нему идут под блокировкой.
+    Открытие, извлечение текста и растеризация (без попаданий в кэш)
+    записываются спанами в tracer; его можно заменить перед проверкой.
+    """
+
+    def __init__(self, pdf_path, max_pixmap_bytes=DEFAULT_PIXMAP_CACHE_BYTES, tracer=None):
+        self.pdf_path = pdf_path
+        self.max_pixmap_bytes = max_pixmap_bytes
+        self.tracer = tracer or spans.NULL_TRACER
+        started = time.perf_counter()
+        self.doc = fitz.open(pdf_path)
+        self.open_time = time.perf_counter() - started
+        self.tracer.add(spans.PDF_OPEN, self.open_time, self.tracer.elapsed() - self.open_time,
+                        pages=len(self.doc))
+        self._lock = threading.RLock()
+        self._pages = {}
+        self._texts = {}
+        self._rects = {}  # размеры листов: читаются без блокировки (предпросмотр в потоке Tk)
+        self._pixmaps = OrderedDict()
+        self._pixmap_bytes = 0
+        self.pixmap_hits = 0
+        self.pixmap_misses = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.doc)
+
+    @property
+    def page_count(self):
+        return len(self.doc)
+
+    def close(self):
+        with self._lock:
+            self._pages.clear()
+            self._texts.clear()
+            self._pixmaps.clear()
+            self._pixmap_bytes = 0
+            if not self.doc.is_closed:
+                self.doc.close()
+
+    def page(self, page_num):
+        """Разобранная страница (загружается один раз)"""
+        with self._lock:
+            page = self._pages.get(page_num)
+            if page is None:
+                page = self.doc.load_page(page_num)
+                self._pages[page_num] = page
+            return page
+
+    def page_text(self, page_num, option="text"):
+        with self._lock:
+            key = (page_num, option)
+            if key not in self._texts:
+                with self.tracer.span(spans.TEXT, page=page_num, option=option):
+                    self._texts[key] = self.page(page_num).get_text(option)
+            return self._texts[key]
+
+    def page_blocks(self, page_num):
+        """Текстовые блоки страницы в порядке PyMuPDF"""
+        with self._lock:
+            key = (page_num, "blocks")
+            if key not in self._texts:
+                with self.tracer.span(spans.TEXT, page=page_num, option="blocks"):
+                    self._texts[key] = [block[4].strip() for block in self.page(page_num).get_text("blocks")
+                                        if block[6] == 0 and block[4].strip()]
+            return self._texts[key]
+
+    def page_fingerprint(self, page_num):
+        """Отпечаток содержимого листа: текст, векторные пути и изображения.
+
+        Не зависит от имени файла, метаданных и других листов, поэтому у
+        неизмененного листа новой ревизии чертежа отпечаток тот же.
+        """
+        with self._lock:
+            key = (page_num, "fingerprint")
+            if key in self._texts:
+                return self._texts[key]
+            page = self.page(page_num)
+            digest = hashlib.sha256()
+            for block in self.page_blocks(page_num):
+                digest.update(block.encode("utf-8"))
+                digest.update(b"\0")
+            # Пути с координатами, округленными до 0,1 пт: переэкспорт из САПР дает шум в знаках
+            for path in page.get_cdrawings():
+                digest.update(repr((path.get("type"), path.get("color"), path.get("fill"),
+                                    path.get("width"), path.get("dashes"))).encode("utf-8"))
+                for item in path["items"]:
+                    digest.update(item[0].encode("ascii"))
+                    digest.update(repr(_rounded(item[1:])).encode("ascii"))
+            for image in page.get_image_info(hashes=True):
+                digest.update(image["digest"])
+                digest.update(repr(_rounded(image["bbox"])).encode("ascii"))
+            self._texts[key] = digest.hexdigest()
+            return self._texts[key]
+
+    def text(self, max_pages=None):
+        """Текст первых max_pages страниц (всех, если None) с границами листов и блоков"""
+        count = self.page_count if max_pages is None else min(self.page_count, max_pages)
+        return chunking.join_blocks(self.page_blocks(page_num) for page_num in range(count))
+
+    def pixmap(self, page_num, dpi=150, clip=None, colorspace=None):
+        """Растр страницы или ее области clip (fitz.Rect) из кэша"""
+        cs_name = colorspace.name if colorspace is not None else "RGB"
+        clip_key = tuple(round(v, 2) for v in clip) if clip is not None else None
+        key = (page_num, dpi, clip_key, cs_name)
+        with self._lock:
+            pix = self._pixmaps.get(key)
+            if pix is not None:
+                self._pixmaps.move_to_end(key)
+                self.pixmap_hits += 1
+                return pix
+            self.pixmap_misses += 1
+            kwargs = {"dpi": dpi}
+            if clip is not None:
+                kwargs["clip"] = clip
+            if colorspace is not None:
+                kwargs["colorspace"] = colorspace
+            with self.tracer.span(spans.RASTER, page=page_num, dpi=dpi) as attrs:
+                pix = self.page(page_num).get_pixmap(**kwargs)
+                attrs["pixels"] = pix.width * pix.height
+            size = pixmap_size(pix)
+            if size <= self.max_pixmap_bytes:
+                self._pixmaps[key] = pix
+                self._pixmap_bytes += size
+                self._evict()
+            return pix
+
+    def page_rect(self, page_num):
+        """Размер листа в пунктах (с учетом поворота)"""
+        rect = self._rects.get(page_num)
+        if rect is None:
+            with self._lock:
+                rect = self._rects[page_num] = fitz.Rect(self.page(page_num).rect)
+        return rect
+
+    def known_page_rect(self, page_num):
+        """Размер листа, если он уже известен, иначе None; не ждет блокировку документа"""
+        return self._rects.get(page_num)
+
+    def render(self, page_num, zoom, clip=None):
+        """Растр без кэша сессии: предпросмотр держит свой кэш миниатюр и плиток.
+
+        zoom - пикселей на пункт (матрица рендеринга), clip - область листа.
+        """
+        with self._lock:
+            kwargs = {"matrix": fitz.Matrix(zoom, zoom)}
+            if clip is not None:
+                kwargs["clip"] = clip
+            with self.tracer.span(spans.RASTER, page=page_num, dpi=round(zoom * 72)) as attrs:
+                pix = self.page(page_num).get_pixmap(**kwargs)
+                attrs["pixels"] = pix.width * pix.height
+            return pix
+
+    def _evict(self):
+        while self._pixmap_bytes > self.max_pixmap_bytes and self._pixmaps:
+            _, pix = self._pixmaps.popitem(last=False)
+            self._pixmap_bytes -= pixmap_size(pix)
+
+    def cache_info(self):
+        with self._lock:
+            return {"pixmaps": len(self._pixmaps), "bytes": self._pixmap_bytes,
+                    "hits": self.pixmap_hits, "misses": self.pixmap_misses}
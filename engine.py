@@ -0,0 +1,1315 @@
+"""Движок проверки чертежей без GUI: извлечение, анализ в Ollama, пакетный режим.
+
+Режимы: fast - текстовая модель по тексту, full - vision-модель с изображениями,
+cascade - сначала легкая текстовая модель, vision-модель только для графики и
+пунктов, которые текстовая модель не смогла решить.
+
+Запуск из командной строки:
+    python engine.py drawings/ -o results.jsonl --mode fast --jobs 4 --inflight 2
+"""
+import argparse
+import copy
+import functools
+import glob
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, as_completed, wait)
+
+import requests
+from urllib3.exceptions import ReadTimeoutError
+
+import chunking
+import findings
+import gost_index
+import image_pipeline
+import ollama_client
+import report
+import result_cache
+import spans
+import title_block
+from document import DocumentSession
+
+OLLAMA_URL = ollama_client.OLLAMA_URL
+
+# Версия шаблонов промптов: увеличивать при любом изменении текста промптов или обрезки,
+# чтобы старые ответы в кэше результатов не использовались
+PROMPT_VERSION = "11"
+
+# Промпт делится на постоянный префикс (system: роль, ссылки на ГОСТ, критерии, формат
+# ответа) и переменную часть (prompt: факты правил и текст листа). Префикс идет первым и
+# зависит только от набора критериев, решенных правилами, поэтому Ollama переиспользует
+# его KV-кэш в следующих запросах и заново обрабатывает только текст. Все, что меняется
+# от листа к листу, должно быть только в prompt - в том числе найденные пункты ГОСТ.
+GOST_LINKS = """В поле gost каждого замечания укажи ГОСТ:
+- ГОСТ 2.308-2011: https://meganorm.ru/Data2/1/4293800/4293800222.pdf (допуски формы)
+- ГОСТ 2.307-2011: https://meganorm.ru/Data2/1/4293800/4293800223.pdf (размеры)
+- ГОСТ 2.309-73: https://www.ntcexpert.ru/documents/GOST_2.309.pdf (шероховатость)
+- ГОСТ 2.104-2006: https://meganorm.ru/Data2/1/4293850/4293850184.pdf (основные надписи)"""
+
+# Со своим индексом стандартов (gost_index) модель ссылается на пункты из выдержек в prompt
+GOST_CITATIONS = """В поле gost каждого замечания укажи пункт стандарта из раздела НОРМЫ в формате "ГОСТ 2.307-2011, п. 4.1".
+Не ссылайся на пункты, которых нет в разделе НОРМЫ."""
+
+NORMS = """
+НОРМЫ (выдержки из ГОСТ):
+{clauses}
+"""
+
+FAST_SYSTEM = """ТЫ: Эксперт ГОСТ. Проанализируй чертеж быстро, включая текст и графику.
+
+{references}
+
+КРИТЕРИИ:
+{criteria}
+
+Если есть изображение: опиши графику, проверь положение элементов, сравни с текстом.
+
+{answer_format}
+
+ТОЛЬКО РУССКИЙ ЯЗЫК. КРАТКО.
+"""
+
+FAST_PROMPT = """{known}{norms}
+ТЕКСТ: {text}
+"""
+
+# Пункты критериев: (идентификаторы критериев, текст). Пункт выпадает из промпта,
+# если все его критерии уже решены правилами title_block
+FAST_CRITERIA = [
+    ({"title_block", "signatures"}, "- Основная надпись (наименование, код, подписи)"),
+    ({"doc_code"}, "- Соответствие кода документа (СБ, ВО, ГЧ, МЧ)"),
+    ({"title_block"}, "- Обязательные реквизиты (масса, масштаб)"),
+    ({"graphics"}, "- Положение деталей: проверка размеров на полках линий-выносок, угловые размеры в зоне 30°, дополнительные стрелки для допусков"),
+    ({"symbols"}, "- Шероховатость: наличие знака √ в скобках"),
+    ({"graphics"}, "- Позиции фигур: наличие буквенных обозначений баз (A, B и т.д.), их соответствие в рамках"),
+]
+
+STANDARD_SYSTEM = """ТЫ: Эксперт по технической документации и российским стандартам ГОСТ. Твоя задача - анализировать чертежи на соответствие ГОСТ, включая текст и графику (положение деталей, фигур, размеров).
+
+{references}
+
+АНАЛИЗИРУЙ чертеж и проверь соответствие ГОСТ по следующим критериям:
+
+{criteria}
+
+Если есть изображение: опиши видимые элементы, проверь позиции, сравни с требованиями ГОСТ.
+
+{answer_format}
+
+ОТВЕЧАЙ ТОЛЬКО НА РУССКОМ ЯЗЫКЕ.
+"""
+
+STANDARD_PROMPT = """{known}{norms}
+ТЕКСТ ЧЕРТЕЖА ДЛЯ АНАЛИЗА:
+{text}
+"""
+
+STANDARD_CRITERIA = [
+    ({"title_block", "signatures"}, """ОСНОВНАЯ НАДПИСЬ - наличие и правильность заполнения:
+   - Наименование изделия
+   - Обозначение документа (код: СБ, ВО, ГЧ, МЧ и т.д.)
+   - Подписи (Разраб., Пров., Т.контр., Н.контр., Утв.)
+   - Масса, масштаб, листы
+"""),
+    ({"doc_code"}, """КОД ДОКУМЕНТА - соответствие наименованию:
+   - СБ = Сборочный чертеж
+   - ВО = Чертеж общего вида
+   - ГЧ = Габаритный чертеж
+   - МЧ = Монтажный чертеж
+"""),
+    ({"tech_requirements"}, """ТЕХНИЧЕСКИЕ ТРЕБОВАНИЯ:
+   - Расположение над основной надписью
+   - Ширина не более 185 мм
+"""),
+    ({"symbols"}, """ОБОЗНАЧЕНИЯ И СИМВОЛЫ:
+   - Буквенные обозначения в технических требованиях
+   - Символы *, **, ***
+   - Знак √ в скобках для шероховатости
+"""),
+    ({"graphics"}, """ГРАФИКА И ПОЛОЖЕНИЕ:
+   - Простановка размеров на полке линии-выноски (в зоне 30°)
+   - Угловые размеры в зоне 30°
+   - Дополнительные стрелки для допусков формы (ГОСТ 2.308)
+   - Соответствие буквенных обозначений баз в рамках
+"""),
+    ({"views"}, """ПОЛОЖЕНИЕ ВИДОВ И ФИГУР:
+   - Положение фигур, деталей: сравни с текстом, выяви несоответствия (например, Ra на поверхностях)
+"""),
+]
+
+# Ответ - JSON по findings.SCHEMA (поле format запроса): без оформления текста модель
+# генерирует меньше токенов, а замечания разбираются в объекты findings.Finding
+ANSWER_FORMAT = """ОТВЕТ - JSON:
+- verdict: "ДА" или "НЕТ" (соответствует ли чертеж по проверяемым критериям);
+- summary: общий вывод, 1-2 предложения;
+- findings: только несоответствия и сомнительные пункты, не больше {max_findings}, сначала критические;
+  для каждого: item (пункт проверки), status, location (где на листе: графа, вид, зона),
+  quote (цитата с чертежа), gost (ГОСТ и пункт), severity ("критическое" или "рекомендация"), recommendation (как исправить).
+Пункт, который нельзя решить по имеющимся данным, - status "не определено".
+Если несоответствий нет, findings - пустой список.""".format(max_findings=findings.MAX_FINDINGS)
+
+# Каскад: пункты, которые текстовая модель не решила, уходят vision-модели в prompt
+RECHECK = """
+ПЕРЕПРОВЕРЬ ПО ИЗОБРАЖЕНИЮ (по тексту решить не удалось):
+{items}
+"""
+RECHECK_CRITERION = """СОМНИТЕЛЬНЫЕ ПУНКТЫ из раздела ПЕРЕПРОВЕРЬ: подтверди или сними каждый по изображению
+"""
+
+CHUNK_NOTE = """ЭТО ЧАСТЬ {index} ИЗ {total} ТЕКСТА ЧЕРТЕЖА. Остальные части проверяются отдельно:
+не считай отсутствующим то, чего нет в этой части, оценивай только то, что в ней есть.
+"""
+
+QUERY_CHARS = 4000  # сколько текста чертежа идет в запрос к индексу ГОСТ
+CLAUSE_SHARE = 0.15  # доля контекста модели на выдержки ГОСТ: лишние пункты не берутся
+
+KNOWN_FACTS = """
+УЖЕ ПРОВЕРЕНО АВТОМАТИЧЕСКИ (не перепроверяй и не включай в ответ):
+{facts}
+"""
+
+CASCADE = "cascade"
+GRAPHIC_CRITERIA = {"graphics", "views"}  # в каскаде сразу идут vision-модели
+TEXT_CRITERIA = {i for ids, _ in FAST_CRITERIA + STANDARD_CRITERIA for i in ids} - GRAPHIC_CRITERIA
+
+# Таймаут чтения ответа, пока скорость модели не измерена (потом - по токенам/с, ollama_client)
+CONNECT_TIMEOUT = 30
+FAST_TIMEOUT = 60
+STANDARD_TIMEOUT = 120
+
+# num_predict - под ответ по findings.SCHEMA: сводка и 3-4 замечания (кириллица ~2 символа
+# на токен, поля ограничены findings.MAX_CHARS); оборванный ответ разбирается до последнего
+# полного замечания
+FAST_OPTIONS = {
+    "temperature": 0.05,
+    "num_predict": 600,
+    "top_k": 20,
+    "repeat_penalty": 1.1
+}
+
+STANDARD_OPTIONS = {
+    "temperature": 0.1,
+    "num_predict": 900,
+    "top_p": 0.8,
+    "repeat_penalty": 1.2
+}
+
+
+def pending_criteria(mode, rules=None, only=None):
+    """Критерии, не решенные правилами (тексты пунктов промпта); only - только из этих идентификаторов"""
+    decided = rules.decided_criteria() if rules else set()
+    criteria = FAST_CRITERIA if mode == "fast" else STANDARD_CRITERIA
+    if mode == "fast" and only is not None:
+        # Текстовая ступень каскада: критерии полной проверки, которых нет в быстрой
+        # (технические требования), тоже проверяются, иначе их не проверит никто
+        covered = set().union(*(ids for ids, _ in FAST_CRITERIA))
+        criteria = criteria + [(ids, "- " + body.rstrip()) for ids, body in STANDARD_CRITERIA
+                               if not ids <= covered]
+    return [body for ids, body in criteria
+            if not ids <= decided and (only is None or ids & only)]
+
+
+def build_prompt(mode, text, rules=None, clauses=None, only=None, recheck=None):
+    """(system, prompt) только из критериев, не решенных правилами. None - спрашивать модель не о чем.
+
+    system - постоянный префикс (одинаков для листов с одинаковым набором решенных
+    критериев), prompt - факты правил, выдержки ГОСТ и текст. clauses - найденные
+    пункты ГОСТ (gost_index.GostIndex.search); None - индекса нет, в system ссылки на ГОСТ.
+    only - идентификаторы критериев, которые проверять (None - все), recheck -
+    сомнительные замечания (findings.Finding) для перепроверки в каскаде.
+    """
+    facts = rules.prompt_facts() if rules else ""
+    known = KNOWN_FACTS.format(facts=facts) if facts else ""
+    if recheck:
+        known += RECHECK.format(items="\n".join(finding.format() for finding in recheck))
+    references = GOST_LINKS if clauses is None else GOST_CITATIONS
+    norms = NORMS.format(clauses=gost_index.format_clauses(clauses)) if clauses else ""
+    criteria = pending_criteria(mode, rules, only)
+    if recheck:
+        criteria.append(RECHECK_CRITERION)
+    if not criteria:
+        return None
+    if mode == "fast":
+        return (FAST_SYSTEM.format(references=references, criteria="\n".join(criteria),
+                                   answer_format=ANSWER_FORMAT),
+                FAST_PROMPT.format(known=known, norms=norms, text=text))
+
+    system = STANDARD_SYSTEM.format(
+        references=references,
+        criteria="\n\n".join(f"{i}. {body.rstrip()}" for i, body in enumerate(criteria, 1)),
+        answer_format=ANSWER_FORMAT
+    )
+    return system, STANDARD_PROMPT.format(known=known, norms=norms, text=text)
+
+
+def with_rules(rules, result):
+    """Analysis с пунктами, решенными правилами, перед замечаниями модели.
+
+    result - Analysis модели или None, если модели проверять было нечего.
+    """
+    rule_findings = [findings.Finding.from_rule(r) for r in rules.results] if rules else []
+    if result is None:
+        return findings.Analysis(overall_verdict([], rules) if rules and rules.decided() else None,
+                                 findings=rule_findings)
+    return findings.Analysis(overall_verdict([result], rules), result.summary,
+                             rule_findings + result.findings, result.note)
+
+
+def stream_lines(response):
+    """Строки потокового ответа; таймаут чтения - requests.exceptions.ReadTimeout, как без потока"""
+    try:
+        yield from response.iter_lines()
+    except requests.exceptions.ConnectionError as e:
+        # requests отдает таймаут чтения из iter_content как ConnectionError
+        if e.args and isinstance(e.args[0], ReadTimeoutError):
+            raise requests.exceptions.ReadTimeout(e, response=response) from e
+        raise
+
+
+def needs_images(rules):
+    """Изображения нужны, пока правила решили не все графические критерии.
+
+    geometry проверяет по векторам только пункты "graphics"; положение видов и
+    знаки Ra ("views") видит лишь vision-модель.
+    """
+    return rules is None or not GRAPHIC_CRITERIA <= rules.decided_criteria()
+
+
+def graphic_pages(rules, page_nums):
+    """Листы, графику которых правила не проверили; если проверена вся - все листы
+    (vision-модель перепроверяет по ним сомнительные пункты)"""
+    pages = [n for n in page_nums if needs_images(rules.for_page(n) if rules else None)]
+    return pages or list(page_nums)
+
+
+def extract_text(session, max_pages=3):
+    return session.text(max_pages)
+
+
+def extract_page_images(session, max_pages=3, config=None, rules=None):
+    """Изображения значимых областей по листам (список PageImages); с rules - только graphic_pages"""
+    count = session.page_count if max_pages is None else min(session.page_count, max_pages)
+    return image_pipeline.render_pages(session, graphic_pages(rules, range(count)), config)
+
+
+def extract_images(session, max_pages=3, config=None):
+    return image_pipeline.ordered_images(extract_page_images(session, max_pages, config))
+
+
+def extract_text_from_pdf(pdf_path, max_pages=3):
+    """Текст из файла или из уже открытой DocumentSession"""
+    try:
+        if isinstance(pdf_path, DocumentSession):
+            return extract_text(pdf_path, max_pages)
+        with DocumentSession(pdf_path) as session:
+            return extract_text(session, max_pages)
+    except Exception as e:
+        return f"Ошибка извлечения текста: {str(e)}"
+
+
+def extract_page_images_from_pdf(pdf_path, max_pages=3, config=None, rules=None):
+    """Изображения по листам из файла или из уже открытой DocumentSession"""
+    try:
+        if isinstance(pdf_path, DocumentSession):
+            return extract_page_images(pdf_path, max_pages, config, rules)
+        with DocumentSession(pdf_path) as session:
+            return extract_page_images(session, max_pages, config, rules)
+    except Exception as e:
+        return f"Ошибка извлечения изображений: {str(e)}"
+
+
+def extract_drawing(pdf_path, include_graphics=False, max_pages=3, image_config=None, per_page=False,
+                    cascade=False):
+    """Извлекает текст и графику одного чертежа (выполняется в процессе пула).
+
+    cascade - листы не рендерятся: BatchChecker рендерит их (render_drawing_images),
+    только если каскад дойдет до vision-модели; в graphic_pages - какие листы.
+    """
+    started = time.time()
+    tracer = spans.Tracer()
+    record = {"file": pdf_path, "text": "", "images": None, "error": None, "sha256": None,
+              "rules": None, "spans": tracer.spans}
+    try:
+        record["sha256"] = result_cache.file_sha256(pdf_path)
+        session = DocumentSession(pdf_path, tracer=tracer)
+    except Exception as e:
+        record["error"] = f"Ошибка открытия файла: {str(e)}"
+        record["extract_time"] = round(time.time() - started, 3)
+        return record
+    with session:
+        try:
+            with tracer.span(spans.RULES):
+                record["rules"] = title_block.check_document(session, max_pages)
+        except Exception:
+            record["rules"] = None  # правила не критичны, пункты уйдут в модель
+        if per_page:
+            try:
+                jobs = extract_page_jobs(session, include_graphics and not cascade, image_config, max_pages,
+                                         record["rules"])
+            except Exception as e:
+                record["error"] = f"Ошибка извлечения листов: {str(e)}"
+                jobs = []
+            record["jobs"] = jobs
+            record["text"] = "".join(job.text for job in jobs)
+            if include_graphics and not cascade:
+                record["images"] = [image for job in jobs for image in job.images or []]
+                record["image_bytes"] = [job.image_bytes for job in jobs]
+            record["extract_time"] = round(time.time() - started, 3)
+            return record
+        record["text"] = extract_text_from_pdf(session, max_pages)
+        if include_graphics and cascade:
+            count = session.page_count if max_pages is None else min(session.page_count, max_pages)
+            record["graphic_pages"] = graphic_pages(record["rules"], range(count))
+        elif include_graphics and needs_images(record["rules"]):
+            pages = extract_page_images_from_pdf(session, max_pages, image_config, record["rules"])
+            if isinstance(pages, str):
+                record["error"] = pages
+            else:
+                record["images"] = image_pipeline.ordered_images(pages)
+                record["image_bytes"] = [page.total_bytes for page in pages]
+    record["extract_time"] = round(time.time() - started, 3)
+    return record
+
+
+def render_drawing_images(pdf_path, page_nums, config=None):
+    """Рендер листов для каскада пакета (в процессе пула): {"images", "image_bytes", "spans"}"""
+    tracer = spans.Tracer()
+    with DocumentSession(pdf_path, tracer=tracer) as session:
+        pages = image_pipeline.render_pages(session, page_nums, config)
+    return {"images": image_pipeline.ordered_images(pages),
+            "image_bytes": [page.total_bytes for page in pages], "spans": tracer.spans}
+
+
+class PageJob:
+    """Данные одного листа для отдельного запроса к модели"""
+
+    def __init__(self, page_num, text, images=None, image_bytes=0):
+        self.page_num = page_num
+        self.text = text
+        self.images = images
+        self.image_bytes = image_bytes
+
+
+def _render_images(session, page_num, config):
+    return image_pipeline.render_page(session, page_num, config).images
+
+
+def extract_page_jobs(session, include_graphics=False, image_config=None, max_pages=None, rules=None,
+                      pages=None, lazy=False):
+    """Задания по листам (все листы, если max_pages=None; pages - только эти листы).
+
+    Листы, графика которых проверена правилами, не рендерятся. lazy=True (каскад) -
+    вместо изображений функция, которая отрендерит лист, когда он понадобится
+    vision-модели; сессия должна быть открыта до конца проверки.
+    """
+    if pages is None:
+        count = session.page_count if max_pages is None else min(session.page_count, max_pages)
+        pages = range(count)
+    jobs = []
+    for page_num in pages:
+        job = PageJob(page_num, chunking.BLOCK_SEP.join(session.page_blocks(page_num)))
+        if lazy:
+            job.images = functools.partial(_render_images, session, page_num, image_config)
+        elif include_graphics and needs_images(rules.for_page(page_num) if rules else None):
+            page_images = image_pipeline.render_page(session, page_num, image_config)
+            job.images = page_images.images
+            job.image_bytes = page_images.total_bytes
+        jobs.append(job)
+    return jobs
+
+
+VERDICT = re.compile(r"СООТВЕТСТВИЕ:\s*\[?\s*(ДА|НЕТ)", re.IGNORECASE)
+
+
+def result_verdict(result):
+    """ДА/НЕТ по ответу модели (Analysis или текст) или None, если вывода в ответе нет.
+
+    В сводном ответе (по частям или листам) достаточно одного НЕТ.
+    """
+    if isinstance(result, findings.Analysis):
+        if result.verdict:
+            return result.verdict if result.verdict in ("ДА", "НЕТ") else None
+        result = result.note
+    verdicts = [verdict.upper() for verdict in VERDICT.findall(result)]
+    if "НЕТ" in verdicts:
+        return "НЕТ"
+    return "ДА" if verdicts else None
+
+
+def overall_verdict(results, rules=None):
+    """Общий вывод по частичным ответам (None - часть решена правилами)"""
+    verdicts = [result_verdict(result) for result in results if result is not None]
+    rules_failed = rules is not None and any(r.status == title_block.FAIL for r in rules.results)
+    if rules_failed or "НЕТ" in verdicts:
+        return "НЕТ"
+    if None in verdicts:
+        return "НЕ ОПРЕДЕЛЕНО"
+    return "ДА"
+
+
+def combine(results, summary, rules=None, label=None, sheets=False):
+    """Один Analysis из ответов по листам или частям текста {номер: Analysis или None}.
+
+    label(номер) - заголовок текста без структуры (ошибки) в сводке; sheets=True -
+    номера - листы, замечания без листа к ним привязываются.
+    """
+    parts = []
+    notes = []
+    for key in sorted(results):
+        result = results[key]
+        if result is None:
+            continue
+        for finding in result.findings:
+            if sheets and finding.sheet is None:
+                finding.sheet = key
+            parts.append(finding)
+        if result.note:
+            notes.append(f"=== {label(key)} ===\n{result.note}" if label else result.note)
+    combined = findings.Analysis(overall_verdict(results.values(), rules), summary, parts,
+                                 "\n\n".join(notes))
+    return with_rules(rules, combined) if rules is not None else combined
+
+
+def merge_page_results(rules, results, reused=()):
+    """Сводит ответы по листам в один отчет с общим выводом.
+
+    reused - листы без изменений, ответы которых взяты из прошлой проверки.
+    """
+    summary = f"листов: {len(results)}"
+    if reused:
+        summary += (f"; изменено листов: {len(results) - len(reused)} из {len(results)}, без изменений "
+                    f"(результат прошлой проверки): {', '.join(str(n + 1) for n in sorted(reused))}")
+    summaries = [f"лист {n + 1}: {results[n].summary}" for n in sorted(results)
+                 if results[n] is not None and results[n].summary]
+    if summaries:
+        summary += ". " + "; ".join(summaries)
+    return combine(results, summary, rules, label=lambda n: f"ЛИСТ {n + 1}", sheets=True)
+
+
+def fallback_analysis(text_content):
+    checks = {
+        "Основная надпись": ["разраб", "пров", "лист", "листов", "масса", "масштаб"],
+        "Код документа": ["сб", "во", "гч", "мч", "рнат"],
+        "Подписи": ["разраб", "пров", "т.контр", "утв"],
+        "Графика": ["ra", "поверхность", "размер", "стрелка"]
+    }
+
+    result = "УПРОЩЕННЫЙ АНАЛИЗ (после таймаута):\n\n"
+    text_lower = text_content.lower()
+
+    for check_name, keywords in checks.items():
+        found = any(keyword in text_lower for keyword in keywords)
+        status = "✓ ЕСТЬ" if found else "✗ НЕТ"
+        result += f"{check_name}: {status}\n"
+
+    result += "\nПримечание: Полный анализ не удался из-за таймаута нейросети. Графика не проанализирована."
+    return result
+
+
+CANCELLED = "Проверка прервана пользователем"
+
+
+class CheckCancelled(Exception):
+    """Проверка остановлена пользователем во время запроса к модели"""
+
+
+class OllamaAnalyzer:
+    """Анализ чертежа в Ollama (быстрый и полный режимы)"""
+
+    def __init__(self, ollama_url=OLLAMA_URL, text_model="llama2:3b",
+                 vision_model="llava:7b", should_stop=None, progress=None, cache=None,
+                 stream=False, on_token=None, client=None, tracer=None, gost_index=None,
+                 top_k=gost_index.DEFAULT_TOP_K):
+        # client - общий OllamaClient (пул соединений, keep_alive); без него создается свой
+        self.client = client or ollama_client.OllamaClient(ollama_url)
+        # tracer - спаны HTTP-запросов и метрики Ollama (загрузка, промпт, генерация)
+        self.tracer = tracer or spans.NULL_TRACER
+        self.ollama_url = self.client.ollama_url
+        self.text_model = text_model
+        self.vision_model = vision_model
+        self.cache = cache
+        # gost_index - индекс пунктов ГОСТ: в промпт идут top_k пунктов, относящихся к чертежу
+        self.gost_index = gost_index
+        self.top_k = top_k
+        # should_stop - функция без аргументов, True если проверку надо прервать;
+        # cancel_token передается в запросы клиента, cancel() закрывает их соединения
+        self.cancel_token = ollama_client.CancelToken(should_stop)
+        self.progress = progress or (lambda message: None)
+        # Потоковый режим: ответ читается кусками NDJSON, каждый кусок передается в on_token
+        self.stream = stream
+        self.on_token = on_token or (lambda token: None)
+
+    def with_tracer(self, tracer):
+        """Копия анализатора со своим tracer (для параллельных файлов пакета).
+
+        Клиент, кэш и состояние отмены общие: cancel() исходного прерывает и копии.
+        """
+        analyzer = copy.copy(self)
+        analyzer.tracer = tracer
+        return analyzer
+
+    def cancel(self):
+        """Прерывает текущие запросы: закрывает соединения, Ollama перестает генерировать"""
+        self.cancel_token.cancel()
+
+    @property
+    def cancelled(self):
+        return self.cancel_token.cancelled
+
+    def image_limit(self):
+        """Лимит изображений на запрос: сколько их помещается в окно vision-модели при полной проверке"""
+        system, prompt = build_prompt("full", "")
+        context = chunking.context_window(self.vision_model)
+        prompt_tokens = chunking.estimate_tokens(system + prompt + CHUNK_NOTE)
+        if self.gost_index is not None:
+            prompt_tokens += int(context * CLAUSE_SHARE)
+        return chunking.image_limit(context, prompt_tokens, STANDARD_OPTIONS["num_predict"])
+
+    def template_version(self):
+        """Версия промптов и правил, а с индексом ГОСТ - и набор стандартов (для кэша и ревизий)"""
+        version = f"{PROMPT_VERSION}/{title_block.RULES_VERSION}"
+        if self.gost_index is not None:
+            version += f"/{self.gost_index.signature}/k{self.top_k}"
+        return version
+
+    def _find_clauses(self, mode, text_content, rules, only=None, max_tokens=None):
+        """Пункты ГОСТ к тексту и непроверенным критериям в пределах max_tokens; None - индекса нет"""
+        if self.gost_index is None:
+            return None
+        query = "\n".join(pending_criteria(mode, rules, only)) + "\n" + text_content[:QUERY_CHARS]
+        with self.tracer.span(spans.RETRIEVAL, k=self.top_k) as attrs:
+            found = self.gost_index.search(query, self.top_k)
+            if max_tokens is not None:
+                found = gost_index.fit_clauses(found, max_tokens)
+            attrs["found"] = len(found)
+        return found
+
+    def _cache_key(self, mode, payload, pdf_hash, pages):
+        if self.cache is None or not self.cache.enabled or not pdf_hash:
+            return None
+        images = payload.get("images")
+        if images:
+            # Вид изображений зависит от настроек конвейера, поэтому в ключ входит их хэш
+            digest = hashlib.sha256()
+            for image in images:
+                digest.update(image.encode("ascii"))
+            images = digest.hexdigest()
+        return result_cache.make_key(pdf_hash, payload["model"], mode, self.template_version(),
+                                     payload["options"], pages, images)
+
+    def _cached_response(self, key):
+        if key is None:
+            return None
+        response = self.cache.get(key)
+        if response is not None:
+            self.progress("Результат взят из кэша")
+        return response
+
+    def _post(self, payload, timeout, stream=False):
+        payload = dict(payload, keep_alive=self.client.keep_alive)
+        return self.client.post("/api/generate", payload, timeout, stream=stream, cancel=self.cancel_token)
+
+    def _generate(self, payload, timeout, empty_response, emit_tokens=True):
+        """Выполняет /api/generate. Возвращает (успех, текст ответа или ошибки)"""
+        if self.cancelled:
+            raise CheckCancelled()
+        start = self.tracer.elapsed()
+        model = payload["model"]
+        try:
+            with self.tracer.span(spans.HTTP, model=model, stream=self.stream,
+                                  images=len(payload.get("images") or []),
+                                  prompt_chars=len(payload.get("system", "")) + len(payload["prompt"]),
+                                  status="error") as attrs:
+                ok, result, data = self._send(payload, timeout, empty_response, emit_tokens)
+                attrs["status"] = "ok" if ok else result
+                if ok:
+                    self.client.record_speed(model, data)
+                metrics = self.tracer.add_ollama_metrics(data, start, model)
+                if metrics:
+                    attrs["server_s"] = round(metrics["total_s"], 6)
+            return ok, result
+        except (CheckCancelled, requests.exceptions.Timeout):
+            raise
+        except Exception:
+            # Сокет, закрытый из cancel(), проявляется как ошибка соединения
+            if self.cancelled:
+                raise CheckCancelled()
+            raise
+        finally:
+            self.cancel_token.release()
+
+    def _send(self, payload, timeout, empty_response, emit_tokens):
+        """Запрос и чтение ответа: (успех, текст, последний объект ответа с метриками)"""
+        if not self.stream:
+            response = self._post(payload, timeout)
+            if self.cancelled:
+                raise CheckCancelled()
+            if response.status_code == 200:
+                data = response.json()
+                return True, data.get("response", empty_response), data
+            return False, f"Ошибка API: {response.status_code}", {}
+
+        parts = []
+        data = {}
+        with self._post(dict(payload, stream=True), timeout, stream=True) as response:
+            if response.status_code != 200:
+                return False, f"Ошибка API: {response.status_code}", {}
+            for line in stream_lines(response):
+                if self.cancelled:
+                    raise CheckCancelled()
+                if not line:
+                    continue
+                data = json.loads(line)
+                if "error" in data:
+                    return False, f"Ошибка API: {data['error']}", {}
+                token = data.get("response", "")
+                if token:
+                    parts.append(token)
+                    if emit_tokens:
+                        self.on_token(token)
+                if data.get("done"):
+                    break
+        return True, "".join(parts) or empty_response, data
+
+    def _analyze(self, mode, text_content, base64_images, pdf_hash, pages, rules, single=True,
+                 only=None, recheck=None, model=None):
+        """Проверка текста моделью. Возвращает ответ без пунктов правил или None, если спрашивать не о чем.
+
+        Текст, не помещающийся в контекст модели, делится на части по блокам
+        PyMuPDF; части проверяются по очереди, выводы сводятся в общий.
+        single=False - запрос входит в постраничную проверку: токены не выводятся,
+        чтобы ответы параллельных листов не перемешивались. only и recheck - как
+        в build_prompt, model - модель вместо выбранной по наличию изображений.
+        """
+        if mode == CASCADE:
+            return self._cascade(text_content, base64_images, pdf_hash, pages, rules, single)
+        if not pending_criteria(mode, rules, only) and not recheck:
+            return None
+        if base64_images and not needs_images(rules) and not recheck:
+            base64_images = None  # графика уже проверена по векторам, vision-модель не нужна
+        model = model or (self.vision_model if base64_images else self.text_model)
+        options = FAST_OPTIONS if mode == "fast" else STANDARD_OPTIONS
+        context = chunking.context_window(model, options)
+        clauses = self._find_clauses(mode, text_content, rules, only, int(context * CLAUSE_SHARE))
+        if clauses and single:
+            self.progress("Пункты ГОСТ для промпта: " +
+                          ", ".join(f"{c['gost']} п. {c['clause']}" for _, c in clauses))
+        system, prompt = build_prompt(mode, "", rules, clauses, only, recheck)
+        prompt_tokens = chunking.estimate_tokens(system + prompt + CHUNK_NOTE)
+        fit = chunking.fit_context(context, prompt_tokens, options["num_predict"], len(base64_images or []))
+        if fit is None:
+            return findings.Analysis.error(
+                f"Промпт ({prompt_tokens} токенов) и ответ ({options['num_predict']} токенов) не помещаются "
+                f"в контекст модели {model} даже при num_ctx={chunking.MAX_CONTEXT}")
+        context, image_count, budget = fit
+        if base64_images and image_count < len(base64_images):
+            # Изображения упорядочены по важности: отбрасываются последние
+            self.progress(f"В контекст {model} ({context} токенов) помещается изображений: "
+                          f"{image_count} из {len(base64_images)}")
+            base64_images = base64_images[:image_count] or None
+        options = dict(options, num_ctx=context)
+        chunks = list(chunking.iter_chunks(text_content, budget))
+        if len(chunks) <= 1:
+            text = chunks[0] if chunks else ""
+            return self._request(mode, text, base64_images, model, options, pdf_hash, pages,
+                                 rules, single, clauses, only, recheck)
+
+        total = len(chunks)
+        self.progress(f"Текст разбит на {total} частей (до {budget} токенов)")
+        results = {}
+        for index, chunk in enumerate(chunks, 1):
+            # Изображения отправляются один раз, с первой частью
+            result = self._request(mode, CHUNK_NOTE.format(index=index, total=total) + chunk,
+                                   base64_images if index == 1 else None, model, options,
+                                   pdf_hash, f"{pages}/chunk:{index}", rules, single=False,
+                                   clauses=clauses, only=only, recheck=recheck)
+            results[index] = result
+            self.progress(f"Часть {index} из {total} проверена: "
+                          f"СООТВЕТСТВИЕ {result_verdict(result) or 'НЕ ОПРЕДЕЛЕНО'}")
+        summaries = "; ".join(r.summary for r in results.values() if r.summary)
+        return combine(results, f"частей текста: {total}. {summaries}" if summaries else f"частей текста: {total}",
+                       label=lambda index: f"ЧАСТЬ {index} ИЗ {total}")
+
+    def _request(self, mode, text, base64_images, model, options, pdf_hash, pages, rules, single,
+                 clauses=None, only=None, recheck=None):
+        """Один запрос к модели (с кэшем результатов). Возвращает findings.Analysis"""
+        empty = "Нет ответа" if mode == "fast" else "Нет ответа от модели"
+        system, prompt = build_prompt(mode, text, rules, clauses, only, recheck)
+        payload = {
+            "model": model,
+            "system": system,
+            "prompt": prompt,
+            "stream": False,
+            "format": findings.SCHEMA,
+            "options": options
+        }
+
+        if base64_images:
+            payload["images"] = base64_images
+
+        # Таймаут по измеренной скорости модели: ожидание ответа не зависит от фиксированных 60 с
+        prompt_tokens = (chunking.estimate_tokens(system + prompt)
+                         + len(base64_images or []) * chunking.IMAGE_TOKENS)
+        read_timeout = self.client.read_timeout(model, prompt_tokens, options["num_predict"],
+                                                FAST_TIMEOUT if mode == "fast" else STANDARD_TIMEOUT)
+        timeout = (CONNECT_TIMEOUT, read_timeout)
+
+        # Этапы каскада спрашивают о части критериев - в ключе кэша отдельный режим
+        key_mode = mode if only is None else f"{mode}:{'+'.join(sorted(only))}"
+        if recheck:
+            digest = hashlib.sha256("\n".join(f.format() for f in recheck).encode("utf-8")).hexdigest()
+            pages = f"{pages}/recheck:{digest[:12]}"
+        cache_key = self._cache_key(key_mode, payload, pdf_hash, pages)
+        cached = self._cached_response(cache_key)
+        if cached is not None:
+            return findings.Analysis.from_dict(cached)
+
+        try:
+            ok, result = self._generate(payload, timeout, empty, emit_tokens=single)
+            if not ok:
+                return findings.Analysis.error(result)
+            analysis = findings.parse_response(result)
+            if cache_key is not None and analysis.verdict:
+                self.cache.put(cache_key, analysis.to_dict(), {"model": payload["model"], "mode": mode})
+            return analysis
+
+        except requests.exceptions.Timeout:
+            if mode == "fast" or only is not None:
+                return findings.Analysis.error(f"Таймаут: модель {model} не успела ответить за {read_timeout:.0f} с")
+            self.progress("Таймаут! Используем упрощенный анализ...")
+            return findings.Analysis.error(fallback_analysis(text))
+        except CheckCancelled:
+            raise
+        except Exception as e:
+            if mode == "fast":
+                return findings.Analysis.error(f"Ошибка: {str(e)}")
+            return findings.Analysis.error(f"Ошибка соединения: {str(e)}")
+
+    def _analyze_document(self, mode, text_content, base64_images, pdf_hash, pages, rules):
+        try:
+            result = self._analyze(mode, text_content, base64_images, pdf_hash, pages, rules)
+        except CheckCancelled:
+            return findings.Analysis.error(CANCELLED)
+        if result is None:
+            self.progress("Все пункты решены правилами, запрос к модели не нужен")
+        return with_rules(rules, result)
+
+    def _cascade(self, text_content, images, pdf_hash, pages, rules, single):
+        """Каскад: легкая текстовая модель, затем vision-модель только там, где она нужна.
+
+        Текстовая модель проверяет текстовые критерии. Vision-модель получает графику
+        (без пунктов, проверенных по векторам) и пункты со статусом "не определено"; если
+        текстовая модель не дала вывода (ошибка, таймаут), vision-модель проверяет все.
+        images - изображения или функция, которая их рендерит: вызывается, только если
+        проверка дошла до vision-модели.
+        """
+        first = self._analyze("fast", text_content, None, pdf_hash, pages, rules, single,
+                              only=TEXT_CRITERIA, model=self.text_model)
+        if first is not None and not first.verdict:
+            self.progress(f"Модель {self.text_model} не дала вывода, проверка передается {self.vision_model}")
+            only, recheck = None, None
+        else:
+            recheck = [f for f in first.findings if f.status == findings.DOUBT] if first else []
+            only = GRAPHIC_CRITERIA if needs_images(rules) else set()
+            if not recheck and not pending_criteria("full", rules, only):
+                return first
+            if single:
+                self.progress(f"{self.vision_model}: " + ", ".join(
+                    (["графика"] if pending_criteria("full", rules, only) else [])
+                    + ([f"перепроверка пунктов: {len(recheck)}"] if recheck else [])))
+        if callable(images):
+            images = images()
+        second = self._analyze("full", text_content, images, pdf_hash, pages, rules, single,
+                               only=only, recheck=recheck, model=self.vision_model)
+        if only is None or first is None:
+            return second
+        if second is not None and second.verdict:
+            # Сомнительные пункты перепроверены: остается ответ vision-модели
+            first = findings.Analysis(first.verdict, first.summary,
+                                      [f for f in first.findings if f.status != findings.DOUBT], first.note)
+        summary = "; ".join(r.summary for r in (first, second) if r is not None and r.summary)
+        return combine({1: first, 2: second}, summary,
+                       label=lambda n: self.text_model if n == 1 else self.vision_model)
+
+    def analyze_fast(self, text_content, base64_images=None, pdf_hash=None, pages=None, rules=None):
+        return self._analyze_document("fast", text_content, base64_images, pdf_hash, pages, rules)
+
+    def analyze_standard(self, text_content, base64_images=None, pdf_hash=None, pages=None, rules=None):
+        return self._analyze_document("full", text_content, base64_images, pdf_hash, pages, rules)
+
+    def analyze_cascade(self, text_content, base64_images=None, pdf_hash=None, pages=None, rules=None):
+        return self._analyze_document(CASCADE, text_content, base64_images, pdf_hash, pages, rules)
+
+    def analyze_pages(self, mode, page_jobs, pdf_hash=None, rules=None, num_parallel=1):
+        """Постраничная проверка: каждый лист - отдельный запрос, не более num_parallel одновременно.
+
+        num_parallel стоит выставлять равным OLLAMA_NUM_PARALLEL сервера: больше
+        запросов сервер все равно поставит в очередь.
+        """
+        results = self.analyze_page_results(mode, page_jobs, pdf_hash, rules, num_parallel)
+        if results is None:
+            return findings.Analysis.error(CANCELLED)
+        return merge_page_results(rules, results)
+
+    def analyze_page_results(self, mode, page_jobs, pdf_hash=None, rules=None, num_parallel=1):
+        """Ответы по листам {номер листа: ответ} или None, если проверку прервали"""
+        total = len(page_jobs)
+
+        def run(job):
+            page_rules = rules.for_page(job.page_num) if rules else None
+            return job.page_num, self._analyze(mode, job.text, job.images, pdf_hash,
+                                               f"page:{job.page_num}", page_rules, single=False)
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=max(1, num_parallel)) as pool:
+            futures = [pool.submit(run, job) for job in page_jobs]
+            try:
+                for fut in as_completed(futures):
+                    page_num, result = fut.result()
+                    results[page_num] = result
+                    self.progress(f"Лист {page_num + 1} проверен ({len(results)}/{total})")
+            except CheckCancelled:
+                self.cancel()
+                for fut in futures:
+                    fut.cancel()
+                return None
+        return results
+
+
+def _reusable(result):
+    """Сохранять для повторной проверки можно разобранный ответ с выводом (не ошибку и не таймаут)"""
+    return result is None or (result.verdict in ("ДА", "НЕТ") and not result.note)
+
+
+def _stored(data):
+    return findings.Analysis.from_dict(data) if data is not None else None
+
+
+def check_file(pdf_path, mode, analyzer, progress=None, image_config=None, per_page=False,
+               num_parallel=1, should_stop=None, revisions=None):
+    """Проверка одного чертежа целиком: правила, извлечение, запросы к модели.
+
+    Общий ход для интерфейса и сервиса проверки. Спаны пишутся в analyzer.tracer.
+    revisions - RevisionStore: модели отправляются только листы, изменившиеся
+    с прошлой проверки документа с тем же обозначением.
+    Возвращает findings.Analysis или None, если проверку остановили до запроса к модели.
+    """
+    progress = progress or (lambda message: None)
+    should_stop = should_stop or (lambda: False)
+    include_graphics = mode == "full"
+    image_config = image_pipeline.with_image_limit(image_config, analyzer.image_limit())
+    with DocumentSession(pdf_path, tracer=analyzer.tracer) as document:
+        pdf_hash = result_cache.file_sha256(pdf_path)
+        designation = None
+        previous = None
+        if revisions is not None and revisions.enabled:
+            designation = title_block.document_designation(document)
+            store_key = (designation, mode, per_page, (analyzer.text_model, analyzer.vision_model),
+                         analyzer.template_version())
+            previous = revisions.load(*store_key)
+            if previous is not None and previous.get("page_count") != document.page_count:
+                previous = None  # число листов входит в основные надписи всех листов
+            if designation is None:
+                progress("Обозначение документа не найдено, проверяются все листы")
+
+        if per_page:
+            fingerprints = []
+            unchanged = set()
+            if designation:
+                fingerprints = [document.page_fingerprint(n) for n in range(document.page_count)]
+                sheets = previous["sheets"] if previous else []
+                unchanged = {n for n, fingerprint in enumerate(fingerprints)
+                             if n < len(sheets) and sheets[n]["fingerprint"] == fingerprint}
+            changed = [n for n in range(document.page_count) if n not in unchanged]
+            if designation:
+                progress(f"Изменено листов: {len(changed)} из {document.page_count}")
+            with analyzer.tracer.span(spans.RULES):
+                rules = title_block.check_document(document, None, pages=changed)
+            for n in sorted(unchanged):
+                rules.results.extend(title_block.RuleResult.from_dict(r) for r in previous["sheets"][n]["rules"])
+            rules.results.sort(key=lambda r: r.page_num or 0)
+            progress(f"Правилами решено пунктов: {len(rules.decided())} из {len(rules.results)}")
+            if include_graphics and changed:
+                progress("Извлекаем текст и графику листов...")
+            page_jobs = extract_page_jobs(document, include_graphics, image_config, rules=rules, pages=changed,
+                                          lazy=mode == CASCADE)
+            progress(f"Листов к проверке: {len(page_jobs)}")
+            if should_stop():
+                return None
+            results = analyzer.analyze_page_results(mode, page_jobs, pdf_hash, rules, num_parallel)
+            if results is None:
+                return findings.Analysis.error(CANCELLED)
+            results.update({n: _stored(previous["sheets"][n]["result"]) for n in unchanged})
+            if designation:
+                revisions.save(*store_key, {
+                    "page_count": document.page_count,
+                    "sheets": [{"fingerprint": fingerprint if _reusable(results[n]) else None,
+                                "result": results[n].to_dict() if results[n] is not None else None,
+                                "rules": [r.to_dict() for r in rules.for_page(n).results]}
+                               for n, fingerprint in enumerate(fingerprints)],
+                })
+            return merge_page_results(rules, results, reused=unchanged)
+
+        fingerprints = None
+        if designation:
+            fingerprints = [document.page_fingerprint(n) for n in range(min(document.page_count, 3))]
+            if previous is not None and previous.get("sheets") == fingerprints:
+                progress("Листы не изменились с прошлой проверки, результат взят из нее")
+                return findings.Analysis.from_dict(previous["result"])
+            progress("Чертеж изменился с прошлой проверки, проверяется заново" if previous
+                     else "Прошлой проверки этого документа нет")
+
+        text_content = extract_text(document)
+        if should_stop():
+            return None
+        progress(f"Текст извлечен: {len(text_content)} символов")
+
+        with analyzer.tracer.span(spans.RULES):
+            rules = title_block.check_document(document)
+        progress(f"Правилами решено пунктов: {len(rules.decided())} из {len(rules.results)}")
+
+        def render_images():
+            progress("Извлекаем графику...")
+            pages = extract_page_images(document, config=image_config, rules=rules)
+            for page in pages:
+                progress(page.summary())
+            images = image_pipeline.ordered_images(pages)
+            progress(f"Извлечено {len(images)} изображений")
+            return images
+
+        base64_images = None
+        if mode == CASCADE:
+            base64_images = render_images  # рендерится, только если каскад дойдет до vision-модели
+        elif include_graphics and not needs_images(rules):
+            progress("Графика проверена по векторам, изображения не нужны")
+        elif include_graphics:
+            base64_images = render_images()
+
+        if should_stop():
+            return None
+        analyze = {"fast": analyzer.analyze_fast, "full": analyzer.analyze_standard,
+                   CASCADE: analyzer.analyze_cascade}[mode]
+        result = analyze(text_content, base64_images, pdf_hash=pdf_hash, pages=3, rules=rules)
+        if fingerprints and not analyzer.cancelled and _reusable(result):
+            revisions.save(*store_key, {"page_count": document.page_count,
+                                        "sheets": fingerprints, "result": result.to_dict()})
+        return result
+
+
+def collect_pdf_files(inputs):
+    """Разворачивает каталоги и glob-шаблоны в отсортированный список PDF"""
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            pattern = os.path.join(item, "**", "*.pdf")
+            files.extend(glob.glob(pattern, recursive=True))
+        elif any(ch in item for ch in "*?["):
+            files.extend(glob.glob(item, recursive=True))
+        elif os.path.isfile(item):
+            files.append(item)
+    # Убираем дубликаты, сохраняя стабильный порядок
+    seen = set()
+    result = []
+    for path in sorted(files):
+        key = os.path.abspath(path)
+        if key not in seen and path.lower().endswith(".pdf"):
+            seen.add(key)
+            result.append(path)
+    return result
+
+
+class BatchChecker:
+    """Пакетная проверка: извлечение в пуле процессов, ограниченное число запросов к Ollama"""
+
+    def __init__(self, analyzer, mode="fast", jobs=None, max_inflight=2, max_pages=3,
+                 image_config=None, per_page=False, num_parallel=1, spans_path=None, annotate_dir=None):
+        self.analyzer = analyzer
+        # Копии чертежей с замечаниями-аннотациями; None - не делать
+        self.annotate_dir = annotate_dir
+        # Подробные спаны каждого файла дописываются в spans_path (JSONL), итоги - в результаты
+        self.spans_path = spans_path
+        self.image_config = image_pipeline.with_image_limit(image_config, analyzer.image_limit())
+        # Постранично: каждый лист отдельным запросом, до num_parallel листов файла одновременно
+        self.per_page = per_page
+        self.num_parallel = num_parallel
+        self.mode = mode
+        self.include_graphics = mode in ("full", CASCADE)
+        self.jobs = jobs or os.cpu_count() or 1
+        self.max_inflight = max(1, max_inflight)
+        self.max_pages = max_pages
+
+    def _analyze(self, extracted, pool=None):
+        tracer = spans.Tracer(file=extracted["file"], mode=self.mode)
+        tracer.extend(extracted.get("spans"))
+        record = self._analyze_traced(extracted, self.analyzer.with_tracer(tracer), pool)
+        record["timings"] = tracer.totals()
+        if self.spans_path:
+            tracer.flush(self.spans_path)
+        return record
+
+    def _lazy_images(self, path, page_nums, analyzer, record, pool):
+        """Изображения для каскада: рендер в пуле процессов (pool), когда проверка дошла до vision-модели"""
+        def render():
+            if pool is not None:
+                rendered = pool.submit(render_drawing_images, path, page_nums, self.image_config).result()
+            else:
+                rendered = render_drawing_images(path, page_nums, self.image_config)
+            analyzer.tracer.extend(rendered["spans"])
+            record["image_counts"].append(len(rendered["images"]))
+            record["image_bytes"].extend(rendered["image_bytes"])
+            return rendered["images"]
+        return render
+
+    def _analyze_traced(self, extracted, analyzer, pool=None):
+        record = {
+            "file": extracted["file"],
+            "mode": self.mode,
+            "model": (f"{analyzer.text_model} + {analyzer.vision_model}" if self.mode == CASCADE
+                      else analyzer.vision_model if extracted["images"] else analyzer.text_model),
+            "text_chars": len(extracted["text"]),
+            "images": len(extracted["images"] or []),
+            "image_bytes": list(extracted.get("image_bytes", [])),
+            "extract_time": extracted["extract_time"],
+        }
+        images = extracted["images"]
+        if self.mode == CASCADE and self.include_graphics and not extracted["error"]:
+            record["image_counts"] = []  # сколько отрендерено по запросам vision-модели
+            if self.per_page:
+                for job in extracted["jobs"]:
+                    job.images = self._lazy_images(extracted["file"], [job.page_num], analyzer, record, pool)
+            elif extracted.get("graphic_pages"):
+                images = self._lazy_images(extracted["file"], extracted["graphic_pages"], analyzer, record, pool)
+        if self.per_page:
+            record["pages"] = len(extracted.get("jobs") or [])
+        if extracted["error"]:
+            record["status"] = "error"
+            record["result"] = extracted["error"]
+            return record
+
+        started = time.time()
+        if self.per_page:
+            result = analyzer.analyze_pages(self.mode, extracted["jobs"],
+                                            pdf_hash=extracted["sha256"],
+                                            rules=extracted.get("rules"),
+                                            num_parallel=self.num_parallel)
+        else:
+            if self.mode == "full":
+                analyze = analyzer.analyze_standard
+            elif self.mode == CASCADE:
+                analyze = analyzer.analyze_cascade
+            else:
+                analyze = analyzer.analyze_fast
+            result = analyze(extracted["text"], images,
+                             pdf_hash=extracted["sha256"], pages=self.max_pages,
+                             rules=extracted.get("rules"))
+        record["analysis_time"] = round(time.time() - started, 3)
+        if "image_counts" in record:
+            record["images"] = sum(record.pop("image_counts"))
+        record["status"] = "ok"
+        record["verdict"] = result.verdict
+        record["counts"] = result.counts()
+        record["result"] = result.to_dict()
+        return record
+
+    def _annotate(self, record):
+        """Копия чертежа с пометками; в основном потоке, PyMuPDF не рассчитан на потоки"""
+        if record.get("status") != "ok" or not isinstance(record.get("result"), dict):
+            return
+        stem = os.path.splitext(os.path.basename(record["file"]))[0]
+        path = os.path.join(self.annotate_dir, stem + report.ANNOTATED_SUFFIX)
+        started = time.time()
+        try:
+            record["annotations"] = report.annotate_pdf(findings.Analysis.from_dict(record["result"]),
+                                                        record["file"], path)
+        except Exception as e:
+            record["annotate_error"] = str(e)
+            return
+        record["annotated"] = path
+        record["annotate_time"] = round(time.time() - started, 3)
+
+    def run(self, files, output_path, on_record=None):
+        """Проверяет файлы и дописывает по одной JSON-строке на файл в output_path"""
+        files_iter = iter(files)
+        # Окно извлечения: не держим в памяти больше готовых страниц, чем успеем отправить
+        extract_window = self.jobs * 2
+        analysis_backlog = self.max_inflight * 2
+        extracting = {}
+        analyzing = set()
+        written = 0
+        if self.annotate_dir:
+            os.makedirs(self.annotate_dir, exist_ok=True)
+
+        with ProcessPoolExecutor(max_workers=self.jobs) as pool, \
+                ThreadPoolExecutor(max_workers=self.max_inflight) as http_pool, \
+                open(output_path, "a", encoding="utf-8") as out:
+
+            def submit_next():
+                path = next(files_iter, None)
+                if path is None:
+                    return False
+                fut = pool.submit(extract_drawing, path, self.include_graphics, self.max_pages,
+                                  self.image_config, self.per_page, self.mode == CASCADE)
+                extracting[fut] = path
+                return True
+
+            def drain(futures, block):
+                nonlocal written
+                if not futures:
+                    return set()
+                done, pending = wait(futures, timeout=None if block else 0,
+                                     return_when=FIRST_COMPLETED)
+                for fut in done:
+                    record = fut.result()
+                    if self.annotate_dir:
+                        self._annotate(record)
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    out.flush()
+                    written += 1
+                    if on_record:
+                        on_record(record)
+                return pending
+
+            for _ in range(extract_window):
+                if not submit_next():
+                    break
+
+            while extracting:
+                done, _ = wait(extracting, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    path = extracting.pop(fut)
+                    try:
+                        extracted = fut.result()
+                    except Exception as e:
+                        extracted = {"file": path, "text": "", "images": None, "sha256": None,
+                                     "error": f"Ошибка процесса извлечения: {str(e)}",
+                                     "extract_time": 0}
+                    analyzing.add(http_pool.submit(self._analyze, extracted, pool))
+                    submit_next()
+                analyzing = drain(analyzing, block=False)
+                while len(analyzing) >= analysis_backlog:
+                    analyzing = drain(analyzing, block=True)
+
+            while analyzing:
+                analyzing = drain(analyzing, block=True)
+
+        return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетная проверка чертежей PDF на соответствие ГОСТ")
+    parser.add_argument("inputs", nargs="+", help="Каталоги, PDF файлы или glob-шаблоны")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="Файл результатов (JSONL)")
+    parser.add_argument("--mode", choices=["fast", "full", CASCADE], default="fast",
+                        help="fast - быстрая проверка по тексту, full - полная с графикой, "
+                             "cascade - легкая модель, vision-модель только для графики и сомнительного")
+    parser.add_argument("--jobs", type=int, default=None, help="Число процессов извлечения")
+    parser.add_argument("--inflight", type=int, default=None,
+                        help="Одновременно проверяемых файлов (по умолчанию 2 на сервер Ollama)")
+    parser.add_argument("--max-pages", type=int, default=None,
+                        help="Страниц на чертеж (по умолчанию 3, постранично - все)")
+    parser.add_argument("--per-page", action="store_true",
+                        help="Проверять каждый лист отдельным запросом и сводить результаты")
+    parser.add_argument("--num-parallel", type=int,
+                        default=int(os.environ.get("OLLAMA_NUM_PARALLEL", "1")),
+                        help="Листов одного файла одновременно (как OLLAMA_NUM_PARALLEL сервера)")
+    parser.add_argument("--url", default=OLLAMA_URL,
+                        help="Адрес сервера Ollama; несколько серверов - через запятую")
+    parser.add_argument("--model", default="llama2:3b", help="Текстовая модель")
+    parser.add_argument("--vision-model", default="llava:7b", help="Vision модель")
+    parser.add_argument("--fast-models", default=None,
+                        help="Каскад: текстовые модели через запятую, берется самая легкая из установленных")
+    parser.add_argument("--keep-alive", default=ollama_client.DEFAULT_KEEP_ALIVE,
+                        help="Сколько держать модель в памяти Ollama (например 30m, -1 - всегда)")
+    parser.add_argument("--spans", default=None,
+                        help="Файл спанов этапов (JSONL): извлечение, растеризация, запросы, метрики Ollama")
+    parser.add_argument("--image-budget-kb", type=int, default=400,
+                        help="Бюджет изображений на лист, КБ (base64)")
+    parser.add_argument("--color", action="store_true",
+                        help="Отправлять изображения в цвете (по умолчанию оттенки серого)")
+    parser.add_argument("--cache-dir", default=result_cache.DEFAULT_CACHE_DIR,
+                        help="Каталог кэша результатов")
+    parser.add_argument("--cache-size-mb", type=int, default=200, help="Предельный размер кэша, МБ")
+    parser.add_argument("--no-cache", action="store_true", help="Не использовать кэш результатов")
+    parser.add_argument("--clear-cache", action="store_true", help="Очистить кэш перед проверкой")
+    parser.add_argument("--docs", default=gost_index.DEFAULT_DOCS_DIR,
+                        help="Каталог PDF стандартов ГОСТ для выдержек в промпте")
+    parser.add_argument("--embed-model", default=None,
+                        help="Модель эмбеддингов Ollama для поиска пунктов ГОСТ (без нее - BM25)")
+    parser.add_argument("--top-k", type=int, default=gost_index.DEFAULT_TOP_K,
+                        help="Сколько пунктов ГОСТ добавлять в промпт")
+    parser.add_argument("--annotate", default=None, metavar="DIR",
+                        help="Каталог для копий чертежей с замечаниями-аннотациями на листах")
+    parser.add_argument("--summary", default=None,
+                        help="Сводка по всем файлам: .json, .html или .pdf (по расширению)")
+    args = parser.parse_args(argv)
+
+    cache = result_cache.ResultCache(args.cache_dir, args.cache_size_mb * 1024 * 1024,
+                                     enabled=not args.no_cache)
+    if args.clear_cache:
+        cache.clear()
+
+    files = collect_pdf_files(args.inputs)
+    if not files:
+        print("PDF файлы не найдены", file=sys.stderr)
+        return 1
+
+    client = ollama_client.OllamaClient(args.url, keep_alive=args.keep_alive)
+    if args.mode == CASCADE and args.fast_models:
+        args.model = client.cheapest_model(args.fast_models.split(","))
+        print(f"Каскад: {args.model}, затем {args.vision_model}", file=sys.stderr)
+    # Модели грузятся, пока идет извлечение первых файлов
+    client.warm_up_async(args.model)
+    if args.mode in ("full", CASCADE):
+        client.warm_up_async(args.vision_model)
+    index = gost_index.GostIndex.load_or_build(args.docs, embed_model=args.embed_model, client=client,
+                                               progress=lambda message: print(message, file=sys.stderr))
+    if index is not None:
+        print(f"Пунктов ГОСТ в индексе: {len(index)}", file=sys.stderr)
+    analyzer = OllamaAnalyzer(args.url, args.model, args.vision_model,
+                              progress=lambda message: print(message, file=sys.stderr),
+                              cache=cache, client=client, gost_index=index, top_k=args.top_k)
+    image_config = image_pipeline.ImagePipelineConfig(
+        max_bytes_per_page=args.image_budget_kb * 1024,
+        grayscale=not args.color
+    )
+    max_pages = args.max_pages
+    if max_pages is None and not args.per_page:
+        max_pages = 3
+    checker = BatchChecker(analyzer, mode=args.mode, jobs=args.jobs,
+                           max_inflight=args.inflight or 2 * len(client.endpoints), max_pages=max_pages,
+                           image_config=image_config, per_page=args.per_page,
+                           num_parallel=args.num_parallel, spans_path=args.spans,
+                           annotate_dir=args.annotate)
+
+    started = time.time()
+    total = len(files)
+
+    summary = report.BatchSummary(args.summary) if args.summary else None
+
+    def on_record(record):
+        print(f"[{record['status']}] {record['file']}", file=sys.stderr)
+        if summary is not None:
+            summary.add(record)
+
+    try:
+        written = checker.run(files, args.output, on_record=on_record)
+    finally:
+        if summary is not None:
+            summary.close()
+    print(f"Проверено {written}/{total} файлов за {time.time() - started:.1f} с -> {args.output}",
+          file=sys.stderr)
+    if summary is not None:
+        print(f"Сводка: {args.summary}", file=sys.stderr)
+    if cache.enabled:
+        stats = cache.stats()
+        print(f"Кэш: попаданий {stats['hits']}, промахов {stats['misses']}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+"""Структурированный результат проверки: замечания и сводка.
+
+Модель отвечает JSON по схеме SCHEMA (поле format запроса /api/generate), ответ
+разбирается в компактные объекты Finding и Analysis со __slots__. Их же хранят
+кэш результатов и ревизии, показывает интерфейс и выгружают отчеты. Текст для
+окна и PDF собирает Analysis.format().
+"""
+import json
+import re
+
+# Статус пункта
+OK = "соответствует"
+FAIL = "не соответствует"
+DOUBT = "не определено"
+
+# Критичность
+CRITICAL = "критическое"
+ADVICE = "рекомендация"
+
+# Источник замечания
+MODEL = "модель"
+RULES = "правила"
+
+# Пределы ответа: Ollama строит по схеме грамматику, и модель не может выйти за них.
+# Так ответ укладывается в num_predict (engine.FAST_OPTIONS, STANDARD_OPTIONS)
+MAX_FINDINGS = 6
+MAX_CHARS = {"summary": 300, "item": 80, "location": 60, "quote": 100, "gost": 50, "recommendation": 150}
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "verdict": {"type": "string", "enum": ["ДА", "НЕТ"]},
+        "summary": {"type": "string", "maxLength": MAX_CHARS["summary"]},
+        "findings": {
+            "type": "array",
+            "maxItems": MAX_FINDINGS,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "item": {"type": "string", "maxLength": MAX_CHARS["item"]},
+                    "status": {"type": "string", "enum": [FAIL, DOUBT]},
+                    "location": {"type": "string", "maxLength": MAX_CHARS["location"]},
+                    "quote": {"type": "string", "maxLength": MAX_CHARS["quote"]},
+                    "gost": {"type": "string", "maxLength": MAX_CHARS["gost"]},
+                    "severity": {"type": "string", "enum": [CRITICAL, ADVICE]},
+                    "recommendation": {"type": "string", "maxLength": MAX_CHARS["recommendation"]},
+                },
+                "required": ["item", "status", "location", "quote", "gost", "severity", "recommendation"],
+            },
+        },
+    },
+    "required": ["verdict", "summary", "findings"],
+}
+
+FIELDS = ("item", "status", "location", "quote", "gost", "severity", "recommendation")
+
+TRUNCATED = "Ответ модели оборван (num_predict): показаны только полностью полученные замечания"
+_VERDICT_FIELD = re.compile(r'"verdict"\s*:\s*"(ДА|НЕТ)"', re.IGNORECASE)
+_SUMMARY_FIELD = re.compile(r'"summary"\s*:\s*("(?:[^"\\]|\\.)*")')
+_FINDINGS_FIELD = re.compile(r'"findings"\s*:\s*\[')
+
+
+class Finding:
+    """Одно замечание (или пункт правил): что, где, цитата, ГОСТ, критичность, что сделать"""
+
+    __slots__ = FIELDS + ("sheet", "rect", "source")
+
+    def __init__(self, item, status=FAIL, location="", quote="", gost="", severity=CRITICAL,
+                 recommendation="", sheet=None, rect=None, source=MODEL):
+        self.item = item
+        self.status = status
+        self.location = location
+        self.quote = quote
+        self.gost = gost
+        self.severity = severity
+        self.recommendation = recommendation
+        self.sheet = sheet  # номер листа с 0, если известен
+        self.rect = tuple(rect) if rect else None  # координаты на листе в пунктах
+        self.source = source
+
+    def to_dict(self):
+        """Словарь без пустых полей (кэш, ревизии, JSON сервиса и пакетной проверки)"""
+        return {name: getattr(self, name) for name in self.__slots__
+                if getattr(self, name) not in (None, "")}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{name: data[name] for name in cls.__slots__ if name in data})
+
+    @classmethod
+    def from_rule(cls, rule):
+        """Пункт title_block/geometry в виде замечания"""
+        status = {"ok": OK, "fail": FAIL}.get(rule.status, DOUBT)
+        return cls(rule.item, status, quote=rule.detail, gost=rule.gost or "",
+                   severity=CRITICAL if status == FAIL else "", sheet=rule.page_num,
+                   rect=rule.rect, source=RULES)
+
+    def where(self):
+        parts = [f"лист {self.sheet + 1}"] if self.sheet is not None else []
+        if self.location:
+            parts.append(self.location)
+        return ", ".join(parts)
+
+    def format(self):
+        if self.source == RULES:
+            mark = {OK: "✓", FAIL: "✗"}.get(self.status, "?")
+            where = f" [{self.where()}]" if self.sheet is not None else ""
+            gost = f" ({self.gost})" if self.gost and self.status == FAIL else ""
+            return f"{mark} {self.item}: {self.quote}{where}{gost}"
+        line = f"- [{self.severity}] {self.item}"
+        if self.status == DOUBT:
+            line += " (не определено)"
+        if self.where():
+            line += f" ({self.where()})"
+        if self.quote:
+            line += f": «{self.quote}»"
+        if self.gost:
+            line += f" (Ссылка на ГОСТ: {self.gost})"
+        if self.recommendation:
+            line += f"\n  Рекомендация: {self.recommendation}"
+        return line
+
+
+class Analysis:
+    """Результат проверки: вывод ДА/НЕТ, краткий вывод, замечания.
+
+    note - текст без структуры: ошибка, таймаут, упрощенный анализ или
+    ответ модели, который не разобрался как JSON.
+    """
+
+    __slots__ = ("verdict", "summary", "findings", "note")
+
+    def __init__(self, verdict=None, summary="", findings=None, note=""):
+        self.verdict = verdict
+        self.summary = summary
+        self.findings = findings or []
+        self.note = note
+
+    @classmethod
+    def error(cls, text):
+        return cls(note=text)
+
+    def to_dict(self):
+        data = {"verdict": self.verdict, "summary": self.summary,
+                "findings": [finding.to_dict() for finding in self.findings]}
+        if self.note:
+            data["note"] = self.note
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("verdict"), data.get("summary", ""),
+                   [Finding.from_dict(item) for item in data.get("findings", [])], data.get("note", ""))
+
+    def rules(self):
+        return [finding for finding in self.findings if finding.source == RULES]
+
+    def problems(self):
+        """Замечания модели и нарушения, найденные правилами"""
+        return [finding for finding in self.findings if finding.source == MODEL or finding.status == FAIL]
+
+    def counts(self):
+        """Число замечаний по критичности"""
+        counts = {CRITICAL: 0, ADVICE: 0}
+        for finding in self.problems():
+            counts[finding.severity] = counts.get(finding.severity, 0) + 1
+        return counts
+
+    def format(self):
+        """Текст для окна результатов и отчета"""
+        parts = []
+        rules = [finding for finding in self.rules() if finding.status != DOUBT]
+        if rules:
+            parts.append("АВТОМАТИЧЕСКАЯ ПРОВЕРКА ПРАВИЛАМИ:\n" + "\n".join(f.format() for f in rules))
+        if self.verdict or self.summary:
+            lines = [f"СООТВЕТСТВИЕ: {self.verdict or 'НЕ ОПРЕДЕЛЕНО'}"]
+            if self.summary:
+                lines.append(f"ОБЩИЙ ВЫВОД: {self.summary}")
+            model = [finding for finding in self.findings if finding.source == MODEL]
+            if model:
+                lines.append("ЗАМЕЧАНИЯ:")
+                lines.extend(finding.format() for finding in model)
+            elif self.verdict:
+                lines.append("ЗАМЕЧАНИЙ НЕТ")
+            parts.append("\n".join(lines))
+        if self.note:
+            parts.append(self.note)
+        return "\n\n".join(parts)
+
+    def __str__(self):
+        return self.format()
+
+
+def _findings(items, sheet):
+    return [Finding(sheet=sheet, **{name: str(item.get(name, "")) for name in FIELDS})
+            for item in items if isinstance(item, dict) and item.get("item")]
+
+
+def _truncated(text, sheet):
+    """Analysis из JSON, оборванного по num_predict: вывод, сводка и полностью полученные замечания.
+
+    None - в тексте нет ни вывода, ни замечаний (ответ не по схеме).
+    """
+    verdict = _VERDICT_FIELD.search(text)
+    summary = _SUMMARY_FIELD.search(text)
+    items = []
+    start = _FINDINGS_FIELD.search(text)
+    if start:
+        decoder = json.JSONDecoder()
+        pos = start.end()
+        while True:
+            while pos < len(text) and text[pos] in " \t\r\n,":
+                pos += 1
+            try:
+                item, pos = decoder.raw_decode(text, pos)
+            except ValueError:
+                break
+            items.append(item)
+    if verdict is None and not items:
+        return None
+    return Analysis(verdict.group(1).upper() if verdict else None,
+                    json.loads(summary.group(1)) if summary else "", _findings(items, sheet), TRUNCATED)
+
+
+def parse_response(text, sheet=None):
+    """Ответ модели в Analysis; не JSON (старый сервер Ollama) - в note.
+
+    Из ответа, оборванного по num_predict, берутся полностью полученные замечания.
+    """
+    try:
+        data = json.loads(text)
+        findings = _findings(data.get("findings", []), sheet)
+        verdict = str(data.get("verdict", "")).upper()
+    except ValueError:
+        return _truncated(text, sheet) or Analysis(note=text)
+    except (TypeError, AttributeError):
+        return Analysis(note=text)
+    return Analysis(verdict if verdict in ("ДА", "НЕТ") else None, str(data.get("summary", "")), findings)
@@ -0,0 +1,446 @@
+"""Проверка графики по векторным путям листа (page.get_drawings()).
+
+Из CAD-чертежей в PDF размерные линии, выноски, стрелки и рамки допусков
+приходят векторами. Отрезки, стрелки и надписи собираются в массивы NumPy,
+углы и взаимное положение текста и линий считаются сразу для всех элементов.
+Если векторов на листе нет (скан), текст не извлекается (кривыми) или проверять
+нечего (нет размеров, рамок, баз), пункты остаются для vision-модели.
+"""
+import re
+
+import fitz  # PyMuPDF
+
+try:
+    import numpy
+except ImportError:  # без numpy графику проверяет модель
+    numpy = None
+
+from image_pipeline import DIMENSION_WORD, MM
+from rule_result import FAIL, OK, UNDECIDED, RuleResult
+
+GOST_DIMENSIONS = "ГОСТ 2.307-2011"
+GOST_FORM_TOLERANCES = "ГОСТ 2.308-2011"
+
+ITEM_LINEAR = "Размеры в зоне 30°"
+ITEM_ANGULAR = "Угловые размеры"
+ITEM_TOLERANCE_ARROWS = "Стрелки допусков формы"
+ITEM_DATUMS = "Обозначения баз"
+ITEMS = [ITEM_LINEAR, ITEM_ANGULAR, ITEM_TOLERANCE_ARROWS, ITEM_DATUMS]
+
+# Наклон размерной линии (от горизонтали против часовой стрелки), при котором число
+# ставится на полке линии-выноски: заштрихованная зона 30° левее вертикали (черт. 7)
+LINEAR_ZONE = (91, 120)
+# Заштрихованная зона угловых размеров: 30° над горизонтальной осью слева от вершины (черт. 8)
+ANGULAR_ZONE = (150, 180)
+
+CONNECT_TOL = 1 * MM  # конец линии касается стрелки, рамки или полки
+TEXT_DISTANCE = 15 * MM  # число относится к ближайшей линии не дальше этого
+HORIZONTAL_TOL = 2  # градусов: отрезок считается горизонтальным (полка)
+
+ARROW_MAX_SIZE = 6 * MM
+DATUM_TRIANGLE_SIZE = (2 * MM, 10 * MM)
+# Знаки допусков формы и расположения (ГОСТ 2.308, табл. 1)
+TOLERANCE_FRAME_MAX_HEIGHT = 12 * MM
+TOLERANCE_SYMBOLS = set("⏤⏥○⌭⌒⌓∥⊥∠◎⌖≡↗⌰")
+DATUM_LETTER = re.compile(r"^[A-ZА-Я]$")
+# Буква базы в ячейке рамки допуска: отдельная заглавная буква, в том числе слитно с числом "0,1А"
+DATUM_REFERENCE = re.compile(r"(?<![A-Za-zА-Яа-я])[A-ZА-Я](?![A-Za-zА-Яа-я])")
+
+
+class PageGeometry:
+    """Векторы листа в массивах: отрезки, стрелки, треугольники баз, рамки, дуги"""
+
+    def __init__(self, segments, arrows, triangles, rects, arcs):
+        self.segments = numpy.array(segments, dtype=float).reshape(-1, 4)  # x0, y0, x1, y1
+        self.arrows = numpy.array(arrows, dtype=float).reshape(-1, 4)  # острие x, y, направление x, y
+        self.triangles = numpy.array(triangles, dtype=float).reshape(-1, 6)  # вершины
+        self.rects = numpy.array(rects, dtype=float).reshape(-1, 4)
+        self.arcs = numpy.array(arcs, dtype=float).reshape(-1, 6)  # начало, середина, конец
+
+    @property
+    def is_empty(self):
+        return len(self.segments) == 0
+
+    def endpoints(self):
+        """Концы отрезков: (N, 2, 2)"""
+        return self.segments.reshape(-1, 2, 2)
+
+    def angles(self):
+        """Наклон отрезков в градусах [0, 180), ось y направлена вверх"""
+        dx = self.segments[:, 2] - self.segments[:, 0]
+        dy = self.segments[:, 1] - self.segments[:, 3]  # в PDF ось y направлена вниз
+        return numpy.degrees(numpy.arctan2(dy, dx)) % 180
+
+
+def _triangle(points):
+    """(вершины, длины противолежащих сторон) для замкнутого пути из трех точек"""
+    unique = []
+    for point in points:
+        if all(abs(point.x - p.x) > 0.01 or abs(point.y - p.y) > 0.01 for p in unique):
+            unique.append(point)
+    if len(unique) != 3:
+        return None
+    sides = [abs(unique[(i + 1) % 3] - unique[(i + 2) % 3]) for i in range(3)]
+    if min(sides) == 0:
+        return None
+    return unique, sides
+
+
+def extract_geometry(page):
+    segments, arrows, triangles, rects, arcs = [], [], [], [], []
+    for path in page.get_drawings():
+        items = path["items"]
+        if path.get("fill") is not None and items and all(item[0] == "l" for item in items):
+            triangle = _triangle([point for item in items for point in item[1:3]])
+            if triangle is not None:
+                vertices, sides = triangle
+                if max(sides) <= ARROW_MAX_SIZE and min(sides) / max(sides) < 0.6:
+                    # Стрелка: острие напротив самой короткой стороны
+                    i = sides.index(min(sides))
+                    tip = vertices[i]
+                    base = (vertices[(i + 1) % 3] + vertices[(i + 2) % 3]) / 2
+                    direction = tip - base
+                    arrows.append((tip.x, tip.y, direction.x / abs(direction), direction.y / abs(direction)))
+                    continue
+                if (DATUM_TRIANGLE_SIZE[0] <= max(sides) <= DATUM_TRIANGLE_SIZE[1]
+                        and min(sides) / max(sides) >= 0.6):
+                    triangles.append([c for p in vertices for c in (p.x, p.y)])
+                    continue
+        for item in items:
+            kind = item[0]
+            if kind == "l":
+                p1, p2 = item[1], item[2]
+                segments.append((p1.x, p1.y, p2.x, p2.y))
+            elif kind == "re":
+                rect = item[1]
+                rects.append((rect.x0, rect.y0, rect.x1, rect.y1))
+                segments.extend([(rect.x0, rect.y0, rect.x1, rect.y0), (rect.x1, rect.y0, rect.x1, rect.y1),
+                                 (rect.x1, rect.y1, rect.x0, rect.y1), (rect.x0, rect.y1, rect.x0, rect.y0)])
+            elif kind == "qu":
+                quad = item[1]
+                corners = [quad.ul, quad.ur, quad.lr, quad.ll]
+                segments.extend((a.x, a.y, b.x, b.y) for a, b in zip(corners, corners[1:] + corners[:1]))
+            elif kind == "c":
+                p1, c1, c2, p2 = item[1:5]
+                middle = (p1 + c1 * 3 + c2 * 3 + p2) / 8  # точка кривой Безье при t = 0.5
+                arcs.append((p1.x, p1.y, middle.x, middle.y, p2.x, p2.y))
+    return PageGeometry(segments, arrows, triangles, rects, arcs)
+
+
+def _word_array(words):
+    return numpy.array([w[:4] for w in words], dtype=float).reshape(-1, 4)
+
+
+def _centers(boxes):
+    return numpy.stack([(boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2], axis=1)
+
+
+def _point_segment_distance(points, segments):
+    """Расстояния от точек (M, 2) до отрезков (N, 4): матрица (M, N)"""
+    a = segments[None, :, :2]
+    ab = segments[None, :, 2:] - segments[None, :, :2]
+    ap = points[:, None, :] - a
+    length2 = numpy.maximum((ab ** 2).sum(axis=2), 1e-9)
+    t = numpy.clip((ap * ab).sum(axis=2) / length2, 0, 1)
+    closest = a + ab * t[:, :, None]
+    return numpy.linalg.norm(points[:, None, :] - closest, axis=2)
+
+
+def _border_distance(points, rect):
+    """Расстояние от точек до границы прямоугольника"""
+    x0, y0, x1, y1 = rect
+    px, py = points[:, 0], points[:, 1]
+    outside = numpy.hypot(numpy.maximum.reduce([x0 - px, numpy.zeros_like(px), px - x1]),
+                          numpy.maximum.reduce([y0 - py, numpy.zeros_like(py), py - y1]))
+    inside = numpy.minimum.reduce([px - x0, x1 - px, py - y0, y1 - py])
+    return numpy.where(inside > 0, inside, outside)
+
+
+def _on_shelf(boxes, geometry, angles):
+    """Для каждой надписи: стоит ли она на горизонтальной полке"""
+    shelves = geometry.segments[(angles < HORIZONTAL_TOL) | (angles > 180 - HORIZONTAL_TOL)]
+    if len(shelves) == 0 or len(boxes) == 0:
+        return numpy.zeros(len(boxes), dtype=bool)
+    shelf_y = (shelves[:, 1] + shelves[:, 3]) / 2
+    shelf_x0 = numpy.minimum(shelves[:, 0], shelves[:, 2])
+    shelf_x1 = numpy.maximum(shelves[:, 0], shelves[:, 2])
+    below = (shelf_y[None, :] >= boxes[:, 3:4] - 1 * MM) & (shelf_y[None, :] <= boxes[:, 3:4] + 2 * MM)
+    overlap = (numpy.minimum(shelf_x1[None, :], boxes[:, 2:3]) - numpy.maximum(shelf_x0[None, :], boxes[:, 0:1]))
+    width = boxes[:, 2:3] - boxes[:, 0:1]
+    return (below & (overlap >= 0.5 * width)).any(axis=1)
+
+
+def _near(points, targets, tol):
+    """Для каждой точки: есть ли цель в соседних ячейках сетки с шагом tol.
+
+    Сортировка ключей ячеек и searchsorted вместо матрицы всех расстояний:
+    на листе бывают десятки тысяч отрезков и тысячи стрелок.
+    """
+    if len(targets) == 0 or len(points) == 0:
+        return numpy.zeros(len(points), dtype=bool)
+    span = 1 << 20
+    cells = numpy.floor(targets / tol).astype(numpy.int64)
+    keys = numpy.sort(cells[:, 0] * span + cells[:, 1])
+    point_cells = numpy.floor(points / tol).astype(numpy.int64)
+    found = numpy.zeros(len(points), dtype=bool)
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            wanted = (point_cells[:, 0] + dx) * span + point_cells[:, 1] + dy
+            index = numpy.minimum(numpy.searchsorted(keys, wanted), len(keys) - 1)
+            found |= keys[index] == wanted
+    return found
+
+
+def _arrow_ends(geometry, segments):
+    """Есть ли стрелка на каждом конце отрезков: (N, 2) булев массив"""
+    ends = segments.reshape(-1, 2)
+    return _near(ends, geometry.arrows[:, :2], CONNECT_TOL).reshape(-1, 2)
+
+
+def check_linear_dimensions(geometry, words, page_num):
+    """Числа размерных линий в заштрихованной зоне должны стоять на полках"""
+    angles = geometry.angles()
+    candidates = geometry.segments[(angles >= LINEAR_ZONE[0]) & (angles <= LINEAR_ZONE[1])]
+    # Размерная линия - отрезок со стрелками на обоих концах
+    zone_lines = candidates[_arrow_ends(geometry, candidates).all(axis=1)]
+    numbers = [w for w in words if DIMENSION_WORD.match(w[4]) and "°" not in w[4]]
+    if len(zone_lines) == 0 or not numbers:
+        # Нечего проверять (или текст кривыми) - решать должна модель
+        return [RuleResult(ITEM_LINEAR, UNDECIDED, "размерных линий с числами в зоне 30° не найдено", page_num)]
+
+    boxes = _word_array(numbers)
+    distance = _point_segment_distance(_centers(boxes), zone_lines)
+    nearest_line = distance.argmin(axis=0)  # ближайшее число к каждой линии
+    on_shelf = _on_shelf(boxes, geometry, angles)
+    results = []
+    reported = set()
+    checked = 0
+    for line, word_index in enumerate(nearest_line):
+        if distance[word_index, line] > TEXT_DISTANCE:
+            continue
+        checked += 1
+        if on_shelf[word_index] or word_index in reported:
+            continue
+        reported.add(word_index)
+        word = numbers[word_index]
+        results.append(RuleResult(ITEM_LINEAR, FAIL,
+                                  f"число {word[4]} размерной линии в зоне 30° не на полке линии-выноски",
+                                  page_num, fitz.Rect(word[:4]), GOST_DIMENSIONS))
+    if not results and not checked:
+        results.append(RuleResult(ITEM_LINEAR, UNDECIDED, "у размерных линий в зоне 30° чисел не найдено",
+                                  page_num))
+    elif not results:
+        results.append(RuleResult(ITEM_LINEAR, OK, f"размеров в зоне 30°: {checked}, числа на полках", page_num))
+    return results
+
+
+def _circle_centers(arcs):
+    """Центры окружностей через три точки каждой дуги"""
+    ax, ay, bx, by, cx, cy = arcs.T
+    d = 2 * (ax * (by - cy) + bx * (cy - ay) + cx * (ay - by))
+    d = numpy.where(numpy.abs(d) < 1e-9, numpy.nan, d)
+    a2, b2, c2 = ax ** 2 + ay ** 2, bx ** 2 + by ** 2, cx ** 2 + cy ** 2
+    ux = (a2 * (by - cy) + b2 * (cy - ay) + c2 * (ay - by)) / d
+    uy = (a2 * (cx - bx) + b2 * (ax - cx) + c2 * (bx - ax)) / d
+    return numpy.stack([ux, uy], axis=1), numpy.hypot(ax - ux, ay - uy)
+
+
+def check_angular_dimensions(geometry, words, page_num):
+    """Угловые размеры: в зоне 30° - на полке, выше оси - со стороны выпуклости, ниже - вогнутости"""
+    numbers = [w for w in words if "°" in w[4] and any(ch.isdigit() for ch in w[4])]
+    if len(geometry.arcs) == 0 or not numbers:
+        return [RuleResult(ITEM_ANGULAR, UNDECIDED, "угловых размеров не найдено", page_num)]
+
+    boxes = _word_array(numbers)
+    points = _centers(boxes)
+    mids = geometry.arcs[:, 2:4]
+    distance = numpy.linalg.norm(points[:, None, :] - mids[None, :, :], axis=2)
+    nearest = distance.argmin(axis=1)
+    centers, radii = _circle_centers(geometry.arcs[nearest])
+    offset = points - centers
+    direction = numpy.degrees(numpy.arctan2(-offset[:, 1], offset[:, 0]))  # от -180 до 180
+    outside = numpy.hypot(offset[:, 0], offset[:, 1]) > radii
+    in_zone = (direction >= ANGULAR_ZONE[0]) & (direction <= ANGULAR_ZONE[1])
+    on_shelf = _on_shelf(boxes, geometry, geometry.angles())
+    valid = (distance[numpy.arange(len(numbers)), nearest] <= TEXT_DISTANCE) & numpy.isfinite(radii)
+
+    results = []
+    for i, word in enumerate(numbers):
+        if not valid[i]:
+            continue
+        if in_zone[i] and not on_shelf[i]:
+            detail = f"число {word[4]} в заштрихованной зоне не вынесено на полку"
+        elif not in_zone[i] and not on_shelf[i] and (direction[i] > 0) != outside[i]:
+            side = "выпуклости" if direction[i] > 0 else "вогнутости"
+            detail = f"число {word[4]} должно стоять со стороны {side} размерной линии"
+        else:
+            continue
+        results.append(RuleResult(ITEM_ANGULAR, FAIL, detail, page_num, fitz.Rect(word[:4]),
+                                  GOST_DIMENSIONS))
+    if not results and not valid.any():
+        results.append(RuleResult(ITEM_ANGULAR, UNDECIDED, "числа с ° не у дуг", page_num))
+    elif not results:
+        results.append(RuleResult(ITEM_ANGULAR, OK, f"угловых размеров: {int(valid.sum())}", page_num))
+    return results
+
+
+def _tolerance_frames(geometry, words):
+    """Рамки допусков: прямоугольники со знаком допуска; возвращает [(рамка, слова в ней)]"""
+    frames = []
+    for rect in geometry.rects:
+        frame = fitz.Rect(*rect)
+        if frame.height > TOLERANCE_FRAME_MAX_HEIGHT:
+            continue  # рамка листа, контуры деталей
+        inside = [w for w in words if fitz.Point((w[0] + w[2]) / 2, (w[1] + w[3]) / 2) in frame]
+        if any(ch in TOLERANCE_SYMBOLS for w in inside for ch in w[4]):
+            frames.append((frame, inside))
+    # Ячейки одной рамки сливаются в одну рамку
+    merged = []
+    for frame, inside in sorted(frames, key=lambda item: item[0].x0):
+        if merged and merged[-1][0].intersects(frame + (-0.5, -0.5, 0.5, 0.5)):
+            merged[-1] = (merged[-1][0] | frame, merged[-1][1] + inside)
+        else:
+            merged.append((frame, inside))
+    return merged
+
+
+def _connected_chain(geometry, start, max_hops=3):
+    """Индексы отрезков ломаной, начинающейся в точке start, и ее конечная точка"""
+    ends = geometry.endpoints()
+    chain = []
+    visited = [numpy.array(start)]
+    for _ in range(max_hops):
+        distance = numpy.linalg.norm(ends - visited[-1][None, None, :], axis=2)
+        distance[chain] = numpy.inf
+        candidates = numpy.argwhere(distance <= CONNECT_TOL)
+        # Совпадающие отрезки (контур, обведенный дважды) не уводят ломаную назад
+        step = next(((index, end) for index, end in candidates
+                     if min(numpy.linalg.norm(ends[index, 1 - end] - point) for point in visited) > CONNECT_TOL),
+                    None)
+        if step is None:
+            break
+        chain.append(step[0])
+        visited.append(ends[step[0], 1 - step[1]])
+    return chain, visited[-1]
+
+
+def check_tolerance_arrows(geometry, words, page_num, frames):
+    """Рамка допуска соединяется с элементом линией со стрелкой (или с треугольником базы)"""
+    if not frames:
+        return [RuleResult(ITEM_TOLERANCE_ARROWS, UNDECIDED, "рамок допусков не найдено", page_num)]
+    ends = geometry.endpoints()
+    tips = geometry.arrows[:, :2]
+    triangle_points = geometry.triangles.reshape(-1, 3, 2)
+    results = []
+    for frame, inside in frames:
+        label = "".join(w[4] for w in inside)
+        touching = []
+        for end in (0, 1):
+            near = _border_distance(ends[:, end], tuple(frame)) < CONNECT_TOL
+            # Отрезки самой рамки (ее стороны и перегородки) не считаются
+            other = _border_distance(ends[:, 1 - end], tuple(frame)) > CONNECT_TOL
+            touching.extend((index, end) for index in numpy.flatnonzero(near & other))
+        if not touching:
+            results.append(RuleResult(ITEM_TOLERANCE_ARROWS, FAIL,
+                                      f"рамка {label} не соединена с элементом", page_num, frame,
+                                      GOST_FORM_TOLERANCES))
+            continue
+        connected = False
+        for index, end in touching:
+            chain, point = _connected_chain(geometry, ends[index, end])
+            if len(tips) and numpy.linalg.norm(tips - point, axis=1).min() < CONNECT_TOL:
+                connected = True
+            elif len(triangle_points) and numpy.linalg.norm(triangle_points - point, axis=2).min() < 2 * MM:
+                connected = True
+        if not connected:
+            results.append(RuleResult(ITEM_TOLERANCE_ARROWS, FAIL,
+                                      f"соединительная линия рамки {label} без стрелки", page_num,
+                                      frame, GOST_FORM_TOLERANCES))
+    if not results:
+        results.append(RuleResult(ITEM_TOLERANCE_ARROWS, OK,
+                                  f"рамок допусков: {len(frames)}, соединены стрелками", page_num))
+    return results
+
+
+def check_datums(geometry, words, page_num, frames):
+    """Буквы баз в рамках допусков должны быть обозначены на листе рамкой с треугольником"""
+    frame_rects = [frame for frame, _ in frames]
+    defined = {}
+    for rect in geometry.rects:
+        box = fitz.Rect(*rect)
+        if not (3 * MM <= box.width <= 12 * MM and abs(box.width - box.height) <= 2 * MM):
+            continue
+        if any(box.intersects(frame) for frame in frame_rects):
+            continue
+        letters = [w for w in words if DATUM_LETTER.match(w[4]) and box.contains(fitz.Rect(w[:4]))]
+        if len(letters) == 1:
+            defined.setdefault(letters[0][4], []).append(box)
+
+    results = []
+    triangle_centers = geometry.triangles.reshape(-1, 3, 2).mean(axis=1)
+    for letter, boxes in sorted(defined.items()):
+        if len(boxes) > 1:
+            results.append(RuleResult(ITEM_DATUMS, FAIL, f"база {letter} обозначена {len(boxes)} раза",
+                                      page_num, boxes[1], GOST_FORM_TOLERANCES))
+        for box in boxes:
+            reach = box + (-15 * MM, -15 * MM, 15 * MM, 15 * MM)
+            if not any(fitz.Point(*center) in reach for center in triangle_centers):
+                results.append(RuleResult(ITEM_DATUMS, FAIL,
+                                          f"рамка базы {letter} без зачерненного треугольника",
+                                          page_num, box, GOST_FORM_TOLERANCES))
+
+    referenced = {}
+    for frame, inside in frames:
+        for w in inside:
+            for letter in DATUM_REFERENCE.findall(w[4]):
+                referenced.setdefault(letter, frame)
+    for letter in sorted(set(referenced) - set(defined)):
+        frame = referenced[letter]
+        results.append(RuleResult(ITEM_DATUMS, FAIL,
+                                  f"база {letter} указана в рамке допуска, но не обозначена на листе",
+                                  page_num, frame, GOST_FORM_TOLERANCES))
+    if not results and not defined:
+        results.append(RuleResult(ITEM_DATUMS, UNDECIDED, "обозначений баз не найдено", page_num))
+    elif not results:
+        results.append(RuleResult(ITEM_DATUMS, OK, f"базы: {', '.join(sorted(defined))}", page_num))
+    return results
+
+
+def _outside(geometry, title_block):
+    """Геометрия без основной надписи и рамки листа: их линии и графы не относятся к изображению"""
+    x0, y0, x1, y1 = tuple(title_block)
+
+    def keep(boxes):
+        left = numpy.minimum(boxes[:, 0], boxes[:, 2])
+        right = numpy.maximum(boxes[:, 0], boxes[:, 2])
+        top = numpy.minimum(boxes[:, 1], boxes[:, 3])
+        bottom = numpy.maximum(boxes[:, 1], boxes[:, 3])
+        inside = (left >= x0 - 1) & (right <= x1 + 1) & (top >= y0 - 1) & (bottom <= y1 + 1)
+        return boxes[~inside]
+    geometry.segments = keep(geometry.segments)
+    geometry.rects = keep(geometry.rects)
+    return geometry
+
+
+def check_page(page, page_num, words=None, title_block=None):
+    """Результаты геометрических правил листа (RuleResult)"""
+    if numpy is None:
+        return [RuleResult(item, UNDECIDED, "numpy не установлен", page_num) for item in ITEMS]
+    geometry = extract_geometry(page)
+    if title_block is not None:
+        geometry = _outside(geometry, title_block)
+    if geometry.is_empty:
+        return [RuleResult(item, UNDECIDED, "векторная графика не найдена", page_num) for item in ITEMS]
+    words = words if words is not None else page.get_text("words")
+    if title_block is not None:
+        words = [w for w in words if not fitz.Rect(w[:4]).intersects(title_block)]
+    if not words:
+        # Текст кривыми или только основная надпись: размеры и базы не прочитать
+        return [RuleResult(item, UNDECIDED, "текст на изображении не извлекается", page_num) for item in ITEMS]
+    frames = _tolerance_frames(geometry, words)
+    results = []
+    results.extend(check_linear_dimensions(geometry, words, page_num))
+    results.extend(check_angular_dimensions(geometry, words, page_num))
+    results.extend(check_tolerance_arrows(geometry, words, page_num, frames))
+    results.extend(check_datums(geometry, words, page_num, frames))
+    return results
@@ -0,0 +1,362 @@
+"""Поиск по текстам ГОСТ: пункты стандартов из docs/ для промпта.
+
+PDF стандартов разбираются на пункты (номер пункта и текст), по ним строится
+индекс BM25 и, если задана модель, эмбеддинги через /api/embed Ollama. Индекс
+сохраняется на диск и при неизменном наборе PDF загружается без разбора. Для
+каждой проверки в промпт попадают только top-k пунктов, относящихся к тексту
+чертежа и непроверенным критериям и укладывающиеся в бюджет токенов (fit_clauses),
+поэтому модель ссылается на реальные пункты, а размер промпта не растет с
+библиотекой стандартов.
+
+    python gost_index.py docs/ --embed-model nomic-embed-text
+    python gost_index.py docs/ --query "шероховатость поверхности знак"
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import fitz  # PyMuPDF
+import numpy as np
+
+import chunking
+from result_cache import DEFAULT_CACHE_DIR
+
+INDEX_VERSION = "1"
+DEFAULT_DOCS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "docs")
+DEFAULT_INDEX_DIR = os.path.join(DEFAULT_CACHE_DIR, "gost_index")
+DEFAULT_TOP_K = 5
+
+MAX_CLAUSE_CHARS = 1200  # длинные пункты делятся на части, чтобы выдержка была короткой
+EMBED_BATCH = 32
+QUERY_CHARS = 2000  # начало запроса, которое идет в эмбеддинг
+QUERY_CACHE_SIZE = 256  # векторов запросов в памяти
+QUERY_TIMEOUT = (5, 10)
+EMBED_RETRY = 60  # секунд без эмбеддинга запросов после ошибки /api/embed
+K1 = 1.5
+B = 0.75
+
+GOST_NAME = re.compile(r"ГОСТ\s+(?:Р\s+)?(?:ИСО\s+)?\d+(?:\.\d+)*-\d{2,4}")
+# Начало пункта: "4.1.2 Текст" или "5. Текст" в начале строки
+CLAUSE_START = re.compile(r"^\s*(\d{1,2}(?:\.\d{1,2}){0,3})\.?\s+(?=[А-ЯЁA-Z])")
+WORD = re.compile(r"[а-яёa-z0-9]+")
+STOP_WORDS = {"и", "в", "во", "на", "по", "с", "со", "к", "ко", "о", "об", "от", "до", "из", "за",
+              "для", "не", "или", "а", "что", "как", "при", "это", "его", "их", "же", "то"}
+
+
+def tokenize(text):
+    """Слова в нижнем регистре; русские обрезаются до 6 букв вместо стемминга"""
+    tokens = []
+    for word in WORD.findall(text.lower().replace("ё", "е")):
+        if word in STOP_WORDS:
+            continue
+        tokens.append(word[:6] if word.isalpha() else word)
+    return tokens
+
+
+def gost_name(doc, path):
+    """Обозначение стандарта с первых страниц или имя файла"""
+    for page_num in range(min(2, len(doc))):
+        match = GOST_NAME.search(doc[page_num].get_text())
+        if match:
+            return re.sub(r"\s+", " ", match.group(0))
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def parse_clauses(path):
+    """Пункты стандарта: [{"gost", "clause", "page", "text"}]"""
+    clauses = []
+    with fitz.open(path) as doc:
+        gost = gost_name(doc, path)
+        current = None
+        for page_num, page in enumerate(doc):
+            for line in page.get_text().splitlines():
+                line = line.strip()
+                if not line:
+                    continue
+                match = CLAUSE_START.match(line)
+                if match:
+                    current = {"gost": gost, "clause": match.group(1), "page": page_num + 1, "lines": []}
+                    clauses.append(current)
+                if current is not None:
+                    current["lines"].append(line)
+    result = []
+    for clause in clauses:
+        text = re.sub(r"-\s+(?=[а-яё])", "", " ".join(clause.pop("lines")))  # переносы слов
+        for start in range(0, len(text), MAX_CLAUSE_CHARS):
+            result.append(dict(clause, text=text[start:start + MAX_CLAUSE_CHARS]))
+    return result
+
+
+def list_sources(docs_dir):
+    """PDF стандартов с размером и временем изменения - по ним видно, что индекс устарел"""
+    sources = {}
+    if not os.path.isdir(docs_dir):
+        return sources
+    for name in sorted(os.listdir(docs_dir)):
+        if name.lower().endswith(".pdf"):
+            st = os.stat(os.path.join(docs_dir, name))
+            sources[name] = [st.st_size, int(st.st_mtime)]
+    return sources
+
+
+def embed(client, model, texts, timeout=(5, 300)):
+    """Эмбеддинги текстов через /api/embed; None, если модель недоступна"""
+    vectors = []
+    try:
+        for start in range(0, len(texts), EMBED_BATCH):
+            response = client.post("/api/embed", {"model": model, "input": texts[start:start + EMBED_BATCH],
+                                                  "keep_alive": client.keep_alive}, timeout)
+            if response.status_code != 200:
+                return None
+            vectors.extend(response.json()["embeddings"])
+    except Exception:
+        return None
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def embed_clauses(client, model, clauses, progress):
+    """Эмбеддинги пунктов; None - модель недоступна"""
+    progress(f"Эмбеддинги пунктов ({model})...")
+    embeddings = embed(client, model, [f"{c['gost']} п. {c['clause']} {c['text']}" for c in clauses])
+    if embeddings is None:
+        progress(f"Модель {model} недоступна, поиск только по BM25")
+    return embeddings
+
+
+class GostIndex:
+    """Индекс BM25 (и эмбеддинги) по пунктам стандартов"""
+
+    def __init__(self, clauses, sources=None, embed_model=None, embeddings=None):
+        self.clauses = clauses
+        self.sources = sources or {}
+        self.embed_model = embed_model if embeddings is not None else None
+        self.embeddings = embeddings
+        self.client = None  # OllamaClient для эмбеддинга запросов
+        self._vectors = OrderedDict()  # sha1 запроса -> вектор (LRU)
+        self._vectors_lock = threading.Lock()
+        self._embed_failed = None  # time.monotonic() последней ошибки эмбеддинга запроса
+        self._lengths = []
+        self._postings = {}
+        for doc_id, clause in enumerate(clauses):
+            tokens = tokenize(f"{clause['gost']} {clause['text']}")
+            self._lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                self._postings.setdefault(term, []).append((doc_id, tf))
+        self._avg_length = sum(self._lengths) / len(self._lengths) if self._lengths else 0.0
+
+    def __len__(self):
+        return len(self.clauses)
+
+    @property
+    def signature(self):
+        """Короткий хэш набора стандартов - входит в ключ кэша результатов"""
+        material = json.dumps([INDEX_VERSION, self.sources, self.embed_model], sort_keys=True)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()[:12]
+
+    @classmethod
+    def build(cls, docs_dir, embed_model=None, client=None, progress=None):
+        progress = progress or (lambda message: None)
+        sources = list_sources(docs_dir)
+        clauses = []
+        for name in sources:
+            try:
+                parsed = parse_clauses(os.path.join(docs_dir, name))
+            except Exception as e:
+                progress(f"Не удалось разобрать {name}: {e}")
+                continue
+            progress(f"{name}: пунктов {len(parsed)}")
+            clauses.extend(parsed)
+        embeddings = None
+        if embed_model and client is not None and clauses:
+            embeddings = embed_clauses(client, embed_model, clauses, progress)
+        index = cls(clauses, sources, embed_model, embeddings)
+        index.client = client
+        return index
+
+    def save(self, index_dir=DEFAULT_INDEX_DIR):
+        os.makedirs(index_dir, exist_ok=True)
+        with open(os.path.join(index_dir, "index.json"), "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_VERSION, "sources": self.sources,
+                       "embed_model": self.embed_model, "clauses": self.clauses}, f, ensure_ascii=False)
+        embeddings_path = os.path.join(index_dir, "embeddings.npy")
+        if self.embeddings is not None:
+            np.save(embeddings_path, self.embeddings)
+        elif os.path.exists(embeddings_path):
+            os.remove(embeddings_path)
+
+    @classmethod
+    def load(cls, index_dir=DEFAULT_INDEX_DIR):
+        """Сохраненный индекс или None"""
+        try:
+            with open(os.path.join(index_dir, "index.json"), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != INDEX_VERSION:
+            return None
+        embeddings = None
+        if data.get("embed_model"):
+            try:
+                embeddings = np.load(os.path.join(index_dir, "embeddings.npy"))
+            except (OSError, ValueError):
+                return None
+        return cls(data["clauses"], data["sources"], data.get("embed_model"), embeddings)
+
+    @classmethod
+    def load_or_build(cls, docs_dir=DEFAULT_DOCS_DIR, index_dir=DEFAULT_INDEX_DIR, embed_model=None,
+                      client=None, progress=None):
+        """Индекс с диска, если набор PDF не менялся, иначе строит и сохраняет заново.
+
+        При другой модели эмбеддингов PDF заново не разбираются: к сохраненным
+        пунктам добавляются эмбеддинги. Если модель недоступна, работает BM25, а
+        эмбеддинги будут построены при следующем запуске. None - в docs_dir нет стандартов.
+        """
+        sources = list_sources(docs_dir)
+        if not sources:
+            return None
+        index = cls.load(index_dir)
+        if index is None or index.sources != sources:
+            index = cls.build(docs_dir, embed_model, client, progress)
+            index._save_quietly(index_dir)
+        elif index.embed_model != (embed_model or None):
+            embeddings = None
+            if embed_model and client is not None and index.clauses:
+                embeddings = embed_clauses(client, embed_model, index.clauses, progress or (lambda message: None))
+            index = cls(index.clauses, index.sources, embed_model, embeddings)
+            if embeddings is not None or not embed_model:
+                index._save_quietly(index_dir)
+        index.client = client
+        return index
+
+    def _save_quietly(self, index_dir):
+        try:
+            self.save(index_dir)
+        except OSError:
+            pass  # индекс в памяти работает и без записи на диск
+
+    def _bm25(self, query_tokens):
+        scores = np.zeros(len(self.clauses), dtype=np.float32)
+        total = len(self.clauses)
+        for term in set(query_tokens):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings:
+                norm = K1 * (1 - B + B * self._lengths[doc_id] / self._avg_length)
+                scores[doc_id] += idf * tf * (K1 + 1) / (tf + norm)
+        return scores
+
+    def _query_vector(self, query):
+        """Эмбеддинг запроса из кэша или /api/embed; None - без эмбеддингов.
+
+        Одинаковые запросы (повторные проверки, те же листы) не ходят в Ollama, а
+        после ошибки EMBED_RETRY секунд поиск идет только по BM25 без лишних запросов.
+        """
+        if self.embeddings is None or self.client is None:
+            return None
+        query = query[:QUERY_CHARS]
+        key = hashlib.sha1(query.encode("utf-8")).hexdigest()
+        with self._vectors_lock:
+            vector = self._vectors.get(key)
+            if vector is not None:
+                self._vectors.move_to_end(key)
+                return vector
+            if self._embed_failed is not None and time.monotonic() - self._embed_failed < EMBED_RETRY:
+                return None
+        vectors = embed(self.client, self.embed_model, [query], timeout=QUERY_TIMEOUT)
+        with self._vectors_lock:
+            if vectors is None:
+                self._embed_failed = time.monotonic()
+                return None
+            self._vectors[key] = vectors[0]
+            if len(self._vectors) > QUERY_CACHE_SIZE:
+                self._vectors.popitem(last=False)
+        return vectors[0]
+
+    def search(self, query, k=DEFAULT_TOP_K):
+        """top-k пунктов к запросу: [(оценка, пункт)]"""
+        if not self.clauses or k <= 0:
+            return []
+        scores = self._bm25(tokenize(query))
+        if scores.max() > 0:
+            scores = scores / scores.max()
+        vector = self._query_vector(query)
+        if vector is not None:
+            # Поровну BM25 (точные термины, номера ГОСТ) и близость по смыслу
+            scores = 0.5 * scores + 0.5 * np.clip(self.embeddings @ vector, 0, None)
+        order = np.argsort(-scores)[:k]
+        return [(float(scores[i]), self.clauses[i]) for i in order if scores[i] > 0]
+
+
+def format_clauses(found):
+    """Выдержки для промпта: [ГОСТ 2.307-2011, п. 4.1] текст"""
+    return "\n".join(f"[{clause['gost']}, п. {clause['clause']}] {clause['text']}" for _, clause in found)
+
+
+def fit_clauses(found, max_tokens):
+    """Лучшие пункты, выдержки которых укладываются в max_tokens: k уменьшается под бюджет.
+
+    Если не помещается даже первый пункт, идет его начало.
+    """
+    result = []
+    used = 0
+    for score, clause in found:
+        tokens = chunking.estimate_tokens(format_clauses([(score, clause)])) + 1
+        if used + tokens <= max_tokens:
+            result.append((score, clause))
+            used += tokens
+            continue
+        if not result:
+            cut = len(clause["text"]) * max_tokens // tokens
+            if cut > 0:
+                result.append((score, dict(clause, text=clause["text"][:cut])))
+        break
+    return result
+
+
+def main(argv=None):
+    import ollama_client
+
+    parser = argparse.ArgumentParser(description="Индекс пунктов ГОСТ для проверки чертежей")
+    parser.add_argument("docs", nargs="?", default=DEFAULT_DOCS_DIR, help="Каталог PDF стандартов")
+    parser.add_argument("--index-dir", default=DEFAULT_INDEX_DIR, help="Где хранить индекс")
+    parser.add_argument("--embed-model", default=None,
+                        help="Модель эмбеддингов Ollama (например nomic-embed-text); без нее - только BM25")
+    parser.add_argument("--url", default=ollama_client.OLLAMA_URL,
+                        help="Адрес сервера Ollama; несколько серверов - через запятую")
+    parser.add_argument("--rebuild", action="store_true", help="Разобрать PDF заново")
+    parser.add_argument("--query", default=None, help="Показать найденные пункты для запроса")
+    parser.add_argument("-k", type=int, default=DEFAULT_TOP_K, help="Сколько пунктов выводить")
+    args = parser.parse_args(argv)
+
+    client = ollama_client.OllamaClient(args.url) if args.embed_model else None
+    report = lambda message: print(message, file=sys.stderr)
+    if args.rebuild:
+        index = GostIndex.build(args.docs, args.embed_model, client, report)
+        index.save(args.index_dir)
+    else:
+        index = GostIndex.load_or_build(args.docs, args.index_dir, args.embed_model, client, report)
+    if index is None:
+        print(f"В {args.docs} нет PDF стандартов", file=sys.stderr)
+        return 1
+    print(f"Пунктов: {len(index)}, стандартов: {len(index.sources)}, "
+          f"эмбеддинги: {index.embed_model or 'нет'}", file=sys.stderr)
+    if args.query:
+        for score, clause in index.search(args.query, args.k):
+            print(f"{score:.3f} [{clause['gost']}, п. {clause['clause']}, с. {clause['page']}] "
+                  f"{clause['text'][:200]}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
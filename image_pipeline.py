@@ -0,0 +1,239 @@
+"""Подготовка изображений листов для vision-модели.
+
+Вместо целой страницы в 150 dpi отправляются только значимые области:
+основная надпись, технические требования и зоны с плотной простановкой
+размеров. Каждая область рендерится со своим dpi в оттенках серого
+(или двух уровнях), кодируется в PNG прямо из pixmap PyMuPDF и
+укладывается в бюджет байт на лист. Число изображений в запросе ограничено
+контекстом модели: при лимите первыми идут самые важные области всех листов.
+"""
+import base64
+import copy
+import re
+
+import fitz  # PyMuPDF
+
+import spans
+
+try:
+    import numpy
+except ImportError:  # без numpy бинаризация просто не выполняется
+    numpy = None
+
+MM = 72 / 25.4  # пунктов в миллиметре
+
+# Основная надпись по ГОСТ 2.104: 185 x 55 мм в правом нижнем углу рамки (поле 5 мм)
+TITLE_BLOCK_WIDTH = 185 * MM
+TITLE_BLOCK_HEIGHT = 55 * MM
+FRAME_MARGIN = 5 * MM
+
+TITLE_MARKERS = ("разраб", "пров", "т.контр", "н.контр", "утв", "лит", "масса", "масштаб", "лист")
+TECH_REQ_HEADER = "технические требования"
+TECH_REQ_ITEM = re.compile(r"^\s*\d{1,2}\s*[.)]\s")
+DIMENSION_WORD = re.compile(r"^[ØR⌀M]?\d+(?:[.,]\d+)?(?:[±+\-]\d+(?:[.,]\d+)?)?°?$")
+
+
+class ImagePipelineConfig:
+    """Настройки подготовки изображений"""
+
+    def __init__(self, title_block_dpi=200, tech_req_dpi=150, dimension_dpi=150,
+                 overview_dpi=40, grayscale=True, bilevel=True, bilevel_threshold=200,
+                 max_bytes_per_page=400 * 1024, min_dpi=60, dimension_grid=4,
+                 max_dimension_zones=2, min_dimension_words=4, max_images=None):
+        self.title_block_dpi = title_block_dpi
+        self.tech_req_dpi = tech_req_dpi
+        self.dimension_dpi = dimension_dpi
+        self.overview_dpi = overview_dpi  # 0 - без обзорного изображения листа
+        self.grayscale = grayscale
+        self.bilevel = bilevel
+        self.bilevel_threshold = bilevel_threshold
+        self.max_bytes_per_page = max_bytes_per_page  # бюджет на base64-данные листа
+        self.min_dpi = min_dpi
+        self.dimension_grid = dimension_grid
+        self.max_dimension_zones = max_dimension_zones
+        self.min_dimension_words = min_dimension_words
+        # Изображений на запрос: каждое занимает chunking.IMAGE_TOKENS контекста модели;
+        # None - без лимита (engine.OllamaAnalyzer.image_limit считает его по окну модели)
+        self.max_images = max_images
+
+
+def with_image_limit(config, max_images):
+    """Копия настроек с лимитом изображений на запрос, если он не задан явно"""
+    config = copy.copy(config or ImagePipelineConfig())
+    if config.max_images is None:
+        config.max_images = max_images
+    return config
+
+
+class Region:
+    """Область листа для отдельной отправки в модель"""
+
+    def __init__(self, name, rect, dpi, priority):
+        self.name = name
+        self.rect = rect
+        self.dpi = dpi
+        self.priority = priority  # меньше - важнее, при нехватке бюджета отбрасываются последними
+
+
+class PageImages:
+    """Изображения одного листа и статистика по отправляемым байтам"""
+
+    def __init__(self, page_num):
+        self.page_num = page_num
+        self.images = []
+        self.regions = []  # (имя области, dpi, байт base64)
+        self.priorities = []  # Region.priority каждого изображения
+
+    @property
+    def total_bytes(self):
+        return sum(size for _, _, size in self.regions)
+
+    def summary(self):
+        parts = ", ".join(f"{name} {dpi} dpi {size / 1024:.1f} КБ" for name, dpi, size in self.regions)
+        return f"Лист {self.page_num + 1}: {self.total_bytes / 1024:.1f} КБ ({parts})"
+
+
+def find_title_block(page, words):
+    """Прямоугольник основной надписи: стандартное место, уточненное по ключевым словам"""
+    rect = page.rect
+    block = fitz.Rect(rect.x1 - FRAME_MARGIN - TITLE_BLOCK_WIDTH,
+                      rect.y1 - FRAME_MARGIN - TITLE_BLOCK_HEIGHT,
+                      rect.x1 - FRAME_MARGIN, rect.y1 - FRAME_MARGIN)
+    markers = fitz.Rect()
+    for x0, y0, x1, y1, word in (w[:5] for w in words):
+        if x0 < rect.width * 0.4 or y0 < rect.height * 0.5:
+            continue
+        if word.lower().startswith(TITLE_MARKERS):
+            markers |= fitz.Rect(x0, y0, x1, y1)
+    if not markers.is_empty:
+        block |= markers
+    return block & rect
+
+
+def find_tech_requirements(page, title_block):
+    """Технические требования: текстовые блоки над основной надписью в ее колонке"""
+    area = fitz.Rect()
+    for x0, y0, x1, y1, text, *_ in page.get_text("blocks"):
+        if y1 > title_block.y0 + 2 * MM or x0 < title_block.x0 - 10 * MM:
+            continue
+        if TECH_REQ_HEADER in text.lower() or TECH_REQ_ITEM.match(text):
+            area |= fitz.Rect(x0, y0, x1, y1)
+    if area.is_empty:
+        return None
+    return (area + (-2 * MM, -2 * MM, 2 * MM, 2 * MM)) & page.rect
+
+
+def find_dimension_zones(page, words, title_block, config):
+    """Ячейки сетки с наибольшим числом размерных чисел"""
+    rect = page.rect
+    grid = config.dimension_grid
+    cell_w = rect.width / grid
+    cell_h = rect.height / grid
+    counts = {}
+    for x0, y0, x1, y1, word in (w[:5] for w in words):
+        if not DIMENSION_WORD.match(word):
+            continue
+        center = fitz.Point((x0 + x1) / 2, (y0 + y1) / 2)
+        if center in title_block:
+            continue
+        cell = (min(int(center.x / cell_w), grid - 1), min(int(center.y / cell_h), grid - 1))
+        counts[cell] = counts.get(cell, 0) + 1
+    best = sorted(counts.items(), key=lambda item: -item[1])[:config.max_dimension_zones]
+    zones = []
+    for (col, row), count in best:
+        if count < config.min_dimension_words:
+            continue
+        zones.append(fitz.Rect(col * cell_w, row * cell_h, (col + 1) * cell_w, (row + 1) * cell_h))
+    return zones
+
+
+def detect_regions(page, config):
+    words = page.get_text("words")
+    title_block = find_title_block(page, words)
+    regions = [Region("основная надпись", title_block, config.title_block_dpi, 0)]
+    tech = find_tech_requirements(page, title_block)
+    if tech is not None:
+        regions.append(Region("технические требования", tech, config.tech_req_dpi, 1))
+    for i, zone in enumerate(find_dimension_zones(page, words, title_block, config)):
+        regions.append(Region(f"размеры {i + 1}", zone, config.dimension_dpi, 2))
+    if config.overview_dpi:
+        regions.append(Region("общий вид", page.rect, config.overview_dpi, 3))
+    return regions
+
+
+def _binarize(pix, threshold):
+    samples = numpy.frombuffer(pix.samples_mv, dtype=numpy.uint8)
+    samples = numpy.where(samples < threshold, 0, 255).astype(numpy.uint8)
+    return fitz.Pixmap(fitz.csGRAY, pix.width, pix.height, samples.tobytes(), 0)
+
+
+def encode_region(session, page_num, region, dpi, config):
+    """PNG области прямо из pixmap, без PIL"""
+    colorspace = fitz.csGRAY if config.grayscale else None
+    pix = session.pixmap(page_num, dpi=dpi, clip=region.rect, colorspace=colorspace)
+    with session.tracer.span(spans.ENCODE, page=page_num, region=region.name, dpi=dpi) as attrs:
+        if config.grayscale and config.bilevel and numpy is not None:
+            pix = _binarize(pix, config.bilevel_threshold)
+        data = base64.b64encode(pix.tobytes("png")).decode("ascii")
+        attrs["bytes"] = len(data)
+    return data
+
+
+def render_page(session, page_num, config=None, regions=None):
+    """Рендерит значимые области листа в пределах бюджета байт (regions - уже выбранные области)"""
+    config = config or ImagePipelineConfig()
+    if regions is None:
+        regions = sorted(detect_regions(session.page(page_num), config), key=lambda region: region.priority)
+        regions = regions[:config.max_images]
+    scale = 1.0
+    while True:
+        encoded = []
+        at_min_dpi = True
+        for region in regions:
+            floor = min(config.min_dpi, region.dpi)
+            dpi = max(floor, int(region.dpi * scale))
+            at_min_dpi = at_min_dpi and dpi == floor
+            encoded.append((region, dpi, encode_region(session, page_num, region, dpi, config)))
+        total = sum(len(data) for _, _, data in encoded)
+        if total <= config.max_bytes_per_page or at_min_dpi:
+            break
+        scale *= 0.75
+
+    # Если даже минимальный dpi не уложился, отбрасываем наименее важные области
+    encoded.sort(key=lambda item: item[0].priority)
+    while len(encoded) > 1 and total > config.max_bytes_per_page:
+        total -= len(encoded.pop()[2])
+
+    result = PageImages(page_num)
+    for region, dpi, data in encoded:
+        result.images.append(data)
+        result.regions.append((region.name, dpi, len(data)))
+        result.priorities.append(region.priority)
+    return result
+
+
+def render_pages(session, page_nums, config=None):
+    """Рендерит листы документа для одного запроса (список PageImages).
+
+    При лимите config.max_images из областей всех листов остаются самые важные:
+    сначала основные надписи всех листов, затем технические требования и т.д.
+    Лишние области не рендерятся; листы без областей в список не входят.
+    """
+    config = config or ImagePipelineConfig()
+    found = [(page_num, region) for page_num in page_nums
+             for region in detect_regions(session.page(page_num), config)]
+    found.sort(key=lambda item: (item[1].priority, item[0]))
+    found = found[:config.max_images]
+    pages = []
+    for page_num in page_nums:
+        regions = [region for n, region in found if n == page_num]
+        if regions:
+            pages.append(render_page(session, page_num, config, regions))
+    return pages
+
+
+def ordered_images(pages):
+    """Изображения листов одним списком, важные первыми (при нехватке контекста отбрасываются последние)"""
+    items = [(priority, page.page_num, image) for page in pages
+             for priority, image in zip(page.priorities, page.images)]
+    return [image for _, _, image in sorted(items, key=lambda item: item[:2])]
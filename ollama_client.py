@@ -0,0 +1,495 @@
+"""Общий клиент Ollama: пул соединений, список моделей, прогрев и измеренная скорость моделей.
+
+Клиент работает с одним или несколькими серверами Ollama (адреса через запятую):
+запрос уходит на доступный сервер, где модель уже в памяти и меньше запросов в
+работе; при ошибке соединения, таймауте или 5xx он повторяется на другом сервере.
+"""
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import urllib3
+
+OLLAMA_URL = "http://localhost:11434"
+DEFAULT_KEEP_ALIVE = "30m"  # сколько модель остается в памяти после последнего запроса
+TAGS_MAX_AGE = 30  # секунд, в течение которых список моделей берется из памяти
+
+# Таймаут ответа по измеренной скорости модели: загрузка + TIMEOUT_FACTOR * расчетное время
+MIN_TIMEOUT = 15
+MAX_TIMEOUT = 600
+TIMEOUT_FACTOR = 3  # запас: очередь запросов на сервере, ответ длиннее среднего
+SPEED_WEIGHT = 0.3  # вес нового замера в скользящем среднем
+NS = 1e9
+
+# Пул серверов
+HEALTH_INTERVAL = 15  # секунд между проверками серверов (/api/tags, /api/ps)
+CHECK_TIMEOUT = 5
+RETRIES = 2  # повторов запроса (на других серверах, если они есть)
+RETRY_BACKOFF = 0.5  # с перед первым повтором, дальше вдвое больше
+LOAD_PENALTY = 2  # модель не в памяти сервера: весит как столько запросов в работе
+
+# CancelToken запроса post(), который выполняет текущий поток: соединение сообщает ему свой сокет
+_current = threading.local()
+
+
+class CancelToken:
+    """Отмена запросов post() из другого потока.
+
+    cancel() закрывает сокеты запросов, выполняющихся с этим токеном: Ollama перестает
+    генерировать, поток запроса получает ошибку соединения. should_stop - внешний
+    признак остановки (функция без аргументов), учитывается в cancelled.
+    """
+
+    def __init__(self, should_stop=None):
+        self.should_stop = should_stop or (lambda: False)
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._sockets = {}  # поток -> сокет его текущего запроса
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set() or self.should_stop()
+
+    def cancel(self):
+        self._cancelled.set()
+        self._shutdown()
+
+    def attach(self, sock):
+        """Сокет запроса текущего потока; после cancel() закрывается сразу"""
+        with self._lock:
+            self._sockets[threading.get_ident()] = sock
+        if self._cancelled.is_set():
+            self._shutdown()
+
+    def release(self):
+        """Запрос текущего потока завершен (потоковый ответ - после чтения)"""
+        with self._lock:
+            self._sockets.pop(threading.get_ident(), None)
+
+    def _shutdown(self):
+        with self._lock:
+            sockets = list(self._sockets.values())
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class _TrackedConnection:
+    """Соединение, которое отдает сокет токену отмены, чтобы запрос можно было оборвать"""
+
+    def send(self, data):
+        super().send(data)
+        token = getattr(_current, "token", None)
+        if token is not None:
+            token.attach(self.sock)
+
+
+class _TrackedHTTPConnection(_TrackedConnection, urllib3.connection.HTTPConnection):
+    pass
+
+
+class _TrackedHTTPSConnection(_TrackedConnection, urllib3.connection.HTTPSConnection):
+    pass
+
+
+class _TrackedHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = _TrackedHTTPConnection
+
+
+class _TrackedHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = _TrackedHTTPSConnection
+
+
+class CancellableAdapter(requests.adapters.HTTPAdapter):
+    """HTTP-адаптер, соединения которого можно закрыть из другого потока.
+
+    Ollama отправляет заголовки ответа только после обработки промпта, поэтому
+    закрыть нужно сам сокет, а не объект ответа - иначе отмена во время
+    prompt eval не сработает.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = dict(self.poolmanager.pool_classes_by_scheme,
+                                                       http=_TrackedHTTPConnectionPool,
+                                                       https=_TrackedHTTPSConnectionPool)
+
+
+class ModelSpeed:
+    """Скорость модели по метрикам ответов Ollama: токенов/с промпта и генерации, загрузка"""
+
+    def __init__(self):
+        self.prompt_rate = None
+        self.eval_rate = None
+        self.load_s = 0.0  # самая долгая замеченная загрузка модели в память
+        self.samples = 0
+
+    @staticmethod
+    def _average(old, count, duration):
+        if not count or not duration:
+            return old
+        rate = count / (duration / NS)
+        return rate if old is None else (1 - SPEED_WEIGHT) * old + SPEED_WEIGHT * rate
+
+    def record(self, data):
+        """Учитывает ответ /api/generate (длительности в наносекундах)"""
+        self.prompt_rate = self._average(self.prompt_rate, data.get("prompt_eval_count"),
+                                         data.get("prompt_eval_duration"))
+        self.eval_rate = self._average(self.eval_rate, data.get("eval_count"), data.get("eval_duration"))
+        self.load_s = max(self.load_s, data.get("load_duration", 0) / NS)
+        if data.get("eval_count"):
+            self.samples += 1
+
+    def timeout(self, prompt_tokens, num_predict):
+        """Таймаут чтения ответа, с; None - скорость генерации еще не измерена"""
+        if not self.eval_rate:
+            return None
+        expected = num_predict / self.eval_rate
+        if self.prompt_rate:
+            expected += prompt_tokens / self.prompt_rate
+        return round(min(MAX_TIMEOUT, max(MIN_TIMEOUT, self.load_s + TIMEOUT_FACTOR * expected)), 1)
+
+
+def parse_urls(value):
+    """Адреса серверов из строки через запятую или списка"""
+    if isinstance(value, str):
+        value = value.split(",")
+    return [url.strip().rstrip("/") for url in value if url.strip()]
+
+
+def _same_model(name, names):
+    return name in names or f"{name}:latest" in names
+
+
+class Endpoint:
+    """Сервер Ollama в пуле: доступность, установленные и загруженные модели, запросы в работе"""
+
+    def __init__(self, url):
+        self.url = url
+        self.healthy = True  # до первой проверки сервер считается доступным
+        self.tags = None  # ответ /api/tags; None - сервер еще не проверялся
+        self.loaded = set()  # модели в памяти (/api/ps и успешные запросы)
+        self.inflight = 0
+        self.failures = 0
+        self.checked = 0.0
+
+    def has_model(self, model):
+        return self.tags is None or model is None or _same_model(model, {m["name"] for m in self.tags})
+
+    def score(self, model):
+        """Меньше - лучше: запросы в работе плюс штраф, если модель придется загружать"""
+        loaded = model is None or _same_model(model, self.loaded)
+        return self.inflight + (0 if loaded else LOAD_PENALTY)
+
+    def status(self):
+        return {"url": self.url, "healthy": self.healthy, "inflight": self.inflight,
+                "loaded": sorted(self.loaded), "failures": self.failures}
+
+
+def parse_keep_alive(value):
+    """Ollama принимает длительность строкой ("30m") или числом секунд (-1 - бессрочно)"""
+    if isinstance(value, str) and value.strip().lstrip("-").isdigit():
+        return int(value)
+    return value
+
+
+class OllamaClient:
+    """Одно keep-alive подключение к серверам Ollama на все приложение.
+
+    Соединения переиспользуются между проверками, список моделей (/api/tags)
+    кэшируется, выбранные модели можно заранее загрузить в память в фоне,
+    чтобы первая проверка не тратила таймаут на загрузку модели. По метрикам
+    ответов запоминается скорость каждой модели - из нее считаются таймауты.
+
+    ollama_url - адрес или несколько адресов через запятую. С несколькими
+    серверами клиент раз в health_interval секунд проверяет их (/api/tags,
+    /api/ps) и распределяет запросы post() между доступными.
+    """
+
+    def __init__(self, ollama_url=OLLAMA_URL, keep_alive=DEFAULT_KEEP_ALIVE, pool_size=16,
+                 health_interval=HEALTH_INTERVAL, retries=RETRIES):
+        self.endpoints = [Endpoint(url) for url in parse_urls(ollama_url)] or [Endpoint(OLLAMA_URL)]
+        self.ollama_url = ",".join(endpoint.url for endpoint in self.endpoints)
+        self.keep_alive = keep_alive
+        self.health_interval = health_interval
+        self.retries = retries
+        self.session = requests.Session()
+        adapter = CancellableAdapter(pool_connections=len(self.endpoints), pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._lock = threading.Lock()
+        self._monitor = None
+        self._closed = threading.Event()
+        self._tags = None
+        self._tags_time = 0
+        self._warming = {}  # модель -> поток прогрева
+        self.warm_models = {}  # модель -> время загрузки, с
+        self.speeds = {}  # модель -> ModelSpeed
+
+    @property
+    def keep_alive(self):
+        return self._keep_alive
+
+    @keep_alive.setter
+    def keep_alive(self, value):
+        self._keep_alive = parse_keep_alive(value)
+
+    def close(self):
+        self._closed.set()
+        self.session.close()
+
+    def url(self, path):
+        """Адрес на первом сервере (запросы без выбора сервера)"""
+        return f"{self.endpoints[0].url}{path}"
+
+    def _check(self, endpoint):
+        """Проверка сервера: установленные (/api/tags) и загруженные (/api/ps) модели"""
+        loaded = None
+        try:
+            response = self.session.get(f"{endpoint.url}/api/tags", timeout=CHECK_TIMEOUT)
+            response.raise_for_status()
+            tags = response.json().get("models", [])
+            response = self.session.get(f"{endpoint.url}/api/ps", timeout=CHECK_TIMEOUT)
+            if response.status_code == 200:
+                loaded = {model["name"] for model in response.json().get("models", [])}
+        except (requests.exceptions.RequestException, ValueError):
+            with self._lock:
+                endpoint.healthy = False
+                endpoint.checked = time.time()
+            return
+        with self._lock:
+            endpoint.healthy = True
+            endpoint.failures = 0
+            endpoint.tags = tags
+            if loaded is not None:
+                endpoint.loaded = loaded
+            endpoint.checked = time.time()
+
+    def check_health(self):
+        """Проверяет все серверы одновременно"""
+        if len(self.endpoints) == 1:
+            self._check(self.endpoints[0])
+            return
+        with ThreadPoolExecutor(max_workers=len(self.endpoints)) as pool:
+            list(pool.map(self._check, self.endpoints))
+
+    def _ensure_monitor(self):
+        """Фоновая проверка серверов пула (с одним сервером не нужна)"""
+        if len(self.endpoints) == 1 or self._monitor is not None:
+            return
+        with self._lock:
+            if self._monitor is not None:
+                return
+
+            def run():
+                while not self._closed.wait(self.health_interval):
+                    self.check_health()
+
+            self._monitor = threading.Thread(target=run, daemon=True)
+        self._monitor.start()
+
+    def endpoint_status(self):
+        with self._lock:
+            return [endpoint.status() for endpoint in self.endpoints]
+
+    def tags(self, refresh=False, timeout=CHECK_TIMEOUT):
+        """Установленные модели (ответ /api/tags, со всех доступных серверов), не чаще раза в TAGS_MAX_AGE секунд"""
+        with self._lock:
+            if (not refresh and self._tags is not None
+                    and time.time() - self._tags_time < TAGS_MAX_AGE):
+                return self._tags
+        self.check_health()
+        models = {}
+        with self._lock:
+            healthy = [endpoint for endpoint in self.endpoints if endpoint.healthy]
+            if not healthy:
+                raise requests.exceptions.ConnectionError(f"Серверы Ollama не доступны: {self.ollama_url}")
+            for endpoint in healthy:
+                for model in endpoint.tags or []:
+                    models.setdefault(model["name"], model)
+            self._tags = list(models.values())
+            self._tags_time = time.time()
+            return self._tags
+
+    def _choose(self, model, tried):
+        """Сервер для запроса: доступный, с моделью, сначала модель в памяти и меньше запросов в работе"""
+        with self._lock:
+            candidates = [endpoint for endpoint in self.endpoints if endpoint not in tried] or self.endpoints
+            candidates = [endpoint for endpoint in candidates if endpoint.healthy] or candidates
+            candidates = [endpoint for endpoint in candidates if endpoint.has_model(model)] or candidates
+            endpoint = min(candidates, key=lambda e: e.score(model))
+            endpoint.inflight += 1
+            return endpoint
+
+    def _release(self, endpoint, failed=False):
+        with self._lock:
+            endpoint.inflight -= 1
+            if failed:
+                # До следующей проверки сервер выбирается, только если других нет
+                endpoint.failures += 1
+                endpoint.healthy = False
+
+    def _release_on_close(self, response, endpoint):
+        """Потоковый ответ занимает сервер, пока его не закроют"""
+        close = response.close
+        released = threading.Event()
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                if not released.is_set():
+                    released.set()
+                    self._release(endpoint)
+
+        response.close = close_and_release
+
+    def post(self, path, payload, timeout, stream=False, cancel=None):
+        """POST на сервер пула; ошибка соединения, таймаут или 5xx - повтор на другом сервере.
+
+        Перед повторами пауза RETRY_BACKOFF, 2 * RETRY_BACKOFF... Таймаут чтения и
+        ответ 5xx/404 повторяются только на другом сервере. cancel - CancelToken:
+        его cancel() обрывает запрос, и отмененный запрос не повторяется; после
+        чтения ответа вызывающий освобождает токен (cancel.release()).
+        """
+        _current.token = cancel
+        try:
+            return self._post(path, payload, timeout, stream, cancel)
+        finally:
+            _current.token = None
+
+    def _post(self, path, payload, timeout, stream, cancel):
+        self._ensure_monitor()
+        model = payload.get("model")
+        tried = []
+        delay = RETRY_BACKOFF
+        for attempt in range(self.retries + 1):
+            endpoint = self._choose(model, tried)
+            tried.append(endpoint)
+            untried = any(e not in tried for e in self.endpoints)
+            last = attempt == self.retries
+            try:
+                response = self.session.post(f"{endpoint.url}{path}", json=payload, timeout=timeout,
+                                             stream=stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self._release(endpoint, failed=True)
+                stalled = isinstance(e, requests.exceptions.ReadTimeout)
+                if last or (cancel is not None and cancel.cancelled) or (stalled and not untried):
+                    raise
+                time.sleep(delay)
+                delay *= 2
+                continue
+            if (response.status_code >= 500 or response.status_code == 404) and untried and not last:
+                # 404 - модели нет на этом сервере, 5xx - сервер не справился (нехватка памяти)
+                response.close()
+                self._release(endpoint, failed=response.status_code >= 500)
+                if response.status_code == 404 and endpoint.tags is not None:
+                    with self._lock:
+                        endpoint.tags = [m for m in endpoint.tags if not _same_model(m["name"], {model})]
+                time.sleep(delay)
+                delay *= 2
+                continue
+            with self._lock:
+                endpoint.failures = 0
+                if response.status_code == 200 and model:
+                    endpoint.loaded.add(model)
+            if stream:
+                self._release_on_close(response, endpoint)
+            else:
+                self._release(endpoint)
+            return response
+
+    def model_names(self, refresh=False):
+        return [model["name"] for model in self.tags(refresh)]
+
+    def cheapest_model(self, names):
+        """Самая легкая из установленных моделей списка (по размеру в /api/tags); первая, если сервер недоступен"""
+        try:
+            sizes = {model["name"]: model.get("size", 0) for model in self.tags()}
+        except (requests.exceptions.RequestException, ValueError):
+            return names[0]
+        installed = {}
+        for name in names:
+            size = sizes.get(name, sizes.get(f"{name}:latest"))
+            if size is not None:
+                installed[name] = size
+        return min(installed, key=installed.get) if installed else names[0]
+
+    def record_speed(self, model, data):
+        """Запоминает скорость модели по метрикам ответа"""
+        with self._lock:
+            self.speeds.setdefault(model, ModelSpeed()).record(data)
+
+    def read_timeout(self, model, prompt_tokens, num_predict, default):
+        """Таймаут чтения ответа по измеренной скорости модели или default, пока замеров нет"""
+        with self._lock:
+            speed = self.speeds.get(model)
+            timeout = speed.timeout(prompt_tokens, num_predict) if speed is not None else None
+        return timeout or default
+
+    def is_available(self):
+        """Проверка подключения; заодно обновляет список моделей"""
+        try:
+            self.tags(refresh=True)
+            return True
+        except (requests.exceptions.RequestException, ValueError):
+            return False
+
+    def _warm_up_endpoint(self, endpoint, model, timeout):
+        started = time.time()
+        response = self.session.post(f"{endpoint.url}/api/generate", timeout=timeout,
+                                     json={"model": model, "prompt": "", "stream": False,
+                                           "keep_alive": self.keep_alive})
+        response.raise_for_status()
+        data = response.json()
+        with self._lock:
+            endpoint.loaded.add(model)
+            self.speeds.setdefault(model, ModelSpeed()).record(data)
+        return data.get("load_duration", 0) / NS or time.time() - started
+
+    def warm_up(self, model, timeout=(5, 300)):
+        """Загружает модель в память (пустой промпт) на всех серверах, где она установлена.
+
+        Возвращает время загрузки, с (самое долгое); ошибка - только если не загрузилась нигде.
+        """
+        with self._lock:
+            targets = [e for e in self.endpoints if e.healthy and e.has_model(model)] or self.endpoints
+        with ThreadPoolExecutor(max_workers=len(targets)) as pool:
+            futures = [pool.submit(self._warm_up_endpoint, endpoint, model, timeout) for endpoint in targets]
+        load_times = []
+        error = None
+        for future in futures:
+            try:
+                load_times.append(future.result())
+            except (requests.exceptions.RequestException, ValueError) as e:
+                error = e
+        if not load_times:
+            raise error
+        load_time = max(load_times)
+        with self._lock:
+            self.warm_models[model] = load_time
+        return load_time
+
+    def warm_up_async(self, model, on_done=None):
+        """Прогрев в фоновом потоке; on_done(модель, время загрузки или текст ошибки)"""
+        on_done = on_done or (lambda model, result: None)
+        with self._lock:
+            thread = self._warming.get(model)
+            if thread is not None and thread.is_alive():
+                return thread
+
+            def run():
+                try:
+                    result = self.warm_up(model)
+                except (requests.exceptions.RequestException, ValueError) as e:
+                    result = f"Ошибка загрузки модели: {str(e)}"
+                on_done(model, result)
+
+            thread = threading.Thread(target=run, daemon=True)
+            self._warming[model] = thread
+        thread.start()
+        return thread
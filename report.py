@@ -0,0 +1,285 @@
+"""Экспорт результатов проверки: отчет, пометки на чертеже, сводка пакетной проверки.
+
+Шрифт FPDF разбирается один раз на процесс, дальше его метрики подставляются в
+новые документы. Пометки («красный карандаш») пишутся аннотациями PyMuPDF в
+копию исходного чертежа и дописываются в конец файла инкрементальным
+сохранением, без перезаписи листов.
+"""
+import html
+import json
+import os
+import shutil
+import string
+import threading
+
+import fitz  # PyMuPDF
+from fpdf import FPDF
+
+import findings
+
+DEFAULT_FONT = "DejaVuSans.ttf"  # Для русского текста: из каталога программы или системный
+FONT_DIRS = [os.path.dirname(os.path.abspath(__file__)),
+             "/usr/share/fonts/truetype/dejavu",
+             "/usr/share/fonts/dejavu",
+             "/usr/local/share/fonts",
+             os.path.join(os.environ.get("WINDIR", "C:\\Windows"), "Fonts")]
+FONT_FAMILY = "dejavu"
+
+ANNOT_TITLE = "Проверка ГОСТ"
+RED = (1, 0, 0)
+ORANGE = (1, 0.5, 0)
+NOTE_STEP = 24  # шаг значков-заметок на поле листа, пункты
+QUOTE_CHARS = 60  # длиннее цитата ищется по началу
+ANNOTATED_SUFFIX = "_checked.pdf"  # имя копии с пометками: <чертеж>_checked.pdf
+
+_font_lock = threading.Lock()
+_fonts = {}  # путь к TTF -> (запись FPDF.fonts, записи FPDF.font_files)
+
+
+def find_font(font_path=DEFAULT_FONT):
+    """Путь к шрифту: как указан или в одном из FONT_DIRS; None - не найден"""
+    if os.path.exists(font_path):
+        return font_path
+    for directory in FONT_DIRS:
+        path = os.path.join(directory, os.path.basename(font_path))
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def new_pdf(font_path=DEFAULT_FONT, size=10):
+    """FPDF с русским шрифтом; TTF разбирается только при первом вызове"""
+    path = find_font(font_path) or font_path
+    pdf = FPDF()
+    with _font_lock:
+        cached = _fonts.get(path)
+        if cached is None:
+            pdf.add_font(FONT_FAMILY, "", path, uni=True)  # нет файла - RuntimeError
+            _fonts[path] = (dict(pdf.fonts[FONT_FAMILY]), dict(pdf.font_files))
+        else:
+            font, font_files = cached
+            # Таблица ширин общая, набор символов (subset) у каждого документа свой
+            pdf.fonts[FONT_FAMILY] = dict(font, i=len(pdf.fonts) + 1, subset=list(range(32)))
+            pdf.font_files.update(font_files)
+    pdf.set_font(FONT_FAMILY, size=size)
+    return pdf
+
+
+def export_pdf(analysis_result, file_path, font_path=DEFAULT_FONT, timings=""):
+    """Сохраняет результаты (findings.Analysis или текст) в PDF"""
+    text = analysis_result.format() if isinstance(analysis_result, findings.Analysis) else analysis_result
+    if timings:
+        text = f"{text}\n\n{timings}"
+    pdf = new_pdf(font_path, size=12)
+    pdf.add_page()
+    pdf.multi_cell(0, 10, text)
+    pdf.output(file_path)
+
+
+def export_json(analysis, file_path, source=None):
+    """Сохраняет замечания в JSON (для сводок и других программ)"""
+    data = {"file": source, "counts": analysis.counts()}
+    data.update(analysis.to_dict())
+    with open(file_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+class _Locator:
+    """Поиск места замечания на листах; текст листа извлекается не больше одного раза"""
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.texts = {}
+
+    def _text(self, page_num):
+        if page_num not in self.texts:
+            self.texts[page_num] = self.doc[page_num].get_text("text")
+        return self.texts[page_num]
+
+    def find(self, finding):
+        """(номер листа, fitz.Rect) или (лист, None); координаты без поворота листа, как у get_text"""
+        sheet = finding.sheet if finding.sheet is not None and finding.sheet < len(self.doc) else None
+        if finding.rect:
+            return sheet or 0, fitz.Rect(finding.rect)
+        quote = finding.quote.strip(" «»\"'")[:QUOTE_CHARS].strip()
+        if not quote:
+            return sheet or 0, None
+        pages = [sheet] if sheet is not None else range(len(self.doc))
+        for page_num in pages:
+            # Быстрая проверка по тексту, search_for только на листе с совпадением
+            if quote not in self._text(page_num):
+                continue
+            hits = self.doc[page_num].search_for(quote)
+            if hits:
+                rect = fitz.Rect(hits[0])
+                for hit in hits[1:]:
+                    if hit.y0 - rect.y1 > 2:  # только строки одного вхождения
+                        break
+                    rect |= hit
+                return page_num, rect
+        return sheet or 0, None
+
+
+def _note_point(page, index):
+    """Точка значка-заметки на левом поле листа (в координатах без поворота)"""
+    y = min(10 + NOTE_STEP * index, page.rect.height - NOTE_STEP)
+    return fitz.Point(10, y) * page.derotation_matrix
+
+
+def annotate_pdf(analysis, source_path, out_path):
+    """Копия чертежа с замечаниями-аннотациями на листах; возвращает число пометок"""
+    shutil.copyfile(source_path, out_path)
+    doc = fitz.open(out_path)
+    try:
+        locator = _Locator(doc)
+        notes = {}  # лист -> число заметок на поле
+        problems = analysis.problems()
+        if len(doc):
+            summary = doc[0].add_text_annot(_note_point(doc[0], 0), analysis.format() or "Замечаний нет",
+                                            icon="Note")
+            summary.set_info(title=ANNOT_TITLE, subject="Итог проверки")
+            summary.update()
+            notes[0] = 1
+        for finding in problems:
+            if not len(doc):
+                break
+            page_num, rect = locator.find(finding)
+            page = doc[page_num]
+            color = RED if finding.status == findings.FAIL and finding.severity != findings.ADVICE else ORANGE
+            if rect is not None and not rect.is_empty:
+                annot = page.add_rect_annot(rect + (-2, -2, 2, 2))
+                annot.set_border(width=1.5)
+            else:
+                index = notes.get(page_num, 0)
+                notes[page_num] = index + 1
+                annot = page.add_text_annot(_note_point(page, index), "", icon="Comment")
+            annot.set_colors(stroke=color)
+            annot.set_info(title=ANNOT_TITLE, subject=finding.gost or finding.item, content=finding.format())
+            annot.update()
+        if doc.can_save_incrementally():
+            # Листы не перезаписываются: аннотации дописываются в конец копии
+            doc.saveIncr()
+            doc.close()
+        else:
+            # Поврежденный или зашифрованный файл: полное сохранение рядом и замена копии
+            temp_path = out_path + ".tmp"
+            doc.save(temp_path, garbage=1, deflate=True)
+            doc.close()
+            os.replace(temp_path, out_path)
+    finally:
+        if not doc.is_closed:
+            doc.close()
+    return len(problems)
+
+
+def _record_analysis(record):
+    result = record.get("result")
+    return findings.Analysis.from_dict(result) if isinstance(result, dict) else None
+
+
+HTML_HEAD = """<!DOCTYPE html>
+<html lang="ru"><head><meta charset="utf-8"><title>Сводка проверки чертежей</title>
+<style>
+body { font-family: sans-serif; margin: 20px; }
+table { border-collapse: collapse; width: 100%; }
+td, th { border: 1px solid #ccc; padding: 4px 8px; vertical-align: top; text-align: left; }
+.НЕТ, .error { color: #b00; } .ДА { color: #070; }
+ul { margin: 0; padding-left: 18px; }
+</style></head><body>
+<h1>Сводка проверки чертежей</h1>
+<table><tr><th>Файл</th><th>Вывод</th><th>Критических</th><th>Рекомендаций</th><th>Замечания</th></tr>
+"""
+HTML_ROW = string.Template(
+    '<tr><td>$file</td><td class="$css">$verdict</td><td>$critical</td><td>$advice</td><td>$details</td></tr>\n')
+HTML_ITEM = string.Template("<li>$text</li>")
+HTML_FOOT = string.Template("</table>\n<p>$totals</p>\n</body></html>\n")
+
+
+class BatchSummary:
+    """Сводка пакетной проверки в JSON, HTML или PDF (по расширению файла).
+
+    Записи BatchChecker добавляются по мере готовности: JSON и HTML пишутся в
+    файл сразу, PDF собирается в одном документе и сохраняется в close().
+    """
+
+    def __init__(self, path, font_path=DEFAULT_FONT):
+        self.path = path
+        ext = os.path.splitext(path)[1].lower()
+        self.kind = {".html": "html", ".htm": "html", ".pdf": "pdf"}.get(ext, "json")
+        self.totals = {"files": 0, "errors": 0, "ДА": 0, "НЕТ": 0,
+                       findings.CRITICAL: 0, findings.ADVICE: 0}
+        self.pdf = None
+        self.out = None
+        if self.kind == "pdf":
+            self.pdf = new_pdf(font_path)
+            self.pdf.add_page()
+            self.pdf.set_font_size(14)
+            self.pdf.multi_cell(0, 8, "Сводка проверки чертежей")
+            self.pdf.set_font_size(10)
+        else:
+            self.out = open(path, "w", encoding="utf-8")
+            self.out.write(HTML_HEAD if self.kind == "html" else '{"files": [\n')
+
+    def _count(self, record, analysis):
+        self.totals["files"] += 1
+        if analysis is None:
+            self.totals["errors"] += 1
+            return
+        if analysis.verdict in self.totals:
+            self.totals[analysis.verdict] += 1
+        for severity, count in (record.get("counts") or analysis.counts()).items():
+            if severity in self.totals:
+                self.totals[severity] += count
+
+    def add(self, record):
+        analysis = _record_analysis(record)
+        self._count(record, analysis)
+        counts = (record.get("counts") or analysis.counts()) if analysis is not None else {}
+        if analysis is None:
+            verdict, lines = "ошибка", [str(record.get("result", ""))]
+        else:
+            verdict = analysis.verdict or "НЕ ОПРЕДЕЛЕНО"
+            lines = [finding.format() for finding in analysis.problems()] or [analysis.note or "Замечаний нет"]
+        if self.kind == "json":
+            prefix = "" if self.totals["files"] == 1 else ",\n"
+            self.out.write(prefix + json.dumps(record, ensure_ascii=False))
+        elif self.kind == "html":
+            items = "".join(HTML_ITEM.substitute(text=html.escape(line)) for line in lines)
+            self.out.write(HTML_ROW.substitute(
+                file=html.escape(record.get("file", "")), css="error" if analysis is None else verdict,
+                verdict=verdict, critical=counts.get(findings.CRITICAL, 0),
+                advice=counts.get(findings.ADVICE, 0), details=f"<ul>{items}</ul>"))
+        else:
+            self.pdf.ln(4)
+            self.pdf.multi_cell(0, 6, f"{record.get('file', '')}: {verdict} (критических "
+                                      f"{counts.get(findings.CRITICAL, 0)}, рекомендаций "
+                                      f"{counts.get(findings.ADVICE, 0)})")
+            self.pdf.multi_cell(0, 5, "\n".join(lines))
+        if self.out is not None:
+            self.out.flush()
+
+    def totals_text(self):
+        totals = self.totals
+        return (f"Файлов: {totals['files']}, соответствуют: {totals['ДА']}, не соответствуют: {totals['НЕТ']}, "
+                f"ошибок: {totals['errors']}; замечаний критических: {totals[findings.CRITICAL]}, "
+                f"рекомендаций: {totals[findings.ADVICE]}")
+
+    def close(self):
+        if self.kind == "json":
+            self.out.write('\n],\n"totals": ' + json.dumps(self.totals, ensure_ascii=False) + "}\n")
+        elif self.kind == "html":
+            self.out.write(HTML_FOOT.substitute(totals=html.escape(self.totals_text())))
+        else:
+            self.pdf.ln(6)
+            self.pdf.multi_cell(0, 6, self.totals_text())
+            self.pdf.output(self.path)
+            self.pdf = None
+        if self.out is not None:
+            self.out.close()
+            self.out = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,134 @@
+"""Кэш результатов анализа Ollama на диске с вытеснением по размеру (LRU)."""
+import hashlib
+import json
+import os
+import threading
+import time
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "drawing_checker")
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """Хэш содержимого PDF (не зависит от имени и пути файла)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_key(pdf_hash, model, mode, template_version, options, pages=None, images=None):
+    """Ключ кэша: все, от чего зависит ответ модели"""
+    material = json.dumps([pdf_hash, model, mode, template_version, options, pages, images],
+                          sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Хранит ответы модели в файлах <ключ>.json, при переполнении удаляет самые старые"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, enabled=True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._index = None  # ключ -> [размер, время последнего доступа]
+        self._total = 0
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load_index(self):
+        if self._index is not None:
+            return
+        self._index = {}
+        self._total = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            self._index[name[:-5]] = [st.st_size, st.st_mtime]
+            self._total += st.st_size
+
+    def get(self, key):
+        """Возвращает сохраненный ответ или None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._load_index()
+            if key not in self._index:
+                self.misses += 1
+                return None
+            path = self._path(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+                now = time.time()
+                os.utime(path, (now, now))  # mtime служит отметкой последнего использования
+                self._index[key][1] = now
+            except (OSError, ValueError):
+                self._forget(key)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry.get("response")
+
+    def put(self, key, response, meta=None):
+        if not self.enabled:
+            return
+        data = json.dumps({"response": response, "meta": meta or {}, "created": time.time()},
+                          ensure_ascii=False).encode("utf-8")
+        with self._lock:
+            self._load_index()
+            path = self._path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError:
+                return
+            if key in self._index:
+                self._total -= self._index[key][0]
+            self._index[key] = [len(data), time.time()]
+            self._total += len(data)
+            self._evict()
+
+    def _forget(self, key):
+        entry = self._index.pop(key, None)
+        if entry:
+            self._total -= entry[0]
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self):
+        if self._total <= self.max_bytes:
+            return
+        for key, _ in sorted(self._index.items(), key=lambda item: item[1][1]):
+            if self._total <= self.max_bytes:
+                break
+            self._forget(key)
+
+    def clear(self):
+        """Удаляет все записи и сбрасывает счетчики"""
+        with self._lock:
+            self._load_index()
+            for key in list(self._index):
+                self._forget(key)
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            self._load_index()
+            return {"hits": self.hits, "misses": self.misses,
+                    "entries": len(self._index), "bytes": self._total}
@@ -0,0 +1,70 @@
+"""Результаты прошлых проверок по обозначению документа - для повторной проверки изменений.
+
+Для каждого обозначения (АБВГ.123456.001 СБ) и режима хранятся отпечатки
+листов (DocumentSession.page_fingerprint) и результаты: ответы модели и
+пункты правил по листам. При проверке новой редакции модель получает только
+листы, отпечаток которых изменился, остальные берутся из записи.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from result_cache import DEFAULT_CACHE_DIR
+
+DEFAULT_DIR = os.path.join(DEFAULT_CACHE_DIR, "revisions")
+
+
+class RevisionStore:
+    """Записи <хэш обозначения и режима>.json; запись другой модели или версии промптов не используется"""
+
+    def __init__(self, store_dir=DEFAULT_DIR, enabled=True):
+        self.store_dir = store_dir
+        self.enabled = enabled
+        self._lock = threading.Lock()
+
+    def _path(self, designation, mode, per_page):
+        material = json.dumps([designation, mode, per_page], ensure_ascii=False)
+        return os.path.join(self.store_dir, f"{hashlib.sha256(material.encode('utf-8')).hexdigest()}.json")
+
+    def load(self, designation, mode, per_page, models, version):
+        """Прошлая запись или None (нет записи, другая модель или версия)"""
+        if not self.enabled or not designation:
+            return None
+        try:
+            with self._lock, open(self._path(designation, mode, per_page), "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if record.get("models") != list(models) or record.get("version") != version:
+            return None
+        return record
+
+    def save(self, designation, mode, per_page, models, version, record):
+        if not self.enabled or not designation:
+            return
+        record = dict(record, designation=designation, mode=mode, per_page=per_page,
+                      models=list(models), version=version, updated=time.time())
+        data = json.dumps(record, ensure_ascii=False).encode("utf-8")
+        path = self._path(designation, mode, per_page)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with self._lock:
+            try:
+                os.makedirs(self.store_dir, exist_ok=True)
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            if not os.path.isdir(self.store_dir):
+                return
+            for name in os.listdir(self.store_dir):
+                if name.endswith(".json"):
+                    try:
+                        os.remove(os.path.join(self.store_dir, name))
+                    except OSError:
+                        pass
@@ -0,0 +1,36 @@
+"""Результат детерминированного правила: общий для title_block и geometry.
+
+Статусы и RuleResult вынесены отдельно, чтобы title_block мог импортировать
+geometry, а geometry - результаты правил без циклического импорта.
+"""
+
+OK = "ok"
+FAIL = "fail"
+UNDECIDED = "undecided"
+
+
+class RuleResult:
+    """Результат одного правила"""
+
+    def __init__(self, item, status, detail, page_num=None, rect=None, gost=None):
+        self.item = item
+        self.status = status
+        self.detail = detail
+        self.page_num = page_num
+        self.rect = tuple(rect) if rect is not None else None  # координаты в пунктах
+        self.gost = gost
+
+    def to_dict(self):
+        return {"item": self.item, "status": self.status, "detail": self.detail,
+                "page_num": self.page_num, "rect": self.rect, "gost": self.gost}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["item"], data["status"], data["detail"], data.get("page_num"),
+                   data.get("rect"), data.get("gost"))
+
+    def format(self):
+        mark = {OK: "✓", FAIL: "✗"}.get(self.status, "?")
+        where = f" [лист {self.page_num + 1}]" if self.page_num is not None else ""
+        gost = f" ({self.gost})" if self.gost and self.status == FAIL else ""
+        return f"{mark} {self.item}: {self.detail}{where}{gost}"
@@ -0,0 +1,215 @@
+"""Очередь проверок: несколько чертежей, приоритеты, отмена по заданию.
+
+Быстрые проверки идут раньше полных, внутри приоритета - по порядку
+постановки. Одновременно выполняется не больше max_concurrent заданий
+(по числу параллельных запросов, которые тянет сервер Ollama). О ходе
+проверки задания сообщают событиями в потокобезопасную очередь events:
+кортежи (вид, задание, данные), интерфейс разбирает их в своем потоке.
+"""
+import heapq
+import itertools
+import os
+import queue
+import threading
+import time
+
+# Меньше - раньше: быстрая проверка не ждет полную, каскадная - между ними
+PRIORITY = {"fast": 0, "cascade": 1, "full": 2}
+MODE_NAMES = {"fast": "быстрая", "cascade": "каскадная", "full": "полная"}
+
+QUEUED = "в очереди"
+RUNNING = "проверяется"
+DONE = "готово"
+CANCELLED = "отменено"
+FAILED = "ошибка"
+
+# Виды событий
+EVENT_QUEUED = "queued"
+EVENT_STARTED = "started"
+EVENT_PROGRESS = "progress"
+EVENT_TOKEN = "token"
+EVENT_DONE = "done"
+EVENT_CANCELLED = "cancelled"
+EVENT_ERROR = "error"
+
+
+def default_concurrency(servers=1):
+    """По умолчанию столько проверок, сколько запросов серверы Ollama обрабатывают параллельно"""
+    try:
+        return max(1, int(os.environ.get("OLLAMA_NUM_PARALLEL", "1"))) * servers
+    except ValueError:
+        return servers
+
+
+class CancelToken:
+    """Отмена одного задания: флаг и обработчики (например, OllamaAnalyzer.cancel)"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def on_cancel(self, callback):
+        """Вызывает callback при отмене (сразу, если задание уже отменено)"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass  # отмена не должна падать из-за закрытого соединения
+
+
+class Job:
+    """Задание проверки одного чертежа"""
+
+    def __init__(self, job_id, pdf_path, mode, options):
+        self.id = job_id
+        self.pdf_path = pdf_path
+        self.mode = mode
+        self.options = options  # настройки на момент постановки (модели, постранично и т.п.)
+        self.priority = PRIORITY.get(mode, len(PRIORITY))
+        self.token = CancelToken()
+        self.status = QUEUED
+        self.result = None
+        self.timings = ""  # сводка времени этапов (spans) после проверки
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def name(self):
+        return os.path.basename(self.pdf_path)
+
+    def describe(self):
+        mode = MODE_NAMES.get(self.mode, self.mode)
+        return f"#{self.id} [{self.status}] {mode}: {self.name}"
+
+
+class JobScheduler:
+    """Очередь с приоритетами и ограничением числа одновременных проверок.
+
+    run_job(job, emit) выполняет проверку в отдельном потоке и возвращает
+    результат; emit(вид, данные) отправляет событие прогресса. Отмененное
+    задание должно как можно скорее вернуться (job.token.cancelled).
+    """
+
+    def __init__(self, run_job, max_concurrent=None, events=None):
+        self.run_job = run_job
+        self.max_concurrent = max_concurrent or default_concurrency()
+        self.events = events if events is not None else queue.Queue()
+        self._lock = threading.Lock()
+        self._heap = []
+        self._seq = itertools.count()
+        self._ids = itertools.count(1)
+        self._jobs = {}
+        self._running = 0
+
+    def _emit(self, kind, job, data=None):
+        self.events.put((kind, job, data))
+
+    def submit(self, pdf_path, mode="fast", **options):
+        with self._lock:
+            job = Job(next(self._ids), pdf_path, mode, options)
+            self._jobs[job.id] = job
+            heapq.heappush(self._heap, (job.priority, next(self._seq), job))
+        self._emit(EVENT_QUEUED, job)
+        self._dispatch()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def forget(self, job_id):
+        """Удаляет завершенное задание (сервис освобождает память); выполняемые не трогает"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in (QUEUED, RUNNING):
+                return False
+            del self._jobs[job_id]
+            return True
+
+    def pending(self):
+        """(в очереди, выполняется)"""
+        with self._lock:
+            queued = sum(1 for job in self._jobs.values() if job.status == QUEUED)
+            return queued, self._running
+
+    def cancel(self, job_id):
+        """Отменяет задание: из очереди снимается сразу, выполняемое прерывается"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status not in (QUEUED, RUNNING):
+                return False
+            was_queued = job.status == QUEUED
+            if was_queued:
+                job.status = CANCELLED
+                job.finished = time.time()
+        job.token.cancel()
+        if was_queued:
+            self._emit(EVENT_CANCELLED, job)
+        return True
+
+    def cancel_all(self):
+        for job in self.jobs():
+            self.cancel(job.id)
+
+    def set_limit(self, max_concurrent):
+        with self._lock:
+            self.max_concurrent = max(1, max_concurrent)
+        self._dispatch()
+
+    def _dispatch(self):
+        started = []
+        with self._lock:
+            while self._heap and self._running < self.max_concurrent:
+                _, _, job = heapq.heappop(self._heap)
+                if job.status != QUEUED:
+                    continue  # отменено, пока стояло в очереди
+                job.status = RUNNING
+                job.started = time.time()
+                self._running += 1
+                started.append(job)
+        for job in started:
+            threading.Thread(target=self._run, args=(job,), daemon=True).start()
+
+    def _run(self, job):
+        self._emit(EVENT_STARTED, job)
+        try:
+            result = self.run_job(job, lambda kind, data=None: self._emit(kind, job, data))
+        except Exception as e:
+            job.error = str(e)
+            job.status = CANCELLED if job.token.cancelled else FAILED
+        else:
+            job.result = result
+            job.status = CANCELLED if job.token.cancelled else DONE
+        job.finished = time.time()
+        with self._lock:
+            self._running -= 1
+        if job.status == DONE:
+            self._emit(EVENT_DONE, job, job.result)
+        elif job.status == CANCELLED:
+            self._emit(EVENT_CANCELLED, job)
+        else:
+            self._emit(EVENT_ERROR, job, job.error)
+        self._dispatch()
@@ -0,0 +1,476 @@
+"""Сервис проверки чертежей по HTTP: один прогретый бэкенд Ollama на весь отдел.
+
+Рабочие места отправляют PDF, получают номер задания и следят за ним
+опросом или потоком событий. Задания всех клиентов идут в одну очередь
+(scheduler) и общий пул соединений с Ollama, поэтому модель загружена один
+раз, а сервер получает не больше запросов, чем обрабатывает параллельно.
+
+    python service.py --host 0.0.0.0 --port 8765 --url http://gpu-server:11434
+
+API:
+    POST   /api/jobs?mode=fast|full|cascade&per_page=1&incremental=1&name=файл.pdf  (тело - PDF) -> {"id", "status"}
+    GET    /api/jobs/<id>          состояние, результат и время этапов
+    GET    /api/jobs/<id>/events   события проверки потоком NDJSON, с начала
+    DELETE /api/jobs/<id>          отмена
+    GET    /api/health             доступность Ollama, модели и очередь
+"""
+import argparse
+import bisect
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlparse
+
+import requests
+
+import engine
+import findings
+import gost_index
+import image_pipeline
+import ollama_client
+import result_cache
+import revisions
+import scheduler
+import spans
+
+DEFAULT_PORT = 8765
+MAX_UPLOAD_BYTES = 100 * 1024 * 1024
+EVENT_WAIT = 15  # секунд ожидания нового события перед пустой строкой (проверка, жив ли клиент)
+
+JOB_TTL = 3600  # секунд хранения завершенного задания и его событий
+MAX_FINISHED_JOBS = 500  # больше завершенных заданий не хранится, старые удаляются раньше JOB_TTL
+EXPIRE_INTERVAL = 60  # секунд между проверками срока хранения заданий
+
+FINAL_EVENTS = {scheduler.EVENT_DONE, scheduler.EVENT_CANCELLED, scheduler.EVENT_ERROR}
+
+
+class _EventLog:
+    """События задания с порядковыми номерами.
+
+    После завершения токены ответа выбрасываются (результат есть в событии done),
+    номера остальных событий не меняются, поэтому подключенные клиенты не сбиваются.
+    """
+
+    __slots__ = ("seqs", "events", "next", "finished")
+
+    def __init__(self):
+        self.seqs = []
+        self.events = []
+        self.next = 0
+        self.finished = None  # время завершения
+
+    def append(self, event):
+        self.seqs.append(self.next)
+        self.events.append(event)
+        self.next += 1
+        if event["event"] in FINAL_EVENTS:
+            self.finished = time.time()
+            kept = [i for i, stored in enumerate(self.events) if stored["event"] != scheduler.EVENT_TOKEN]
+            self.seqs = [self.seqs[i] for i in kept]
+            self.events = [self.events[i] for i in kept]
+
+    def since(self, index):
+        """События с номерами от index"""
+        return self.events[bisect.bisect_left(self.seqs, index):]
+
+
+class CheckService:
+    """Очередь проверок поверх одного OllamaClient"""
+
+    def __init__(self, client, text_model="llama2:3b", vision_model="llava:7b", cache=None,
+                 image_config=None, max_concurrent=None, num_parallel=1, upload_dir=None,
+                 spans_path=None, revision_store=None, gost_index=None, top_k=gost_index.DEFAULT_TOP_K,
+                 cascade_model=None, job_ttl=JOB_TTL, max_finished_jobs=MAX_FINISHED_JOBS):
+        self.client = client
+        self.text_model = text_model
+        self.vision_model = vision_model
+        self.cascade_model = cascade_model or text_model  # первая ступень каскадной проверки
+        self.cache = cache
+        self.revision_store = revision_store  # прошлые проверки по обозначениям документов
+        self.gost_index = gost_index  # пункты ГОСТ для промптов
+        self.top_k = top_k
+        self.image_config = image_config
+        self.num_parallel = num_parallel
+        self.spans_path = spans_path
+        self.upload_dir = upload_dir or tempfile.mkdtemp(prefix="drawing_checker_")
+        self.scheduler = scheduler.JobScheduler(self._run_job, max_concurrent)
+        self._events = {}  # id задания -> _EventLog
+        self.job_ttl = job_ttl
+        self.max_finished_jobs = max_finished_jobs
+        self._cond = threading.Condition()
+        threading.Thread(target=self._pump_events, daemon=True).start()
+        threading.Thread(target=self._expire_loop, daemon=True).start()
+
+    def submit(self, data, name, mode="fast", per_page=False, incremental=False):
+        path = os.path.join(self.upload_dir, f"{uuid.uuid4().hex}.pdf")
+        with open(path, "wb") as f:
+            f.write(data)
+        return self.scheduler.submit(path, mode, name=name, per_page=per_page,
+                                     incremental=incremental)
+
+    def _run_job(self, job, emit):
+        tracer = spans.Tracer(file=job.options["name"], mode=job.mode, job=job.id)
+        text_model = self.cascade_model if job.mode == engine.CASCADE else self.text_model
+        analyzer = engine.OllamaAnalyzer(
+            self.client.ollama_url, text_model, self.vision_model,
+            should_stop=lambda: job.token.cancelled,
+            progress=lambda message: emit(scheduler.EVENT_PROGRESS, message),
+            cache=self.cache, stream=True, client=self.client, tracer=tracer,
+            on_token=lambda token: emit(scheduler.EVENT_TOKEN, token),
+            gost_index=self.gost_index, top_k=self.top_k)
+        job.token.on_cancel(analyzer.cancel)
+        result = engine.check_file(job.pdf_path, job.mode, analyzer,
+                                   progress=lambda message: emit(scheduler.EVENT_PROGRESS, message),
+                                   image_config=self.image_config,
+                                   per_page=job.options["per_page"],
+                                   num_parallel=self.num_parallel,
+                                   should_stop=lambda: job.token.cancelled,
+                                   revisions=self.revision_store if job.options["incremental"] else None)
+        job.timings = tracer.format()
+        if self.spans_path:
+            tracer.flush(self.spans_path)
+        return result
+
+    def _pump_events(self):
+        """Переносит события планировщика в журналы заданий и будит ожидающих"""
+        while True:
+            kind, job, data = self.scheduler.events.get()
+            event = {"event": kind, "status": job.status}
+            if isinstance(data, findings.Analysis):
+                data = data.to_dict()
+            if data is not None:
+                event["data"] = data
+            if kind == scheduler.EVENT_DONE:
+                event["timings"] = job.timings
+            with self._cond:
+                self._events.setdefault(job.id, _EventLog()).append(event)
+                self._cond.notify_all()
+            if kind in FINAL_EVENTS:
+                try:
+                    os.remove(job.pdf_path)
+                except OSError:
+                    pass
+                self._expire()
+
+    def _expire_loop(self):
+        """Срок хранения проверяется и без новых заданий: после всплеска сервис может простаивать"""
+        while True:
+            time.sleep(max(1, min(EXPIRE_INTERVAL, self.job_ttl)))
+            self._expire()
+
+    def _expire(self):
+        """Удаляет завершенные задания старше job_ttl и сверх max_finished_jobs"""
+        now = time.time()
+        with self._cond:
+            finished = sorted((log.finished, job_id) for job_id, log in self._events.items()
+                              if log.finished is not None)
+            excess = len(finished) - self.max_finished_jobs
+            expired = [job_id for i, (finished_at, job_id) in enumerate(finished)
+                       if i < excess or now - finished_at > self.job_ttl]
+            for job_id in expired:
+                del self._events[job_id]
+            self._cond.notify_all()
+        for job_id in expired:
+            self.scheduler.forget(job_id)
+
+    def events_since(self, job_id, index, timeout=EVENT_WAIT):
+        """События задания с номера index (ждет новых до timeout).
+
+        Возвращает (события, номер следующего события, завершено). Удаленное по
+        сроку задание считается завершенным.
+        """
+        with self._cond:
+            def ready():
+                log = self._events.get(job_id)
+                return log.next > index if log is not None else self.scheduler.get(job_id) is None
+            self._cond.wait_for(ready, timeout)
+            log = self._events.get(job_id)
+            if log is None:
+                return [], index, self.scheduler.get(job_id) is None
+            events = log.since(index)
+            return events, log.next, log.finished is not None
+
+    def position(self, job):
+        """Место в очереди (0 - выполняется или завершено)"""
+        if job.status != scheduler.QUEUED:
+            return 0
+        ahead = [other for other in self.scheduler.jobs() if other.status == scheduler.QUEUED
+                 and (other.priority, other.id) < (job.priority, job.id)]
+        return len(ahead) + 1
+
+    def job_info(self, job):
+        return {"id": job.id, "name": job.options["name"], "mode": job.mode,
+                "status": job.status, "position": self.position(job),
+                "result": job.result.to_dict() if job.result is not None else None,
+                "timings": job.timings, "error": job.error,
+                "submitted": job.submitted, "started": job.started, "finished": job.finished}
+
+    def health(self):
+        queued, running = self.scheduler.pending()
+        return {"ollama": self.client.is_available(), "ollama_url": self.client.ollama_url,
+                "endpoints": self.client.endpoint_status(),
+                "text_model": self.text_model, "vision_model": self.vision_model,
+                "cascade_model": self.cascade_model, "queued": queued, "running": running,
+                "max_concurrent": self.scheduler.max_concurrent}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _job(self, parts):
+        try:
+            return self.server.service.scheduler.get(int(parts[2]))
+        except (IndexError, ValueError):
+            return None
+
+    def do_GET(self):
+        service = self.server.service
+        parts = urlparse(self.path).path.strip("/").split("/")
+        if parts == ["api", "health"]:
+            self._send_json(service.health())
+            return
+        job = self._job(parts) if parts[:2] == ["api", "jobs"] else None
+        if job is None:
+            self._send_json({"error": "задание не найдено"}, 404)
+        elif len(parts) == 3:
+            self._send_json(service.job_info(job))
+        elif len(parts) == 4 and parts[3] == "events":
+            self._stream_events(job)
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        service = self.server.service
+        url = urlparse(self.path)
+        if url.path.rstrip("/") != "/api/jobs":
+            self._send_json({"error": "not found"}, 404)
+            return
+        query = parse_qs(url.query)
+        mode = query.get("mode", ["fast"])[0]
+        if mode not in scheduler.PRIORITY:
+            self._send_json({"error": f"неизвестный режим: {mode}"}, 400)
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        if length <= 0:
+            self._send_json({"error": "нет PDF в теле запроса"}, 400)
+            return
+        if length > MAX_UPLOAD_BYTES:
+            self._send_json({"error": "файл слишком большой"}, 413)
+            self.close_connection = True
+            return
+        data = self.rfile.read(length)
+        if not data.startswith(b"%PDF"):
+            self._send_json({"error": "это не PDF"}, 400)
+            return
+        per_page = query.get("per_page", ["0"])[0] in ("1", "true", "yes")
+        incremental = query.get("incremental", ["0"])[0] in ("1", "true", "yes")
+        name = query.get("name", ["drawing.pdf"])[0]
+        job = service.submit(data, name, mode, per_page, incremental)
+        self._send_json({"id": job.id, "status": job.status, "position": service.position(job)}, 201)
+
+    def do_DELETE(self):
+        parts = urlparse(self.path).path.strip("/").split("/")
+        job = self._job(parts) if parts[:2] == ["api", "jobs"] and len(parts) == 3 else None
+        if job is None:
+            self._send_json({"error": "задание не найдено"}, 404)
+            return
+        cancelled = self.server.service.scheduler.cancel(job.id)
+        self._send_json({"id": job.id, "cancelled": cancelled, "status": job.status})
+
+    def _stream_events(self, job):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        index = 0
+        try:
+            while True:
+                events, index, finished = self.server.service.events_since(job.id, index)
+                if not events:
+                    self._write_chunk(b"\n")  # пустая строка: соединение живо, клиент еще слушает
+                for event in events:
+                    self._write_chunk(json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n")
+                if finished:
+                    break
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class CheckServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, service, host="127.0.0.1", port=DEFAULT_PORT):
+        super().__init__((host, port), _Handler)
+        self.service = service
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class ServiceClient:
+    """Тонкий клиент сервиса: задания интерфейса выполняются на общем сервере"""
+
+    def __init__(self, service_url, timeout=10):
+        self.service_url = service_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def url(self, path):
+        return f"{self.service_url}{path}"
+
+    def health(self):
+        response = self.session.get(self.url("/api/health"), timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def is_available(self):
+        try:
+            return bool(self.health().get("ollama"))
+        except (requests.exceptions.RequestException, ValueError):
+            return False
+
+    def submit(self, pdf_path, mode="fast", per_page=False, incremental=False):
+        with open(pdf_path, "rb") as f:
+            data = f.read()
+        name = quote(os.path.basename(pdf_path))
+        response = self.session.post(
+            self.url(f"/api/jobs?mode={mode}&per_page={int(per_page)}"
+                     f"&incremental={int(incremental)}&name={name}"),
+            data=data, headers={"Content-Type": "application/pdf"}, timeout=(self.timeout, 120))
+        if response.status_code != 201:
+            raise RuntimeError(f"Сервер проверки: {response.json().get('error', response.status_code)}")
+        return response.json()["id"]
+
+    def status(self, job_id):
+        return self.session.get(self.url(f"/api/jobs/{job_id}"), timeout=self.timeout).json()
+
+    def cancel(self, job_id):
+        try:
+            self.session.delete(self.url(f"/api/jobs/{job_id}"), timeout=self.timeout)
+        except requests.exceptions.RequestException:
+            pass
+
+    def events(self, job_id):
+        """События задания до завершения (генератор словарей)"""
+        with self.session.get(self.url(f"/api/jobs/{job_id}/events"), stream=True,
+                              timeout=(self.timeout, EVENT_WAIT * 4)) as response:
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def run(self, job, emit):
+        """run_job для локального планировщика: задание уходит на сервер, события - в интерфейс"""
+        remote_id = self.submit(job.pdf_path, job.mode, job.options.get("per_page", False),
+                                job.options.get("incremental", False))
+        job.token.on_cancel(lambda: self.cancel(remote_id))
+        emit(scheduler.EVENT_PROGRESS, f"Задание #{remote_id} на сервере {self.service_url}")
+        stream = job.options.get("stream", True)
+        for event in self.events(remote_id):
+            kind = event["event"]
+            if kind == scheduler.EVENT_PROGRESS:
+                emit(kind, event["data"])
+            elif kind == scheduler.EVENT_TOKEN and stream:
+                emit(kind, event["data"])
+            elif kind == scheduler.EVENT_DONE:
+                job.timings = event.get("timings", "")
+                data = event.get("data")
+                return findings.Analysis.from_dict(data) if data is not None else None
+            elif kind == scheduler.EVENT_CANCELLED:
+                return None
+            elif kind == scheduler.EVENT_ERROR:
+                raise RuntimeError(event.get("data") or "ошибка на сервере проверки")
+        raise RuntimeError("Сервер проверки закрыл соединение до окончания проверки")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сервис проверки чертежей по HTTP")
+    parser.add_argument("--host", default="127.0.0.1", help="Адрес (0.0.0.0 - доступ из сети)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--url", default=engine.OLLAMA_URL,
+                        help="Адрес сервера Ollama; несколько серверов - через запятую")
+    parser.add_argument("--model", default="llama2:3b", help="Текстовая модель")
+    parser.add_argument("--vision-model", default="llava:7b", help="Vision модель")
+    parser.add_argument("--fast-models", default=None,
+                        help="Каскад: текстовые модели через запятую, первой ступенью идет самая легкая")
+    parser.add_argument("--keep-alive", default="-1",
+                        help="Сколько держать модель в памяти Ollama (по умолчанию всегда)")
+    parser.add_argument("--max-concurrent", type=int, default=None,
+                        help="Проверок одновременно (по умолчанию OLLAMA_NUM_PARALLEL или 1 на сервер Ollama)")
+    parser.add_argument("--num-parallel", type=int,
+                        default=int(os.environ.get("OLLAMA_NUM_PARALLEL", "1")),
+                        help="Листов одного файла одновременно при постраничной проверке")
+    parser.add_argument("--image-budget-kb", type=int, default=400,
+                        help="Бюджет изображений на лист, КБ (base64)")
+    parser.add_argument("--cache-dir", default=result_cache.DEFAULT_CACHE_DIR,
+                        help="Каталог кэша результатов")
+    parser.add_argument("--no-cache", action="store_true", help="Не использовать кэш результатов")
+    parser.add_argument("--spans", default=None, help="Файл спанов этапов (JSONL)")
+    parser.add_argument("--revisions-dir", default=revisions.DEFAULT_DIR,
+                        help="Каталог прошлых проверок для повторной проверки только измененных листов")
+    parser.add_argument("--docs", default=gost_index.DEFAULT_DOCS_DIR,
+                        help="Каталог PDF стандартов ГОСТ для выдержек в промпте")
+    parser.add_argument("--embed-model", default=None,
+                        help="Модель эмбеддингов Ollama для поиска пунктов ГОСТ (без нее - BM25)")
+    parser.add_argument("--top-k", type=int, default=gost_index.DEFAULT_TOP_K,
+                        help="Сколько пунктов ГОСТ добавлять в промпт")
+    parser.add_argument("--job-ttl", type=int, default=JOB_TTL,
+                        help="Сколько секунд хранить завершенное задание и его события")
+    parser.add_argument("--max-jobs", type=int, default=MAX_FINISHED_JOBS,
+                        help="Сколько завершенных заданий хранить не дольше --job-ttl")
+    args = parser.parse_args(argv)
+
+    client = ollama_client.OllamaClient(args.url, keep_alive=args.keep_alive)
+    client.warm_up_async(args.model)
+    client.warm_up_async(args.vision_model)
+    cascade_model = client.cheapest_model(args.fast_models.split(",")) if args.fast_models else None
+    if cascade_model and cascade_model != args.model:
+        client.warm_up_async(cascade_model)
+    cache = result_cache.ResultCache(args.cache_dir, enabled=not args.no_cache)
+    image_config = image_pipeline.ImagePipelineConfig(max_bytes_per_page=args.image_budget_kb * 1024)
+    service = CheckService(client, args.model, args.vision_model, cache=cache,
+                           image_config=image_config,
+                           max_concurrent=args.max_concurrent or scheduler.default_concurrency(len(client.endpoints)),
+                           num_parallel=args.num_parallel, spans_path=args.spans,
+                           revision_store=revisions.RevisionStore(args.revisions_dir, enabled=not args.no_cache),
+                           gost_index=gost_index.GostIndex.load_or_build(
+                               args.docs, embed_model=args.embed_model, client=client,
+                               progress=lambda message: print(message, file=sys.stderr)),
+                           top_k=args.top_k, cascade_model=cascade_model,
+                           job_ttl=args.job_ttl, max_finished_jobs=args.max_jobs)
+    server = CheckServer(service, args.host, args.port)
+    print(f"Сервис проверки: {server.url} (Ollama {args.url}, "
+          f"проверок одновременно: {service.scheduler.max_concurrent})", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
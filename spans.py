@@ -0,0 +1,184 @@
+"""Замеры этапов проверки (спаны) и метрики инференса Ollama.
+
+Tracer собирает спаны одной проверки: открытие PDF, извлечение текста,
+правила, растеризацию, кодирование изображений, HTTP-запросы, а из ответа
+Ollama - загрузку модели, обработку промпта и генерацию. Итоги выводятся в
+интерфейсе и отчете, сами спаны дописываются в JSONL.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+PDF_OPEN = "pdf_open"
+TEXT = "text_extract"
+RULES = "rules"
+RETRIEVAL = "gost_search"
+RASTER = "rasterize"
+ENCODE = "base64"
+HTTP = "http"
+MODEL_LOAD = "model_load"
+PROMPT_EVAL = "prompt_eval"
+GENERATION = "generation"
+EXPORT = "export"
+
+STAGES = [
+    (PDF_OPEN, "Открытие PDF"),
+    (TEXT, "Извлечение текста"),
+    (RULES, "Правила"),
+    (RETRIEVAL, "Поиск пунктов ГОСТ"),
+    (RASTER, "Растеризация"),
+    (ENCODE, "Кодирование PNG/base64"),
+    (HTTP, "Запросы к Ollama"),
+    (MODEL_LOAD, "загрузка модели"),
+    (PROMPT_EVAL, "обработка промпта"),
+    (GENERATION, "генерация"),
+    (EXPORT, "Экспорт отчета"),
+]
+
+# Этапы на стороне сервера, входят в время HTTP-запросов
+SERVER_STAGES = {MODEL_LOAD, PROMPT_EVAL, GENERATION}
+
+DEFAULT_LOG = os.path.join(os.path.expanduser("~"), ".cache", "drawing_checker", "spans.jsonl")
+
+NS = 1e9  # Ollama отдает длительности в наносекундах
+
+
+class Tracer:
+    """Спаны одной проверки; потокобезопасен (листы проверяются параллельно)"""
+
+    def __init__(self, **meta):
+        self.trace_id = uuid.uuid4().hex[:12]
+        self.meta = meta  # например file, mode - дописываются в каждую строку JSONL
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self.spans = []
+        self._flushed = 0
+
+    def elapsed(self):
+        return time.perf_counter() - self._t0
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """with tracer.span(name) as attrs: ... - в attrs можно дописать поля по ходу"""
+        start = time.perf_counter()
+        try:
+            yield attrs
+        finally:
+            self.add(name, time.perf_counter() - start, start - self._t0, **attrs)
+
+    def add(self, name, duration, start=None, **attrs):
+        record = {"name": name, "start_s": round(start, 6) if start is not None else None,
+                  "duration_s": round(duration, 6)}
+        record.update(attrs)
+        with self._lock:
+            self.spans.append(record)
+
+    def extend(self, records):
+        """Спаны, собранные в другом процессе (извлечение в пуле)"""
+        with self._lock:
+            self.spans.extend(records or [])
+
+    def add_ollama_metrics(self, data, start, model):
+        """Раскладывает метрики ответа Ollama на спаны загрузки, промпта и генерации.
+
+        start - смещение начала HTTP-запроса; этапы идут на сервере друг за другом.
+        Возвращает метрики в секундах (пустой словарь, если сервер их не прислал).
+        """
+        if "total_duration" not in data:
+            return {}
+        metrics = {
+            "total_s": data.get("total_duration", 0) / NS,
+            "load_s": data.get("load_duration", 0) / NS,
+            "prompt_eval_s": data.get("prompt_eval_duration", 0) / NS,
+            "prompt_eval_count": data.get("prompt_eval_count", 0),
+            "eval_s": data.get("eval_duration", 0) / NS,
+            "eval_count": data.get("eval_count", 0),
+        }
+        if metrics["load_s"]:
+            self.add(MODEL_LOAD, metrics["load_s"], start, model=model)
+        offset = start + metrics["load_s"]
+        self.add(PROMPT_EVAL, metrics["prompt_eval_s"], offset, model=model,
+                 tokens=metrics["prompt_eval_count"],
+                 tokens_per_s=_rate(metrics["prompt_eval_count"], metrics["prompt_eval_s"]))
+        self.add(GENERATION, metrics["eval_s"], offset + metrics["prompt_eval_s"], model=model,
+                 tokens=metrics["eval_count"],
+                 tokens_per_s=_rate(metrics["eval_count"], metrics["eval_s"]))
+        return metrics
+
+    def totals(self):
+        """Сумма по этапам: {имя: {"count", "duration_s", "tokens"}}"""
+        result = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            total = result.setdefault(span["name"], {"count": 0, "duration_s": 0.0, "tokens": 0})
+            total["count"] += 1
+            total["duration_s"] += span["duration_s"]
+            total["tokens"] += span.get("tokens", 0)
+        for total in result.values():
+            total["duration_s"] = round(total["duration_s"], 6)
+        return result
+
+    def format(self):
+        """Текстовая сводка для интерфейса и отчета"""
+        totals = self.totals()
+        lines = ["ВРЕМЯ ЭТАПОВ:"]
+        for name, label in STAGES:
+            total = totals.get(name)
+            if total is None:
+                continue
+            indent = "    - " if name in SERVER_STAGES else "- "
+            line = f"{indent}{label}: {total['duration_s']:.2f} с"
+            if total["count"] > 1:
+                line += f" ({total['count']} шт.)"
+            if total["tokens"]:
+                line += (f", токенов {total['tokens']}"
+                         f" ({_rate(total['tokens'], total['duration_s']):.1f} ток/с)")
+            lines.append(line)
+        lines.append(f"Всего: {self.elapsed():.2f} с (этапы листов идут параллельно, сумма может быть больше)")
+        return "\n".join(lines)
+
+    def records(self, start=0):
+        with self._lock:
+            spans = self.spans[start:]
+        base = {"trace_id": self.trace_id, "started": round(self.started, 3)}
+        base.update(self.meta)
+        return [dict(base, **span) for span in spans]
+
+    def flush(self, path=DEFAULT_LOG):
+        """Дописывает в JSONL еще не записанные спаны"""
+        with self._lock:
+            start, self._flushed = self._flushed, len(self.spans)
+        records = self.records(start)[:self._flushed - start]
+        if not records:
+            return 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with _write_lock, open(path, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return len(records)
+
+
+class NullTracer(Tracer):
+    """Ничего не записывает (замеры не нужны)"""
+
+    def add(self, name, duration, start=None, **attrs):
+        pass
+
+    def extend(self, records):
+        pass
+
+
+NULL_TRACER = NullTracer()
+
+_write_lock = threading.Lock()
+
+
+def _rate(count, seconds):
+    return round(count / seconds, 1) if seconds > 0 else 0.0
@@ -0,0 +1,265 @@
+"""Локальная заглушка Ollama для бенчмарков и проверки без GPU.
+
+Отвечает на /api/tags, /api/ps, /api/embed и /api/generate (потоково и целиком) в формате
+Ollama, с настраиваемыми задержками загрузки модели, обработки промпта и
+генерации токенов. Общее начало промпта с прошлым запросом той же модели
+заново не обрабатывается, как при переиспользовании KV-кэша. Запуск отдельно:
+    python stub_ollama.py --port 11434 --prompt-delay 0.5 --token-delay 0.02
+"""
+import argparse
+import contextlib
+import json
+import re
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_MODELS = ["llama2:3b", "tinyllama", "qwen:1.8b", "llama3:8b", "llava:7b", "bakllava:7b", "llava:13b",
+                  "nomic-embed-text"]
+EMBED_DIM = 64
+DEFAULT_RESPONSE = """СООТВЕТСТВИЕ: ДА
+ПРОБЛЕМЫ:
+- не обнаружены
+РЕКОМЕНДАЦИИ:
+- проверить простановку размеров на полках линий-выносок"""
+# Ответ на запросы с JSON-схемой (поле format), как у findings.SCHEMA
+DEFAULT_JSON_RESPONSE = json.dumps({
+    "verdict": "ДА",
+    "summary": "Чертеж в целом соответствует требованиям.",
+    "findings": [{"item": "Размеры на полках линий-выносок", "status": "не определено",
+                  "location": "главный вид", "quote": "R5", "gost": "ГОСТ 2.307-2011, п. 4.2",
+                  "severity": "рекомендация",
+                  "recommendation": "проверить простановку размеров на полках линий-выносок"}],
+}, ensure_ascii=False)
+
+
+class StubConfig:
+    """Задержки заглушки, секунды"""
+
+    def __init__(self, models=None, response=DEFAULT_RESPONSE, load_delay=0.0, prompt_delay=0.0,
+                 prompt_delay_per_1k=0.0, token_delay=0.0, image_delay=0.0, prefix_cache=True,
+                 json_response=DEFAULT_JSON_RESPONSE, num_parallel=0):
+        self.models = models or list(DEFAULT_MODELS)
+        self.response = response
+        self.json_response = json_response  # ответ на запросы с format (JSON-схема)
+        self.load_delay = load_delay  # первая загрузка модели
+        self.prompt_delay = prompt_delay  # обработка промпта до первого токена
+        self.prompt_delay_per_1k = prompt_delay_per_1k  # плюс за каждую 1000 символов промпта
+        self.token_delay = token_delay  # на каждый токен ответа
+        self.image_delay = image_delay  # на каждое изображение
+        # Как у Ollama: общее начало с прошлым промптом модели не обрабатывается заново
+        self.prefix_cache = prefix_cache
+        self.num_parallel = num_parallel  # как OLLAMA_NUM_PARALLEL: лишние запросы ждут; 0 - без ограничения
+
+
+def model_size(name):
+    """Правдоподобный размер модели в байтах по числу параметров в имени (llama2:3b)"""
+    match = re.search(r"(\d+(?:\.\d+)?)b\b", name)
+    return int(float(match.group(1)) * 0.6e9) if match else int(0.6e9)
+
+
+def common_prefix(a, b):
+    """Длина общего начала двух строк"""
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, как у настоящего сервера
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": name, "model": name, "size": model_size(name)}
+                                        for name in server.config.models]})
+        elif self.path == "/api/ps":
+            with server.lock:
+                loaded = list(server.loaded)
+            self._send_json({"models": [{"name": name, "model": name} for name in loaded]})
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        server = self.server
+        if self.path not in ("/api/generate", "/api/embed"):
+            self._send_json({"error": "not found"}, 404)
+            return
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        model = payload.get("model", "")
+        if model not in server.config.models:
+            self._send_json({"error": f"model '{model}' not found"}, 404)
+            return
+        if self.path == "/api/embed":
+            inputs = payload.get("input", [])
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            self._send_json({"model": model, "embeddings": [embed_text(text) for text in inputs]})
+            return
+        server.record(payload)
+        with server.slots:
+            self._generate(server, payload, model)
+
+    def _generate(self, server, payload, model):
+        started = time.perf_counter()
+
+        with server.lock:
+            load = model not in server.loaded
+            server.loaded.add(model)
+        load_duration = server.config.load_delay if load else 0.0
+        time.sleep(load_duration)
+
+        prompt = payload.get("prompt", "")
+        if not prompt:
+            # Пустой промпт только загружает модель (прогрев)
+            self._send_json({"model": model, "response": "", "done": True,
+                             "load_duration": int(load_duration * 1e9)})
+            return
+
+        config = server.config
+        system = payload.get("system", "")
+        full_prompt = f"{system}\n\n{prompt}" if system else prompt
+        with server.lock:
+            previous = server.prompt_cache.get(model, "")
+            server.prompt_cache[model] = full_prompt
+        reused = common_prefix(previous, full_prompt) if config.prefix_cache else 0
+        evaluated = len(full_prompt) - reused
+        prompt_duration = (config.prompt_delay + config.prompt_delay_per_1k * evaluated / 1000
+                           + config.image_delay * len(payload.get("images") or []))
+        time.sleep(prompt_duration)
+        response = config.json_response if payload.get("format") else config.response
+        tokens = response.split(" ")
+        tokens = [token + " " for token in tokens[:-1]] + tokens[-1:]
+
+        def metrics():
+            total = time.perf_counter() - started
+            return {"total_duration": int(total * 1e9), "load_duration": int(load_duration * 1e9),
+                    "prompt_eval_count": max(1, evaluated // 3),
+                    "prompt_eval_duration": int(prompt_duration * 1e9),
+                    "eval_count": len(tokens),
+                    "eval_duration": int(config.token_delay * len(tokens) * 1e9)}
+
+        if payload.get("stream", True) is False:
+            time.sleep(config.token_delay * len(tokens))
+            self._send_json(dict({"model": model, "response": response, "done": True}, **metrics()))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for token in tokens:
+                time.sleep(config.token_delay)
+                self._write_chunk({"model": model, "response": token, "done": False})
+            self._write_chunk(dict({"model": model, "response": "", "done": True}, **metrics()))
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            server.cancelled += 1  # клиент оборвал соединение (отмена проверки)
+            self.close_connection = True
+
+    def _write_chunk(self, data):
+        line = json.dumps(data, ensure_ascii=False).encode("utf-8") + b"\n"
+        self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+        self.wfile.flush()
+
+
+def embed_text(text):
+    """Детерминированный эмбеддинг: слова, разложенные хэшем по EMBED_DIM координатам"""
+    vector = [0.0] * EMBED_DIM
+    for word in text.lower().split():
+        vector[zlib.crc32(word[:6].encode("utf-8")) % EMBED_DIM] += 1.0
+    return vector
+
+
+class StubOllamaServer(ThreadingHTTPServer):
+    """Заглушка в фоновом потоке: with StubOllamaServer(config) as server: server.url"""
+
+    daemon_threads = True
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        super().__init__((host, port), _Handler)
+        self.config = config or StubConfig()
+        self.lock = threading.Lock()
+        self.loaded = set()
+        self.prompt_cache = {}  # модель -> последний промпт (имитация KV-кэша Ollama)
+        self.requests = []  # краткие сведения о запросах /api/generate
+        self.cancelled = 0
+        self.slots = (threading.Semaphore(self.config.num_parallel) if self.config.num_parallel
+                      else contextlib.nullcontext())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record(self, payload):
+        with self.lock:
+            self.requests.append({"model": payload.get("model"),
+                                  "prompt_chars": len(payload.get("system", "")) + len(payload.get("prompt", "")),
+                                  "images": len(payload.get("images") or []),
+                                  "stream": payload.get("stream", True)})
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Заглушка сервера Ollama")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--load-delay", type=float, default=0.0, help="Загрузка модели, с")
+    parser.add_argument("--prompt-delay", type=float, default=0.0, help="Обработка промпта, с")
+    parser.add_argument("--prompt-delay-per-1k", type=float, default=0.0,
+                        help="Добавка на 1000 символов промпта, с")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="На токен ответа, с")
+    parser.add_argument("--image-delay", type=float, default=0.0, help="На изображение, с")
+    parser.add_argument("--no-prefix-cache", action="store_true",
+                        help="Обрабатывать каждый промпт целиком (без имитации KV-кэша)")
+    parser.add_argument("--num-parallel", type=int, default=0,
+                        help="Запросов генерации одновременно, как OLLAMA_NUM_PARALLEL (0 - без ограничения)")
+    args = parser.parse_args(argv)
+    config = StubConfig(load_delay=args.load_delay, prompt_delay=args.prompt_delay,
+                        prompt_delay_per_1k=args.prompt_delay_per_1k, token_delay=args.token_delay,
+                        image_delay=args.image_delay, prefix_cache=not args.no_prefix_cache,
+                        num_parallel=args.num_parallel)
+    server = StubOllamaServer(config, args.host, args.port)
+    print(f"Заглушка Ollama: {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+"""Генератор синтетических чертежей в стиле ЕСКД для бенчмарков.
+
+Листы форматов A4-A0 с рамкой, основной надписью (форма 1 на первом листе,
+2а на последующих), техническими требованиями и векторной графикой: контуры
+деталей, размерные линии со стрелками, полки линий-выносок, рамки допусков и
+обозначения баз. Растровый вариант - те же листы, отрендеренные в изображение
+(как скан). Одинаковые параметры и seed дают одинаковый файл.
+
+    python synthetic_drawings.py bench_pdfs --sizes A4 A1 --sheets 1 10 --kinds vector raster
+"""
+import argparse
+import math
+import os
+import random
+import sys
+
+import fitz  # PyMuPDF
+
+from image_pipeline import MM
+
+SHEET_SIZES = {  # мм, ГОСТ 2.301
+    "A4": (210, 297),
+    "A3": (420, 297),
+    "A2": (594, 420),
+    "A1": (841, 594),
+    "A0": (1189, 841),
+}
+FONT = "china-s"  # встроенный шрифт PyMuPDF с кириллицей
+SIGNATURES = [("Разраб.", "Иванов"), ("Пров.", "Петров"), ("Т.контр.", "Сидоров"),
+              ("Н.контр.", "Кузнецов"), ("Утв.", "Смирнов")]
+TECH_REQUIREMENTS = ["ТЕХНИЧЕСКИЕ ТРЕБОВАНИЯ", "1. Размеры для справок.",
+                     "2. Острые кромки притупить.", "3. Неуказанные предельные отклонения размеров: H14, h14, ±IT14/2."]
+
+
+def _text(page, x, y, text, size=7):
+    page.insert_text((x, y), text, fontname=FONT, fontsize=size)
+
+
+def _arrow(shape, tip, direction, length=3 * MM, width=1 * MM):
+    dx, dy = direction
+    norm = math.hypot(dx, dy)
+    dx, dy = dx / norm, dy / norm
+    bx, by = tip[0] - dx * length, tip[1] - dy * length
+    px, py = -dy * width / 2, dx * width / 2
+    shape.draw_polyline([fitz.Point(tip), fitz.Point(bx + px, by + py), fitz.Point(bx - px, by - py)])
+    shape.finish(fill=(0, 0, 0), color=(0, 0, 0), closePath=True)
+
+
+def _draw_title_block(page, sheet, sheets, designation, name, doc_name):
+    rect = page.rect
+    right, bottom = rect.x1 - 5 * MM, rect.y1 - 5 * MM
+    height = 55 * MM if sheet == 0 else 15 * MM
+    x0, y0 = right - 185 * MM, bottom - height
+    shape = page.new_shape()
+    shape.draw_rect(fitz.Rect(x0, y0, right, bottom))
+    for y in range(5, int(height / MM), 5):
+        shape.draw_line(fitz.Point(x0, y0 + y * MM), fitz.Point(x0 + 65 * MM, y0 + y * MM))
+    shape.draw_line(fitz.Point(x0 + 65 * MM, y0), fitz.Point(x0 + 65 * MM, bottom))
+    shape.finish(width=0.5)
+    shape.commit()
+    if sheet == 0:
+        for i, (label, value) in enumerate(SIGNATURES):
+            _text(page, x0 + 1 * MM, y0 + (29 + i * 5) * MM, label)
+            _text(page, x0 + 18 * MM, y0 + (29 + i * 5) * MM, value)
+        _text(page, x0 + 70 * MM, y0 + 12 * MM, designation, 10)
+        _text(page, x0 + 70 * MM, y0 + 35 * MM, name, 9)
+        _text(page, x0 + 70 * MM, y0 + 40 * MM, doc_name)
+        _text(page, x0 + 135 * MM, y0 + 20 * MM, "Масса")
+        _text(page, x0 + 155 * MM, y0 + 20 * MM, "Масштаб")
+        _text(page, x0 + 137 * MM, y0 + 30 * MM, "1,5")
+        _text(page, x0 + 157 * MM, y0 + 30 * MM, "1:2")
+        _text(page, x0 + 140 * MM, y0 + 40 * MM, "Лист 1")
+        _text(page, x0 + 160 * MM, y0 + 40 * MM, f"Листов {sheets}")
+    else:
+        _text(page, x0 + 70 * MM, y0 + 9 * MM, designation, 10)
+        _text(page, x0 + 170 * MM, y0 + 9 * MM, f"Лист {sheet + 1}")
+    return fitz.Rect(x0, y0, right, bottom)
+
+
+def _draw_tech_requirements(page, title_block):
+    y = title_block.y0 - 5 * MM - len(TECH_REQUIREMENTS) * 5 * MM
+    for line in TECH_REQUIREMENTS:
+        _text(page, title_block.x0 + 5 * MM, y, line)
+        y += 5 * MM
+
+
+def _draw_part(page, field, rng):
+    """Вид детали: контур, отверстия, размеры, выноска с полкой, допуск формы и база"""
+    shape = page.new_shape()
+    w = max(rng.uniform(0.3, 0.5) * field.width, 70 * MM)  # рамка допуска и база не пересекаются
+    h = rng.uniform(0.3, 0.5) * field.height
+    x0 = field.x0 + rng.uniform(0.1, 0.3) * field.width
+    y0 = field.y0 + rng.uniform(0.15, 0.3) * field.height
+    part = fitz.Rect(x0, y0, x0 + w, y0 + h)
+    shape.draw_rect(part)
+    for _ in range(rng.randint(2, 6)):
+        radius = rng.uniform(0.03, 0.08) * min(w, h)
+        center = fitz.Point(rng.uniform(part.x0 + radius * 2, part.x1 - radius * 2),
+                            rng.uniform(part.y0 + radius * 2, part.y1 - radius * 2))
+        shape.draw_circle(center, radius)
+    shape.finish(width=1)
+
+    # Горизонтальный размер над деталью
+    y = part.y0 - 10 * MM
+    shape.draw_line(fitz.Point(part.x0, part.y0), fitz.Point(part.x0, y - 2 * MM))
+    shape.draw_line(fitz.Point(part.x1, part.y0), fitz.Point(part.x1, y - 2 * MM))
+    shape.draw_line(fitz.Point(part.x0, y), fitz.Point(part.x1, y))
+    shape.finish(width=0.3)
+    _arrow(shape, (part.x0, y), (-1, 0))
+    _arrow(shape, (part.x1, y), (1, 0))
+    _text(page, (part.x0 + part.x1) / 2, y - 1 * MM, f"{w / MM:.0f}", 9)
+
+    # Вертикальный размер слева
+    x = part.x0 - 10 * MM
+    shape.draw_line(fitz.Point(part.x0, part.y0), fitz.Point(x - 2 * MM, part.y0))
+    shape.draw_line(fitz.Point(part.x0, part.y1), fitz.Point(x - 2 * MM, part.y1))
+    shape.draw_line(fitz.Point(x, part.y0), fitz.Point(x, part.y1))
+    shape.finish(width=0.3)
+    _arrow(shape, (x, part.y0), (0, -1))
+    _arrow(shape, (x, part.y1), (0, 1))
+    page.insert_text((x - 1 * MM, (part.y0 + part.y1) / 2), f"{h / MM:.0f}", fontname=FONT,
+                     fontsize=9, rotate=90)
+
+    # Наклонный размер в зоне 30° с числом на полке линии-выноски
+    angle = math.radians(rng.uniform(95, 115))
+    start = fitz.Point(part.x1 + 15 * MM, part.y1)
+    length = min(40 * MM, h)
+    end = fitz.Point(start.x + length * math.cos(angle), start.y - length * math.sin(angle))
+    shape.draw_line(start, end)
+    middle = (start + end) / 2
+    shelf_y = middle.y - 8 * MM
+    shape.draw_line(middle, fitz.Point(middle.x + 8 * MM, shelf_y))
+    shape.draw_line(fitz.Point(middle.x + 8 * MM, shelf_y), fitz.Point(middle.x + 20 * MM, shelf_y))
+    shape.finish(width=0.3)
+    _arrow(shape, (start.x, start.y), (start.x - end.x, start.y - end.y))
+    _arrow(shape, (end.x, end.y), (end.x - start.x, end.y - start.y))
+    _text(page, middle.x + 9 * MM, shelf_y - 0.5 * MM, f"{length / MM:.0f}", 9)
+
+    # Допуск плоскостности со ссылкой на базу А
+    frame = fitz.Rect(part.x1 - 40 * MM, part.y1 + 15 * MM, part.x1 - 15 * MM, part.y1 + 21 * MM)
+    shape.draw_rect(frame)
+    shape.draw_line(fitz.Point(frame.x0 + 7 * MM, frame.y0), fitz.Point(frame.x0 + 7 * MM, frame.y1))
+    shape.draw_line(fitz.Point(frame.x0 + 19 * MM, frame.y0), fitz.Point(frame.x0 + 19 * MM, frame.y1))
+    leader_x = frame.x0 + 3 * MM
+    shape.draw_line(fitz.Point(leader_x, frame.y0), fitz.Point(leader_x, part.y1))
+    shape.finish(width=0.3)
+    _arrow(shape, (leader_x, part.y1), (0, -1))
+    _text(page, frame.x0 + 1.5 * MM, frame.y1 - 1.5 * MM, "∥", 9)
+    _text(page, frame.x0 + 8 * MM, frame.y1 - 1.5 * MM, "0,05", 9)
+    _text(page, frame.x0 + 20.5 * MM, frame.y1 - 1.5 * MM, "А", 9)
+
+    # Обозначение базы А
+    base = fitz.Rect(part.x0 + 10 * MM, part.y1 + 12 * MM, part.x0 + 16 * MM, part.y1 + 18 * MM)
+    shape.draw_rect(base)
+    shape.draw_line(fitz.Point(base.x0 + 3 * MM, base.y0), fitz.Point(base.x0 + 3 * MM, part.y1 + 3 * MM))
+    shape.finish(width=0.3)
+    shape.draw_polyline([fitz.Point(base.x0, part.y1), fitz.Point(base.x0 + 6 * MM, part.y1),
+                         fitz.Point(base.x0 + 3 * MM, part.y1 + 3 * MM)])
+    shape.finish(fill=(0, 0, 0), color=(0, 0, 0), closePath=True)
+    _text(page, base.x0 + 1.5 * MM, base.y1 - 1.5 * MM, "А", 9)
+    shape.commit()
+
+
+def make_drawing(path, size="A3", sheets=1, raster=False, dpi=100, seed=0,
+                 designation="АБВГ.123456.001 СБ", name="Корпус", doc_name="Сборочный чертеж"):
+    """Создает PDF с sheets листами формата size; raster=True - листы изображениями"""
+    width, height = SHEET_SIZES[size]
+    rng = random.Random(f"{seed}/{size}/{sheets}")
+    doc = fitz.open()
+    for sheet in range(sheets):
+        page = doc.new_page(width=width * MM, height=height * MM)
+        frame = fitz.Rect(20 * MM, 5 * MM, page.rect.x1 - 5 * MM, page.rect.y1 - 5 * MM)
+        page.draw_rect(frame, width=1)
+        title_block = _draw_title_block(page, sheet, sheets, designation, name, doc_name)
+        if sheet == 0:
+            _draw_tech_requirements(page, title_block)
+        # Поле изображения над техническими требованиями и основной надписью
+        field = fitz.Rect(frame.x0 + 15 * MM, frame.y0 + 15 * MM, frame.x1 - 15 * MM,
+                          title_block.y0 - 40 * MM)
+        _draw_part(page, field, rng)
+
+    if raster:
+        scan = fitz.open()
+        for page in doc:
+            pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+            scan_page = scan.new_page(width=page.rect.width, height=page.rect.height)
+            scan_page.insert_image(scan_page.rect, stream=pix.tobytes("png"))
+        doc.close()
+        doc = scan
+    doc.save(path, deflate=True)
+    doc.close()
+    return path
+
+
+def drawing_name(size, sheets, kind):
+    return f"{size}_{sheets}sheets_{kind}.pdf"
+
+
+def make_set(out_dir, sizes=("A4", "A3", "A1"), sheet_counts=(1, 10), kinds=("vector", "raster"), seed=0):
+    """Набор чертежей для бенчмарка; уже созданные файлы не пересоздаются"""
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for size in sizes:
+        for sheets in sheet_counts:
+            for kind in kinds:
+                path = os.path.join(out_dir, drawing_name(size, sheets, kind))
+                if not os.path.exists(path):
+                    make_drawing(path, size, sheets, raster=kind == "raster", seed=seed)
+                paths.append((size, sheets, kind, path))
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Синтетические чертежи для бенчмарков")
+    parser.add_argument("out_dir", help="Каталог для PDF")
+    parser.add_argument("--sizes", nargs="+", default=["A4", "A3", "A1"], choices=sorted(SHEET_SIZES))
+    parser.add_argument("--sheets", nargs="+", type=int, default=[1, 10], help="Число листов (1-50)")
+    parser.add_argument("--kinds", nargs="+", default=["vector", "raster"], choices=["vector", "raster"])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    for size, sheets, kind, path in make_set(args.out_dir, args.sizes, args.sheets, args.kinds, args.seed):
+        print(path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,345 @@
+"""Детерминированная проверка основной надписи по координатам текста.
+
+Правила работают по спанам page.get_text("dict") и решают пункты, которые
+не требуют нейросети: заполненность граф основной надписи, соответствие кода
+документа наименованию и ширину технических требований. Графику листа
+проверяет geometry по векторным путям. Пункты, которые правила решить не
+смогли, остаются для Ollama.
+"""
+import re
+
+import fitz  # PyMuPDF
+
+import geometry
+from image_pipeline import MM, find_title_block, find_tech_requirements
+from rule_result import FAIL, OK, UNDECIDED, RuleResult  # engine берет их отсюда
+
+# Увеличивать при изменении правил: от версии зависит ключ кэша результатов
+RULES_VERSION = "4"
+
+GOST_TITLE_BLOCK = "ГОСТ 2.104-2006"
+GOST_DOC_CODES = "ГОСТ 2.102-2013"
+GOST_TECH_REQ = "ГОСТ 2.316-2008"
+
+# Подписи: значение (фамилия) в той же строке правее метки
+SIGNATURE_FIELDS = [
+    ("разраб", "Разраб."),
+    ("пров", "Пров."),
+    ("тконтр", "Т.контр."),
+    ("нконтр", "Н.контр."),
+    ("утв", "Утв."),
+]
+# Реквизиты: значение под меткой (масса, масштаб) или правее нее (лист, листов)
+REQUISITE_FIELDS = [
+    ("масса", "Масса", "below"),
+    ("масштаб", "Масштаб", "below"),
+    ("лист", "Лист", "right"),
+    ("листов", "Листов", "right"),
+]
+
+DOC_CODE_NAMES = {
+    "СБ": "сборочный чертеж",
+    "ВО": "чертеж общего вида",
+    "ГЧ": "габаритный чертеж",
+    "МЧ": "монтажный чертеж",
+}
+DESIGNATION = re.compile(r"([А-ЯA-Z]{2,6}\.\d{6}\.\d{3}(?:-\d{2,3})?)(?:\s*(СБ|ВО|ГЧ|МЧ)\b)?")
+TECH_REQ_MAX_WIDTH_MM = 185
+
+# Какие пункты критериев закрывают правила (идентификаторы критериев промпта)
+CRITERIA_RULES = {
+    "signatures": [label for _, label in SIGNATURE_FIELDS],
+    "title_block": [label for _, label, _ in REQUISITE_FIELDS] + ["Обозначение документа",
+                                                                  "Наименование изделия"],
+    "doc_code": ["Код документа"],
+    "tech_requirements": ["Технические требования"],
+    # Пункты графики, которые проверяются по векторам на каждом листе. Положение видов
+    # и знаки Ra (критерий "views") правила не проверяют - их всегда смотрит модель
+    "graphics": geometry.ITEMS,
+}
+# Критерии основной надписи: на последующих листах (форма 2а) закрыты формой листа
+TITLE_CRITERIA = {"signatures", "title_block", "doc_code", "tech_requirements"}
+
+
+class RuleReport:
+    """Результаты правил по документу"""
+
+    def __init__(self, first_sheet=True):
+        self.results = []
+        self.first_sheet = first_sheet
+
+    def add(self, result):
+        self.results.append(result)
+
+    def for_page(self, page_num):
+        """Результаты одного листа - для постраничной проверки"""
+        report = RuleReport(first_sheet=page_num == 0)
+        report.results = [r for r in self.results if r.page_num == page_num]
+        return report
+
+    def status(self, item):
+        statuses = {r.status for r in self.results if r.item == item}
+        if not statuses or UNDECIDED in statuses:
+            return UNDECIDED
+        return FAIL if FAIL in statuses else OK
+
+    def decided_criteria(self):
+        """Идентификаторы критериев, полностью решенных правилами"""
+        decided = {criterion for criterion, items in CRITERIA_RULES.items()
+                   if all(self.status(item) != UNDECIDED for item in items)}
+        if not self.first_sheet:
+            # На последующих листах (форма 2а) подписей, кода и технических требований нет
+            decided |= TITLE_CRITERIA
+        return decided
+
+    def decided(self):
+        return [r for r in self.results if r.status != UNDECIDED]
+
+    def format(self):
+        if not self.decided():
+            return ""
+        lines = ["АВТОМАТИЧЕСКАЯ ПРОВЕРКА ПРАВИЛАМИ:"]
+        lines.extend(r.format() for r in self.decided())
+        return "\n".join(lines)
+
+    def prompt_facts(self):
+        """Краткая сводка решенных пунктов для промпта (модель их не перепроверяет)"""
+        items = list(dict.fromkeys(r.item for r in self.decided()))
+        failed = [item for item in items if self.status(item) == FAIL]
+        lines = [f"- {item}: НЕ соответствует" for item in failed]
+        passed = len(items) - len(failed)
+        if passed:
+            lines.append(f"- остальные проверенные пункты ({passed}): соответствуют")
+        return "\n".join(lines)
+
+
+def page_spans(page):
+    """Спаны страницы: (fitz.Rect, текст)"""
+    spans = []
+    for block in page.get_text("dict")["blocks"]:
+        for line in block.get("lines", []):
+            for span in line["spans"]:
+                text = span["text"].strip()
+                if text:
+                    spans.append((fitz.Rect(span["bbox"]), text))
+    return spans
+
+
+def _label_pattern(key):
+    # Между буквами метки допускаются точки и пробелы: "Т.контр.", "Н. контр"
+    letters = r"[.\s]*".join(re.escape(ch) for ch in key)
+    return re.compile(rf"^\s*({letters})(.*)$", re.IGNORECASE | re.DOTALL)
+
+
+def _find_label(spans, key, prefer_rightmost=False):
+    """Спан с меткой графы: (прямоугольник, текст, остаток текста после метки)"""
+    pattern = _label_pattern(key)
+    matches = []
+    for rect, text in spans:
+        match = pattern.match(text.replace("ё", "е").replace("Ё", "Е"))
+        if not match:
+            continue
+        rest = match.group(2)
+        # "Листов" не должно находиться по метке "Лист", а "Разраб.Иванов" - должно
+        if rest and rest[0].isalpha():
+            continue
+        matches.append((rect, text, rest.strip(" .:\t")))
+    if not matches:
+        return None
+    if prefer_rightmost:
+        return max(matches, key=lambda item: item[0].x0)
+    return matches[0]
+
+
+def _same_row(rect, other):
+    middle = (other.y0 + other.y1) / 2
+    return rect.y0 - 1 <= middle <= rect.y1 + 1
+
+
+def _value_right(spans, label_rect, rest, max_distance):
+    # Значение может быть в том же спане: "Листов 3"
+    if rest:
+        return rest
+    for rect, text in spans:
+        if rect is label_rect:
+            continue
+        if _same_row(label_rect, rect) and label_rect.x0 + 1 < rect.x0 <= label_rect.x1 + max_distance:
+            return text
+    return None
+
+
+def _value_below(spans, label_rect, max_distance):
+    for rect, text in spans:
+        if rect is label_rect:
+            continue
+        overlaps = rect.x0 < label_rect.x1 + 2 * MM and rect.x1 > label_rect.x0 - 2 * MM
+        if overlaps and label_rect.y1 - 1 <= rect.y0 <= label_rect.y1 + max_distance:
+            return text
+    return None
+
+
+def check_fields(spans, page_num, first_sheet=True, page_count=1):
+    results = []
+    if first_sheet:
+        for key, label in SIGNATURE_FIELDS:
+            found = _find_label(spans, key)
+            if found is None:
+                results.append(RuleResult(label, FAIL, "графа отсутствует", page_num, gost=GOST_TITLE_BLOCK))
+                continue
+            rect, _, rest = found
+            value = _value_right(spans, rect, rest, 45 * MM)
+            if value and any(ch.isalpha() for ch in value):
+                results.append(RuleResult(label, OK, f"заполнено ({value})", page_num, rect))
+            else:
+                results.append(RuleResult(label, FAIL, "не заполнено", page_num, rect, GOST_TITLE_BLOCK))
+
+    for key, label, direction in REQUISITE_FIELDS:
+        if not first_sheet and key != "лист":
+            continue
+        if key == "лист" and page_count == 1:
+            results.append(RuleResult(label, OK, "не заполняется на однолистовом документе", page_num))
+            continue
+        found = _find_label(spans, key, prefer_rightmost=True)
+        if found is None:
+            results.append(RuleResult(label, FAIL, "графа отсутствует", page_num, gost=GOST_TITLE_BLOCK))
+            continue
+        rect, _, rest = found
+        if any(ch.isdigit() for ch in rest):
+            value = rest  # значение в том же спане: "Масштаб 1:2"
+        elif direction == "below":
+            value = _value_below(spans, rect, 12 * MM)
+        else:
+            value = _value_right(spans, rect, rest, 25 * MM)
+        if value and any(ch.isdigit() for ch in value):
+            results.append(RuleResult(label, OK, f"заполнено ({value})", page_num, rect))
+        else:
+            results.append(RuleResult(label, FAIL, "не заполнено", page_num, rect, GOST_TITLE_BLOCK))
+    return results
+
+
+def check_doc_code(spans, page_num):
+    designation = None
+    for rect, text in spans:
+        match = DESIGNATION.search(text)
+        if match:
+            designation = (rect, match)
+            break
+    if designation is None:
+        return [RuleResult("Обозначение документа", UNDECIDED, "не найдено в тексте", page_num),
+                RuleResult("Наименование изделия", UNDECIDED, "нет обозначения", page_num),
+                RuleResult("Код документа", UNDECIDED, "нет обозначения", page_num)]
+
+    rect, match = designation
+    code = match.group(2)
+    results = [RuleResult("Обозначение документа", OK, match.group(0), page_num, rect)]
+
+    # Наименование (графа 1) - под обозначением, в левой части средней колонки
+    labels = [key for key, _ in SIGNATURE_FIELDS] + [key for key, _, _ in REQUISITE_FIELDS]
+    name = None
+    for other, text in spans:
+        below = rect.y1 - 1 <= other.y0 <= rect.y1 + 30 * MM
+        aligned = rect.x0 - 5 * MM <= other.x0 <= rect.x0 + 40 * MM
+        is_label = any(_find_label([(other, text)], key) for key in labels)
+        if below and aligned and not is_label and sum(ch.isalpha() for ch in text) >= 3:
+            name = (other, text)
+            break
+    if name:
+        results.append(RuleResult("Наименование изделия", OK, name[1], page_num, name[0]))
+    else:
+        results.append(RuleResult("Наименование изделия", FAIL, "не заполнено", page_num, rect,
+                                  GOST_TITLE_BLOCK))
+    names = " ".join(text.lower().replace("ё", "е") for _, text in spans)
+    named_types = [c for c, name in DOC_CODE_NAMES.items() if name in names]
+
+    if code:
+        if code in named_types:
+            results.append(RuleResult("Код документа", OK,
+                                      f"{code} соответствует наименованию \"{DOC_CODE_NAMES[code]}\"",
+                                      page_num, rect))
+        elif named_types:
+            other = DOC_CODE_NAMES[named_types[0]]
+            results.append(RuleResult("Код документа", FAIL,
+                                      f"код {code} не соответствует наименованию \"{other}\"",
+                                      page_num, rect, GOST_DOC_CODES))
+        else:
+            results.append(RuleResult("Код документа", FAIL,
+                                      f"код {code}, но нет наименования \"{DOC_CODE_NAMES[code]}\"",
+                                      page_num, rect, GOST_DOC_CODES))
+    elif named_types:
+        expected = named_types[0]
+        results.append(RuleResult("Код документа", FAIL,
+                                  f"наименование \"{DOC_CODE_NAMES[expected]}\", но в обозначении нет кода {expected}",
+                                  page_num, rect, GOST_DOC_CODES))
+    else:
+        results.append(RuleResult("Код документа", OK, "чертеж детали, код не требуется", page_num, rect))
+    return results
+
+
+def check_tech_requirements(page, title_block, page_num):
+    area = find_tech_requirements(page, title_block)
+    if area is None:
+        # Требования могут стоять не над основной надписью - это нарушение расположения
+        for x0, y0, x1, y1, text, *_ in page.get_text("blocks"):
+            if "технические требования" in text.lower():
+                return [RuleResult("Технические требования", FAIL, "расположены не над основной надписью",
+                                   page_num, (x0, y0, x1, y1), GOST_TECH_REQ)]
+        return [RuleResult("Технические требования", OK, "на листе отсутствуют", page_num)]
+    width_mm = (area.width - 4 * MM) / MM  # find_tech_requirements добавляет поля по 2 мм
+    if width_mm > TECH_REQ_MAX_WIDTH_MM + 1:
+        return [RuleResult("Технические требования", FAIL,
+                           f"ширина {width_mm:.0f} мм больше {TECH_REQ_MAX_WIDTH_MM} мм",
+                           page_num, area, GOST_TECH_REQ)]
+    return [RuleResult("Технические требования", OK,
+                       f"над основной надписью, ширина {width_mm:.0f} мм", page_num, area)]
+
+
+def check_page(page, page_num, first_sheet=True, page_count=1):
+    spans = page_spans(page)
+    words = page.get_text("words")
+    title_block = find_title_block(page, words)
+    graphics = geometry.check_page(page, page_num, words, title_block)
+    # Графы основной надписи ищем только в ее области (с запасом на дополнительные графы)
+    block_spans = [(rect, text) for rect, text in spans
+                   if rect.intersects(title_block + (-20 * MM, -20 * MM, 0, 0))]
+    if not block_spans:
+        # Текст не извлекается (скан или текст кривыми) - решать должна модель
+        if first_sheet:
+            labels = [label for criterion, items in CRITERIA_RULES.items()
+                      if criterion in TITLE_CRITERIA for label in items]
+        else:
+            labels = ["Лист"]
+        return [RuleResult(label, UNDECIDED, "текст основной надписи не найден", page_num)
+                for label in labels] + graphics
+
+    results = check_fields(block_spans, page_num, first_sheet, page_count)
+    if first_sheet:
+        results.extend(check_doc_code(block_spans, page_num))
+        results.extend(check_tech_requirements(page, title_block, page_num))
+    return results + graphics
+
+
+def check_document(session, max_pages=3, pages=None):
+    """Проверяет основные надписи листов; первый лист - по форме 1, остальные - 2а.
+
+    pages - номера листов для проверки (по умолчанию первые max_pages).
+    """
+    report = RuleReport()
+    if pages is None:
+        count = session.page_count if max_pages is None else min(session.page_count, max_pages)
+        pages = range(count)
+    for page_num in pages:
+        for result in check_page(session.page(page_num), page_num, first_sheet=page_num == 0,
+                                 page_count=session.page_count):
+            report.add(result)
+    return report
+
+
+def document_designation(session):
+    """Обозначение документа с кодом ("АБВГ.123456.001 СБ") из текста первого листа или None"""
+    if not session.page_count:
+        return None
+    for block in session.page_blocks(0):
+        match = DESIGNATION.search(block)
+        if match:
+            return " ".join(part for part in match.groups() if part)
+    return None
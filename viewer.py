@@ -0,0 +1,356 @@
+"""Предпросмотр чертежа: миниатюры всех листов и просмотр листа плитками с масштабом.
+
+Рендеринг идет в фоновом потоке (RenderWorker), интерфейс получает готовые
+растры через очередь и подставляет их по мере готовности, поэтому большой
+файл открывается сразу. Миниатюры рендерятся матрицей под нужный размер, без
+масштабирования PIL. В просмотре рендерятся только видимые плитки листа при
+текущем масштабе; готовые плитки лежат в кэше с ограничением по объему.
+"""
+import math
+import queue
+import threading
+import tkinter as tk
+from collections import OrderedDict, deque
+
+import fitz  # PyMuPDF
+from PIL import Image, ImageTk
+
+THUMB_SIZE = (96, 68)  # место под миниатюру, пикселей
+TILE = 256  # сторона плитки, пикселей
+ZOOM_STEP = 1.25
+MAX_ZOOM = 8.0  # 576 dpi
+DEFAULT_TILE_CACHE_BYTES = 64 * 1024 * 1024
+POLL_MS = 30
+
+
+def fit_zoom(rect, width, height):
+    """Пикселей на пункт, чтобы лист целиком поместился в width x height"""
+    return min(width / rect.width, height / rect.height)
+
+
+def pixmap_image(pix):
+    return Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+
+
+class RenderWorker:
+    """Фоновый поток рендеринга: видимые плитки раньше миниатюр.
+
+    Задания - функции без аргументов, возвращающие PIL.Image; результат
+    (ключ, изображение) попадает в очередь results, интерфейс забирает его
+    в своем потоке. Плитки берутся с конца (последние запрошенные видны
+    сейчас), миниатюры - по порядку листов.
+    """
+
+    def __init__(self):
+        self.results = queue.Queue()
+        self._urgent = deque()
+        self._background = deque()
+        self._cond = threading.Condition()
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def submit(self, key, render, urgent=False):
+        with self._cond:
+            if urgent:
+                self._urgent.append((key, render))
+            else:
+                self._background.append((key, render))
+            self._cond.notify()
+
+    def clear(self, urgent=True, background=False):
+        """Снимает еще не начатые задания (сменился лист или масштаб)"""
+        with self._cond:
+            if urgent:
+                self._urgent.clear()
+            if background:
+                self._background.clear()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._urgent and not self._background:
+                    self._cond.wait()
+                key, render = self._urgent.pop() if self._urgent else self._background.popleft()
+            try:
+                image = render()
+            except Exception:
+                image = None  # документ закрыли, пока задание ждало очереди
+            self.results.put((key, image))
+
+
+class TileCache:
+    """LRU готовых изображений (PhotoImage) с ограничением по объему пикселей"""
+
+    def __init__(self, max_bytes=DEFAULT_TILE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key):
+        image = self._items.get(key)
+        if image is not None:
+            self._items.move_to_end(key)
+        return image
+
+    def put(self, key, image):
+        if key in self._items:
+            self._bytes -= self._size(self._items.pop(key))
+        self._items[key] = image
+        self._bytes += self._size(image)
+        while self._bytes > self.max_bytes and len(self._items) > 1:
+            _, old = self._items.popitem(last=False)
+            self._bytes -= self._size(old)
+
+    def clear(self):
+        self._items.clear()
+        self._bytes = 0
+
+    @staticmethod
+    def _size(image):
+        return image.width() * image.height() * 3
+
+
+class PreviewPanel(tk.Frame):
+    """Полоса миниатюр слева и просмотр выбранного листа плитками справа.
+
+    Колесо мыши прокручивает лист, Ctrl+колесо и кнопки меняют масштаб,
+    клик по миниатюре открывает лист.
+    """
+
+    def __init__(self, master, width=480, height=300, tile_cache_bytes=DEFAULT_TILE_CACHE_BYTES):
+        super().__init__(master)
+        self.worker = RenderWorker()
+        self.tiles = TileCache(tile_cache_bytes)
+        self.session = None
+        self.page_num = 0
+        self._rect = None  # размер текущего листа; None - его еще узнает рендерер
+        self.zoom = 1.0
+        self._generation = 0  # растет при смене документа: старые результаты отбрасываются
+        self._thumbs = {}
+        self._shown = {}  # ключ видимой плитки -> (элемент холста, изображение)
+        self._pending = set()
+        self._update_scheduled = False
+
+        thumb_w, thumb_h = THUMB_SIZE
+        self.thumb_canvas = tk.Canvas(self, width=thumb_w + 8, height=height, bg="gray85")
+        thumb_scroll = tk.Scrollbar(self, orient=tk.VERTICAL, command=self.thumb_canvas.yview)
+        self.thumb_canvas.configure(yscrollcommand=thumb_scroll.set)
+        self.thumb_canvas.grid(row=0, column=0, rowspan=2, sticky="ns")
+        thumb_scroll.grid(row=0, column=1, rowspan=2, sticky="ns")
+
+        self.canvas = tk.Canvas(self, width=width, height=height, bg="gray70")
+        xscroll = tk.Scrollbar(self, orient=tk.HORIZONTAL, command=self._xview)
+        yscroll = tk.Scrollbar(self, orient=tk.VERTICAL, command=self._yview)
+        self.canvas.configure(xscrollcommand=xscroll.set, yscrollcommand=yscroll.set)
+        self.canvas.grid(row=0, column=2, sticky="nsew")
+        yscroll.grid(row=0, column=3, sticky="ns")
+        xscroll.grid(row=1, column=2, sticky="ew")
+
+        controls = tk.Frame(self)
+        controls.grid(row=2, column=2, sticky="w")
+        tk.Button(controls, text="−", width=2, command=lambda: self.zoom_by(1 / ZOOM_STEP)).pack(side=tk.LEFT)
+        tk.Button(controls, text="+", width=2, command=lambda: self.zoom_by(ZOOM_STEP)).pack(side=tk.LEFT)
+        tk.Button(controls, text="По размеру", command=self.zoom_fit).pack(side=tk.LEFT, padx=5)
+        self.info_label = tk.Label(controls, text="")
+        self.info_label.pack(side=tk.LEFT, padx=5)
+
+        self.canvas.bind("<Configure>", lambda event: self._schedule_update())
+        self.canvas.bind("<MouseWheel>", self._on_wheel)
+        self.canvas.bind("<Button-4>", self._on_wheel)
+        self.canvas.bind("<Button-5>", self._on_wheel)
+        self.canvas.bind("<ButtonPress-1>", lambda event: self.canvas.scan_mark(event.x, event.y))
+        self.canvas.bind("<B1-Motion>", self._on_drag)
+        self.thumb_canvas.bind("<Button-1>", self._on_thumb_click)
+        self.after(POLL_MS, self._poll)
+
+    # Документ и миниатюры
+
+    def show_document(self, session):
+        """Показывает документ: первый лист сразу по размеру окна, миниатюры - в фоне"""
+        self._generation += 1
+        self.worker.clear(urgent=True, background=True)
+        self.session = session
+        self.tiles.clear()
+        self._pending.clear()
+        self._thumbs.clear()
+        self.thumb_canvas.delete("all")
+        thumb_w, thumb_h = THUMB_SIZE
+        for page_num in range(session.page_count):
+            y = page_num * (thumb_h + 8) + 4
+            self.thumb_canvas.create_rectangle(4, y, 4 + thumb_w, y + thumb_h, fill="white", outline="")
+            self.thumb_canvas.create_text(8, y + 4, anchor=tk.NW, text=str(page_num + 1),
+                                          fill="gray40", tags="label")
+            self.thumb_canvas.create_rectangle(4, y, 4 + thumb_w, y + thumb_h, outline="gray60",
+                                               tags=("frame", f"frame{page_num}"))
+            self.worker.submit(("thumb", self._generation, page_num),
+                               self._thumb_renderer(session, page_num))
+        self.thumb_canvas.configure(scrollregion=(0, 0, thumb_w + 8, session.page_count * (thumb_h + 8)))
+        self.show_page(0)
+
+    def _thumb_renderer(self, session, page_num):
+        def render():
+            zoom = fit_zoom(session.page_rect(page_num), *THUMB_SIZE)
+            return pixmap_image(session.render(page_num, zoom))
+        return render
+
+    def _on_thumb_click(self, event):
+        if self.session is None:
+            return
+        page_num = int(self.thumb_canvas.canvasy(event.y) // (THUMB_SIZE[1] + 8))
+        if 0 <= page_num < self.session.page_count:
+            self.show_page(page_num)
+
+    # Просмотр листа плитками
+
+    def show_page(self, page_num):
+        self.page_num = page_num
+        self.thumb_canvas.itemconfigure("frame", outline="gray60", width=1)
+        self.thumb_canvas.itemconfigure(f"frame{page_num}", outline="red", width=2)
+        self._rect = self.session.known_page_rect(page_num)
+        if self._rect is None:
+            # Документ может быть занят проверкой: размер листа узнает рендерер, лист покажет _poll
+            self.canvas.delete("tile")
+            self._shown.clear()
+            session = self.session
+            self.worker.submit(("rect", self._generation, page_num), lambda: session.page_rect(page_num),
+                               urgent=True)
+            return
+        self.zoom_fit()
+
+    def zoom_fit(self):
+        if self.session is None or self._rect is None:
+            return
+        self.update_idletasks()
+        width = max(self.canvas.winfo_width(), int(self.canvas["width"])) - 4
+        height = max(self.canvas.winfo_height(), int(self.canvas["height"])) - 4
+        self.set_zoom(fit_zoom(self._rect, width, height), snap=math.floor)
+
+    def zoom_by(self, factor):
+        self.set_zoom(self.zoom * factor)
+
+    def set_zoom(self, zoom, snap=round):
+        if self.session is None or self._rect is None:
+            return
+        # Уровни масштаба квантуются, чтобы плитки прошлых масштабов находились в кэше
+        zoom = min(MAX_ZOOM, max(0.05, zoom))
+        zoom = ZOOM_STEP ** snap(math.log(zoom, ZOOM_STEP))
+        # Центр видимой области остается на месте
+        rect = self._rect
+        cx, cy = self._view_center()
+        scale = zoom / self.zoom
+        self.zoom = zoom
+        self.worker.clear(urgent=True)
+        self._pending = {key for key in self._pending if key[0] == "thumb"}
+        self.canvas.delete("tile")
+        self._shown.clear()
+        width, height = rect.width * zoom, rect.height * zoom
+        self.canvas.configure(scrollregion=(0, 0, width, height))
+        self.canvas.xview_moveto(max(0.0, (cx * scale - self.canvas.winfo_width() / 2) / width))
+        self.canvas.yview_moveto(max(0.0, (cy * scale - self.canvas.winfo_height() / 2) / height))
+        self.info_label.config(text=f"Лист {self.page_num + 1} из {self.session.page_count}, "
+                                    f"{round(zoom * 72)} dpi")
+        self._schedule_update()
+
+    def _view_center(self):
+        return (self.canvas.canvasx(self.canvas.winfo_width() / 2),
+                self.canvas.canvasy(self.canvas.winfo_height() / 2))
+
+    def _xview(self, *args):
+        self.canvas.xview(*args)
+        self._schedule_update()
+
+    def _yview(self, *args):
+        self.canvas.yview(*args)
+        self._schedule_update()
+
+    def _on_drag(self, event):
+        self.canvas.scan_dragto(event.x, event.y, gain=1)
+        self._schedule_update()
+
+    def _on_wheel(self, event):
+        delta = event.delta if event.delta else (120 if event.num == 4 else -120)
+        if event.state & 0x4:  # Ctrl - масштаб
+            self.zoom_by(ZOOM_STEP if delta > 0 else 1 / ZOOM_STEP)
+        else:
+            self.canvas.yview_scroll(-1 if delta > 0 else 1, "units")
+            self._schedule_update()
+
+    def _schedule_update(self):
+        if not self._update_scheduled:
+            self._update_scheduled = True
+            self.after_idle(self._update_tiles)
+
+    def _update_tiles(self):
+        """Показывает видимые плитки: готовые из кэша, остальные заказывает рендереру"""
+        self._update_scheduled = False
+        if self.session is None or self._rect is None:
+            return
+        rect = self._rect
+        left, top = self.canvas.canvasx(0), self.canvas.canvasy(0)
+        right = left + self.canvas.winfo_width()
+        bottom = top + self.canvas.winfo_height()
+        cols = math.ceil(rect.width * self.zoom / TILE)
+        rows = math.ceil(rect.height * self.zoom / TILE)
+        visible = {("tile", self._generation, self.page_num, self.zoom, tx, ty)
+                   for ty in range(max(0, int(top // TILE)), min(rows, int(bottom // TILE) + 1))
+                   for tx in range(max(0, int(left // TILE)), min(cols, int(right // TILE) + 1))}
+        # Ушедшие из окна плитки снимаются с холста: их изображения держит только TileCache
+        for key in [key for key in self._shown if key not in visible]:
+            self.canvas.delete(self._shown.pop(key)[0])
+        for key in visible:
+            tx, ty = key[4], key[5]
+            if key in self._shown:
+                continue
+            image = self.tiles.get(key)
+            if image is not None:
+                self._place_tile(key, image)
+            elif key not in self._pending:
+                self._pending.add(key)
+                self.worker.submit(key, self._tile_renderer(self.session, self.page_num,
+                                                            self.zoom, tx, ty), urgent=True)
+
+    def _tile_renderer(self, session, page_num, zoom, tx, ty):
+        def render():
+            rect = session.page_rect(page_num)
+            clip = fitz.Rect(rect.x0 + tx * TILE / zoom, rect.y0 + ty * TILE / zoom,
+                             rect.x0 + (tx + 1) * TILE / zoom, rect.y0 + (ty + 1) * TILE / zoom) & rect
+            return pixmap_image(session.render(page_num, zoom, clip))
+        return render
+
+    def _place_tile(self, key, image):
+        tx, ty = key[4], key[5]
+        item = self.canvas.create_image(tx * TILE, ty * TILE, anchor=tk.NW, image=image, tags="tile")
+        self._shown[key] = (item, image)
+
+    # Результаты рендерера
+
+    def _poll(self):
+        try:
+            while True:
+                key, image = self.worker.results.get_nowait()
+                self._pending.discard(key)
+                if image is None or key[1] != self._generation:
+                    continue
+                if key[0] == "rect":
+                    if key[2] == self.page_num and self._rect is None:
+                        self._rect = image
+                        self.zoom_fit()
+                    continue
+                photo = ImageTk.PhotoImage(image)
+                if key[0] == "thumb":
+                    self._place_thumb(key[2], photo)
+                else:
+                    self.tiles.put(key, photo)
+                    if key[2] == self.page_num and key[3] == self.zoom and key not in self._shown:
+                        self._place_tile(key, photo)
+        except queue.Empty:
+            pass
+        self.after(POLL_MS, self._poll)
+
+    def _place_thumb(self, page_num, photo):
+        thumb_w, thumb_h = THUMB_SIZE
+        self._thumbs[page_num] = photo  # ссылка, иначе Tk удалит изображение
+        y = page_num * (thumb_h + 8) + 4
+        self.thumb_canvas.create_image(4 + (thumb_w - photo.width()) // 2, y + (thumb_h - photo.height()) // 2,
+                                       anchor=tk.NW, image=photo)
+        self.thumb_canvas.tag_raise("label")
+        self.thumb_canvas.tag_raise("frame")